@@ -1,24 +1,44 @@
 # app.py - Sistema de Gestión de Agua Potable
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify, g, Response
 import mysql.connector
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from datetime import datetime, date
 from config import Config
-
-# Importaciones para generar PDFs
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch, cm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from reportlab.pdfgen import canvas
-import io
+from conexion import obtener_conexion
+from cache import CacheLRU, CacheArchivos, version_actual, incrementar_version, forzar_relectura
+from lecturas import (obtener_ultima_lectura, refrescar_ultima_lectura, sellar_ultimas_lecturas,
+                      leer_archivo_lecturas, importar_lecturas, COLUMNAS_IMPORTACION)
+from consumo import refrescar_consumo_mensual, consumo_por_mes, inicio_mes
+from busqueda import indice_clientes, registrar_cambio_cliente
+from facturacion import calcular_factura, tarifa_vigente
+from listas import LISTADOS, FACTURAS_PENDIENTES, CLIENTES_SECTOR, fecha_iso, valor_json
+from pagos import facturas_pendientes_cliente, registrar_pago as registrar_pago_factura, registrar_pago_grupo, obtener_pago_grupo
+from reportes_pdf import generar_recibo_pdf, generar_recibo_grupo_pdf
+from renderizado_pdf import renderizar
+from reportes import REPORTES
+from estado_cuenta import cargar_estado_cuenta
+from exportaciones import (EXPORTACIONES, FORMATOS, generar as generar_exportacion, cerrar as cerrar_exportacion,
+                           nombre_archivo as nombre_exportacion)
+from avisos import generar_avisos
+from trabajos import tipo_trabajo, encolar, obtener_trabajo, despachador, ESTADO_TERMINADO as TRABAJO_TERMINADO
+from refacturacion import (iniciar_refacturacion, ejecutar_refacturacion, cancelar_refacturacion,
+                           obtener_refacturacion, listar_refacturaciones, ESTADO_EN_CURSO)
+
+import os
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# Permisos por usuario compartidos entre peticiones del worker: {id_usuario: (version, permisos)}
+cache_permisos = CacheLRU(max_entradas=Config.PERMISOS_CACHE_MAX, ttl=Config.PERMISOS_CACHE_TTL)
+
+# Recibos PDF ya generados, compartidos por los workers (un pago no cambia una vez registrado)
+cache_recibos = CacheArchivos(Config.RECIBOS_CACHE_DIR, Config.RECIBOS_CACHE_MAX_MB * 1024 * 1024, extension='.pdf')
+
+# Incrementar al cambiar el diseño de los recibos para no servir los guardados
+RECIBO_PLANTILLA = 2
+
 # Procesador de contexto para inyectar datetime en templates
 @app.context_processor
 def inject_now():
@@ -37,8 +57,8 @@ def inject_permisos():
         
         user_id = session.get('user_id')
         
-        # Verificar siempre en la BD para asegurar que los permisos estén actualizados
-        # Esto es importante porque los permisos pueden cambiar mientras el usuario está logueado
+        # Los permisos se leen de la BD una vez por petición (cargar_permisos_usuario),
+        # así que los cambios hechos mientras el usuario está logueado se respetan
         try:
             return tiene_permiso(user_id, codigo_permiso)
         except Exception as e:
@@ -50,69 +70,147 @@ def inject_permisos():
 
 # --- Funciones de Conexión a la Base de Datos ---
 def get_db_connection():
+    """Obtiene una conexión del pool del worker (conn.close() la devuelve al pool)"""
     try:
-        conn = mysql.connector.connect(
-            host=app.config['DB_HOST'],
-            port=app.config['DB_PORT'],        
-            user=app.config['DB_USER'],         
-            password=app.config['DB_PASSWORD'], 
-            database=app.config['DB_NAME']
-        )
+        conn = obtener_conexion()
         return conn
     except mysql.connector.Error as err:
         print(f"Error al conectar a MySQL: {err}")
         flash("Error de conexión a la base de datos.", "danger")
         return None
 
+def get_db():
+    """
+    Conexión de la petición actual.
+
+    Se obtiene del pool la primera vez que se usa y se guarda en flask.g, de modo
+    que los decoradores, las vistas y los procesadores de contexto comparten una
+    sola conexión por petición. Las vistas que escriben confirman con
+    conn.commit() (o marcan g.confirmar = True); lo que quede sin confirmar se
+    revierte y la conexión se devuelve al pool en cerrar_db().
+    """
+    if 'db' not in g:
+        conn = get_db_connection()
+        if conn is None:
+            return None
+        g.db = conn
+    return g.db
+
+@app.before_request
+def iniciar_despachador():
+    """Arranca el despachador de trabajos de este proceso (no hace nada si ya corre)"""
+    despachador.iniciar()
+
+@app.teardown_appcontext
+def cerrar_db(exc):
+    """
+    Revierte lo que la petición dejó sin confirmar y devuelve la conexión al
+    pool. Solo confirma si la vista marcó g.confirmar y no hubo excepción:
+    una vista que atrapa un mysql.connector.Error y muestra un mensaje no
+    debe confirmar lo que se ejecutó antes del error.
+    """
+    confirmar = g.pop('confirmar', False)
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+
+    try:
+        if exc is None and confirmar:
+            conn.commit()
+        else:
+            conn.rollback()
+    except mysql.connector.Error as err:
+        print(f"ERROR al finalizar la transacción de la petición: {err}")
+    finally:
+        try:
+            conn.close()
+        except mysql.connector.Error as err:
+            print(f"ERROR al devolver la conexión al pool: {err}")
+
 # --- Funciones de Gestión de Permisos ---
+def cargar_permisos_usuario(id_usuario):
+    """
+    Carga el conjunto de permisos activos de un usuario con una sola consulta.
+
+    El resultado se guarda en flask.g durante la petición, de modo que los
+    decoradores, las vistas y las plantillas consultan el mismo conjunto en
+    memoria. Entre peticiones se reutiliza desde cache_permisos mientras no
+    cambie la versión 'permisos' de version_cache. Devuelve None si el
+    usuario no existe o está inactivo.
+    """
+    permisos_peticion = g.setdefault('permisos_por_usuario', {})
+    if id_usuario in permisos_peticion:
+        return permisos_peticion[id_usuario]
+
+    # La versión se lee antes que los permisos: si cambia mientras tanto, la
+    # entrada queda con la versión anterior y se descarta en la próxima verificación
+    version = version_actual(get_db, 'permisos')
+    if version is not None:
+        en_cache = cache_permisos.obtener(id_usuario)
+        if en_cache is not None and en_cache[0] == version:
+            permisos_peticion[id_usuario] = en_cache[1]
+            return en_cache[1]
+
+    conn = get_db()
+    if conn is None:
+        print(f"ERROR cargar_permisos_usuario: No se pudo conectar a la BD")
+        return None
+
+    cursor = conn.cursor(dictionary=True)
+    # Un solo viaje a la BD: estado del usuario y sus permisos activos
+    cursor.execute("""
+        SELECT u.activo, p.codigo_permiso
+        FROM usuario u
+        LEFT JOIN usuario_permiso up ON up.id_usuario = u.id_usuario
+        LEFT JOIN permiso p ON up.id_permiso = p.id_permiso AND p.activo = TRUE
+        WHERE u.id_usuario = %s
+    """, (id_usuario,))
+    filas = cursor.fetchall()
+
+    if not filas or not filas[0]['activo']:
+        print(f"DEBUG cargar_permisos_usuario: Usuario {id_usuario} no encontrado o inactivo")
+        permisos = None
+    else:
+        permisos = frozenset(fila['codigo_permiso'] for fila in filas if fila['codigo_permiso'])
+        print(f"DEBUG cargar_permisos_usuario: Usuario {id_usuario} tiene {len(permisos)} permisos")
+
+    if version is not None:
+        cache_permisos.guardar(id_usuario, (version, permisos))
+    permisos_peticion[id_usuario] = permisos
+    return permisos
+
+def invalidar_cache_permisos(id_usuario):
+    """
+    Descarta los permisos guardados de un usuario en este worker.
+
+    Se llama después de confirmar una transacción que incrementó la versión
+    'permisos'; los demás workers verán el cambio en su próxima lectura de
+    version_cache.
+    """
+    cache_permisos.descartar(id_usuario)
+    forzar_relectura()
+    permisos_peticion = g.get('permisos_por_usuario')
+    if permisos_peticion:
+        permisos_peticion.pop(id_usuario, None)
+
 def tiene_permiso(id_usuario, codigo_permiso):
     """Verifica si un usuario tiene un permiso específico"""
-    conn = get_db_connection()
-    if conn is None:
-        print(f"ERROR tiene_permiso: No se pudo conectar a la BD")
+    if id_usuario is None:
         return False
-    
+
     try:
-        cursor = conn.cursor(dictionary=True)
-        # Verificar que el usuario existe y está activo
-        cursor.execute("SELECT activo FROM usuario WHERE id_usuario = %s", (id_usuario,))
-        usuario = cursor.fetchone()
-        
-        if not usuario or not usuario['activo']:
-            print(f"DEBUG tiene_permiso: Usuario {id_usuario} no encontrado o inactivo")
-            cursor.close()
-            conn.close()
-            return False
-        
-        # Verificar permiso específico - los permisos son la única fuente de control
-        cursor.execute("""
-            SELECT COUNT(*) as tiene_permiso
-            FROM usuario_permiso up
-            JOIN permiso p ON up.id_permiso = p.id_permiso
-            WHERE up.id_usuario = %s 
-            AND p.codigo_permiso = %s
-            AND p.activo = TRUE
-        """, (id_usuario, codigo_permiso))
-        
-        resultado = cursor.fetchone()
-        tiene = resultado['tiene_permiso'] > 0 if resultado else False
-        
-        print(f"DEBUG tiene_permiso: Usuario {id_usuario}, permiso {codigo_permiso}, resultado: {tiene}")
-        
-        cursor.close()
-        conn.close()
-        return tiene
+        # Los permisos son la única fuente de control
+        permisos = cargar_permisos_usuario(id_usuario)
+        return permisos is not None and codigo_permiso in permisos
     except Exception as e:
         print(f"ERROR al verificar permiso: {e}")
         import traceback
         traceback.print_exc()
-        if conn:
-            conn.close()
         return False
 
 def obtener_permisos_usuario(id_usuario):
     """Obtiene todos los permisos de un usuario"""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         print(f"ERROR obtener_permisos_usuario: No se pudo conectar a la BD")
         return []
@@ -125,8 +223,6 @@ def obtener_permisos_usuario(id_usuario):
         
         if not usuario:
             print(f"DEBUG obtener_permisos_usuario: Usuario {id_usuario} no encontrado")
-            cursor.close()
-            conn.close()
             return []
         
         # Obtener permisos asignados - los permisos son la única fuente de control
@@ -139,15 +235,11 @@ def obtener_permisos_usuario(id_usuario):
         permisos = [row['codigo_permiso'] for row in cursor.fetchall()]
         print(f"DEBUG obtener_permisos_usuario: Usuario {id_usuario} tiene {len(permisos)} permisos: {permisos}")
         
-        cursor.close()
-        conn.close()
         return permisos
     except Exception as e:
         print(f"ERROR al obtener permisos: {e}")
         import traceback
         traceback.print_exc()
-        if conn:
-            conn.close()
         return []
 
 # --- Decoradores de Seguridad (R2: Gestión de roles y permisos) ---
@@ -200,43 +292,6 @@ def permiso_required(codigo_permiso):
         return decorated_function
     return decorator
 
-# --- Funciones de Lógica de Negocio ---
-def calcular_factura(consumo):
-    """Calcula el monto total de la factura según el consumo y tarifas."""
-    TARIFA_BASE = 2.00      # Q2 por m³ dentro del límite
-    CARGO_FIJO = 0.00
-    LIMITE_CONSUMO = 25     # m³
-    TARIFA_EXCESO = 4.00    # Q4 por m³ después del límite
-
-    # Si el consumo es negativo (lectura menor), generar crédito
-    if consumo < 0:
-        # El cargo fijo sigue aplicándose, pero se resta el valor del "consumo negativo"
-        consumo_abs = abs(consumo)
-        if consumo_abs <= LIMITE_CONSUMO:
-            descuento = consumo_abs * TARIFA_BASE
-        else:
-            descuento = (LIMITE_CONSUMO * TARIFA_BASE) + ((consumo_abs - LIMITE_CONSUMO) * TARIFA_EXCESO)
-        
-        monto_total = CARGO_FIJO - descuento
-        return round(monto_total, 2)
-    
-    # Si el consumo es 0, solo cobrar el cargo fijo
-    if consumo == 0:
-        return CARGO_FIJO
-    
-    # Consumo positivo normal
-    monto_total = CARGO_FIJO
-
-    if consumo <= LIMITE_CONSUMO:
-        monto_total += consumo * TARIFA_BASE
-    else:
-        monto_total += (LIMITE_CONSUMO * TARIFA_BASE)
-        exceso = consumo - LIMITE_CONSUMO
-        monto_total += exceso * TARIFA_EXCESO
-
-    return round(monto_total, 2)
-
-
 # --- RUTAS DE AUTENTICACIÓN ---
 
 @app.route('/', methods=['GET', 'POST'])
@@ -246,15 +301,13 @@ def login():
         email = request.form['usuario']
         password = request.form['contrasena']
 
-        conn = get_db_connection()
+        conn = get_db()
         if conn is None:
             return redirect(url_for('login'))
 
         cursor = conn.cursor(dictionary=True)
         cursor.execute("SELECT id_usuario, nombre, apellido, rol, contrasena_hash FROM usuario WHERE correo_electronico = %s", (email,))
         user = cursor.fetchone()
-        cursor.close()
-        conn.close()
 
         if user and check_password_hash(user['contrasena_hash'], password):
             session['logged_in'] = True
@@ -288,7 +341,7 @@ def logout():
 def dashboard():
     """Menú Principal de Opciones."""
     # Obtener estadísticas para el dashboard
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None: 
         return render_template('dashboard.html', stats={})
     
@@ -307,9 +360,6 @@ def dashboard():
     cursor.execute("SELECT COUNT(*) as total FROM sector")
     total_sectores = cursor.fetchone()['total']
     
-    cursor.close()
-    conn.close()
-    
     stats = {
         'total_clientes': total_clientes,
         'facturas_pendientes': facturas_pendientes,
@@ -327,7 +377,7 @@ def dashboard():
 @permiso_required('clientes.crear')
 def registrar_cliente():
     """Registrar Nuevo Cliente (R1)."""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None: return redirect(url_for('dashboard'))
 
     cursor = conn.cursor(dictionary=True)
@@ -344,29 +394,21 @@ def registrar_cliente():
                 INSERT INTO cliente (nombre, apellido, id_sector, telefono, no_contador)
                 VALUES (%s, %s, %s, %s, %s)
             """, (nombre, apellido, id_sector, telefono, no_contador))
+            registrar_cambio_cliente(cursor, cursor.lastrowid)
             conn.commit()
+            forzar_relectura()
+            indice_clientes.forzar_sincronizacion()
             flash("Cliente registrado exitosamente.", "success")
             return redirect(url_for('registrar_cliente'))
         except mysql.connector.Error as err:
             flash(f"Error al registrar cliente: {err}", "danger")
             conn.rollback()
 
-    # Listar sectores para el formulario
+    # Listar sectores para el formulario (la tabla de clientes se pide a /api/listas/clientes)
     cursor.execute("SELECT id_sector, nombre_sector FROM sector")
     sectores = cursor.fetchall()
-    
-    # Listar clientes recientes para la tabla
-    cursor.execute("""
-        SELECT c.id_cliente, c.nombre, c.apellido, s.nombre_sector, c.no_contador, c.telefono
-        FROM cliente c JOIN sector s ON c.id_sector = s.id_sector
-        WHERE c.activo = TRUE
-        ORDER BY c.id_cliente DESC LIMIT 10
-    """)
-    clientes_recientes = cursor.fetchall()
 
-    cursor.close()
-    conn.close()
-    return render_template('clientes/registro.html', sectores=sectores, clientes_recientes=clientes_recientes)
+    return render_template('clientes/registro.html', sectores=sectores)
 
 
 @app.route('/api/clientes/<int:id_cliente>', methods=['GET'])
@@ -376,7 +418,7 @@ def obtener_cliente(id_cliente):
     if not tiene_permiso(session.get('user_id'), 'clientes.editar'):
         return jsonify({'error': 'No tienes permiso para esta acción'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         return jsonify({'error': 'Error de conexión'}), 500
     
@@ -389,9 +431,6 @@ def obtener_cliente(id_cliente):
     """, (id_cliente,))
     cliente = cursor.fetchone()
     
-    cursor.close()
-    conn.close()
-    
     if not cliente:
         return jsonify({'error': 'Cliente no encontrado'}), 404
     
@@ -406,7 +445,7 @@ def actualizar_cliente(id_cliente):
         return jsonify({'error': 'No tienes permiso para esta acción'}), 403
     
     data = request.json
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         return jsonify({'error': 'Error de conexión'}), 500
     
@@ -420,16 +459,15 @@ def actualizar_cliente(id_cliente):
             WHERE id_cliente = %s AND activo = TRUE
         """, (data['nombre'], data['apellido'], data['id_sector'], data.get('telefono', ''), 
               data['no_contador'], id_cliente))
+        registrar_cambio_cliente(cursor, id_cliente)
         
         conn.commit()
-        cursor.close()
-        conn.close()
+        forzar_relectura()
+        indice_clientes.forzar_sincronizacion()
         
         return jsonify({'success': True, 'message': 'Cliente actualizado exitosamente'})
     except mysql.connector.Error as err:
         conn.rollback()
-        cursor.close()
-        conn.close()
         return jsonify({'error': str(err)}), 400
 
 
@@ -440,7 +478,7 @@ def obtener_lectura(id_lectura):
     if not tiene_permiso(session.get('user_id'), 'lecturas.editar'):
         return jsonify({'error': 'No tienes permiso para esta acción'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         return jsonify({'error': 'Error de conexión'}), 500
     
@@ -455,9 +493,6 @@ def obtener_lectura(id_lectura):
     """, (id_lectura,))
     lectura = cursor.fetchone()
     
-    cursor.close()
-    conn.close()
-    
     if not lectura:
         return jsonify({'error': 'Lectura no encontrada'}), 404
     
@@ -472,7 +507,7 @@ def actualizar_lectura(id_lectura):
         return jsonify({'error': 'No tienes permiso para esta acción'}), 403
     
     data = request.json
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         return jsonify({'error': 'Error de conexión'}), 500
     
@@ -486,23 +521,33 @@ def actualizar_lectura(id_lectura):
         # El consumo_m3 se calcula automáticamente por la columna GENERATED
         # Pero necesitamos recalcular el monto_total
         consumo = lectura_actual - lectura_anterior
-        monto_total = calcular_factura(consumo)
+        monto_total = calcular_factura(consumo, tarifa_vigente(get_db, fecha_lectura))
         
+        cursor.execute("SELECT id_cliente, fecha_lectura FROM lectura WHERE id_lectura = %s", (id_lectura,))
+        fila = cursor.fetchone()
+        if not fila:
+            return jsonify({'error': 'Lectura no encontrada'}), 404
+        
+        # Como al registrar: primero la última lectura del cliente, después sus lecturas
+        obtener_ultima_lectura(cursor, fila[0], bloquear=True)
         cursor.execute("""
             UPDATE lectura 
             SET fecha_lectura = %s, lectura_anterior = %s, lectura_actual = %s, monto_total = %s
             WHERE id_lectura = %s
         """, (fecha_lectura, lectura_anterior, lectura_actual, monto_total, id_lectura))
         
+        # La edición puede cambiar cuál es la última lectura del cliente
+        refrescar_ultima_lectura(cursor, fila[0])
+        # Se recalculan el mes anterior y el nuevo si la fecha cambió de mes
+        refrescar_consumo_mensual(cursor, [fila[0]], min(fila[1], inicio_mes(fecha_lectura)))
+        sellar_ultimas_lecturas(cursor, [fila[0]])
         conn.commit()
-        cursor.close()
-        conn.close()
+        forzar_relectura()
+        indice_clientes.forzar_sincronizacion()
         
         return jsonify({'success': True, 'message': 'Lectura actualizada exitosamente'})
     except mysql.connector.Error as err:
         conn.rollback()
-        cursor.close()
-        conn.close()
         return jsonify({'error': str(err)}), 400
 
 
@@ -513,34 +558,17 @@ def actualizar_lectura(id_lectura):
 @permiso_required('lecturas.crear')
 def registro_lectura():
     """Registro de Lectura y Facturación (R1, R2, R3, R4)."""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None: return redirect(url_for('dashboard'))
     cursor = conn.cursor(dictionary=True)
-    
-    # Obtener clientes activos
-    cursor.execute("""
-        SELECT c.id_cliente, c.nombre, c.apellido, c.no_contador, s.nombre_sector 
-        FROM cliente c 
-        JOIN sector s ON c.id_sector = s.id_sector
-        WHERE c.activo = TRUE
-        ORDER BY c.nombre, c.apellido
-    """)
-    clientes = cursor.fetchall()
 
     if request.method == 'POST':
         id_cliente = request.form['id_cliente']
         fecha_lectura = request.form['fecha_lectura']
         lectura_actual = float(request.form['lectura_actual'].replace(',', '.'))
         
-        # Obtener la última lectura del cliente
-        cursor.execute("""
-            SELECT lectura_actual 
-            FROM lectura 
-            WHERE id_cliente = %s 
-            ORDER BY fecha_lectura DESC 
-            LIMIT 1
-        """, (id_cliente,))
-        ultima_lectura = cursor.fetchone()
+        # Obtener la última lectura del cliente (bloqueada hasta el commit)
+        ultima_lectura = obtener_ultima_lectura(cursor, id_cliente, bloquear=True)
         
         if ultima_lectura:
             lectura_anterior = float(ultima_lectura['lectura_actual'])
@@ -551,21 +579,24 @@ def registro_lectura():
         
         # YA NO HAY VALIDACIÓN QUE RECHACE CONSUMO NEGATIVO
         
-        monto_total = calcular_factura(consumo)
+        monto_total = calcular_factura(consumo, tarifa_vigente(get_db, fecha_lectura))
 
         try:
             cursor.execute("""
                 INSERT INTO lectura (id_cliente, id_usuario_lector, fecha_lectura, lectura_anterior, lectura_actual, monto_total)
                 VALUES (%s, %s, %s, %s, %s, %s)
             """, (id_cliente, session['user_id'], fecha_lectura, lectura_anterior, lectura_actual, monto_total))
+            refrescar_ultima_lectura(cursor, id_cliente)
+            refrescar_consumo_mensual(cursor, [id_cliente], fecha_lectura)
+            sellar_ultimas_lecturas(cursor, [id_cliente])
             conn.commit()
+            forzar_relectura()
+            indice_clientes.forzar_sincronizacion()
             flash(f"Lectura registrada. Factura generada por Q{monto_total:.2f}.", "success")
         except mysql.connector.Error as err:
             flash(f"Error al registrar lectura: {err}", "danger")
             conn.rollback()
 
-        cursor.close()
-        conn.close()
         return redirect(url_for('registro_lectura'))
 
     # Obtener últimas lecturas registradas - INCLUYE LECTURA_ACTUAL
@@ -579,9 +610,51 @@ def registro_lectura():
     """)
     ultimas_lecturas = cursor.fetchall()
 
-    cursor.close()
-    conn.close()
-    return render_template('procesos/lectura.html', clientes=clientes, ultimas_lecturas=ultimas_lecturas)
+    return render_template('procesos/lectura.html', ultimas_lecturas=ultimas_lecturas)
+
+
+@app.route('/procesos/lectura/importar', methods=['GET', 'POST'])
+@login_required
+@permiso_required('lecturas.crear')
+def importar_lecturas_archivo():
+    """Carga masiva de lecturas desde un archivo CSV o JSON"""
+    resultado = None
+
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            flash("Seleccione un archivo CSV o JSON.", "warning")
+            return redirect(url_for('importar_lecturas_archivo'))
+
+        try:
+            filas = leer_archivo_lecturas(archivo.read(), archivo.filename)
+        except ValueError as err:
+            flash(f"Archivo no válido: {err}", "danger")
+            return redirect(url_for('importar_lecturas_archivo'))
+
+        conn = get_db()
+        if conn is None: return redirect(url_for('dashboard'))
+
+        solo_validar = request.form.get('solo_validar') == '1'
+        try:
+            resultado = importar_lecturas(conn, filas, session['user_id'], solo_validar=solo_validar)
+        except mysql.connector.Error as err:
+            flash(f"Error al importar lecturas: {err}", "danger")
+            return redirect(url_for('importar_lecturas_archivo'))
+
+        if not solo_validar and resultado['insertadas']:
+            forzar_relectura()
+            indice_clientes.forzar_sincronizacion()
+
+        if solo_validar:
+            flash(f"Validación: {resultado['insertadas']} de {resultado['total']} lecturas se pueden importar.", "info")
+        elif resultado['insertadas']:
+            flash(f"{resultado['insertadas']} lecturas registradas. Facturado: Q{resultado['monto_total']:.2f}.", "success")
+        if resultado['errores']:
+            flash(f"{len(resultado['errores'])} filas con errores (ver detalle).", "warning")
+
+    return render_template('procesos/importar_lecturas.html', resultado=resultado,
+                           columnas=COLUMNAS_IMPORTACION)
 
 
 @app.route('/api/buscar-clientes')
@@ -593,133 +666,113 @@ def buscar_clientes():
     if len(query) < 2:
         return jsonify({'clientes': []})
     
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'clientes': []})
-    
-    cursor = conn.cursor(dictionary=True)
-    
-    # Buscar por nombre, apellido o número de contador
-    cursor.execute("""
-        SELECT 
-            c.id_cliente, 
-            c.nombre, 
-            c.apellido, 
-            c.no_contador, 
-            s.nombre_sector,
-            COALESCE(
-                (SELECT lectura_actual 
-                 FROM lectura 
-                 WHERE id_cliente = c.id_cliente 
-                 ORDER BY fecha_lectura DESC 
-                 LIMIT 1), 
-                0
-            ) as ultima_lectura
-        FROM cliente c
-        JOIN sector s ON c.id_sector = s.id_sector
-        WHERE c.activo = TRUE
-        AND (
-            c.nombre LIKE %s 
-            OR c.apellido LIKE %s 
-            OR c.no_contador LIKE %s
-            OR CONCAT(c.nombre, ' ', c.apellido) LIKE %s
-        )
-        ORDER BY c.nombre, c.apellido
-        LIMIT 10
-    """, (f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%'))
-    
-    clientes = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
+    # Buscar por nombre, apellido o número de contador en el índice en memoria
+    # (sin distinguir mayúsculas ni tildes). La BD solo se consulta cuando toca
+    # sincronizar el índice; la última lectura ya viene en cada entrada.
+    indice_clientes.sincronizar(get_db)
+    clientes = indice_clientes.autocompletar(query, limite=10)
     
     # Convertir a formato JSON-friendly
     resultado = []
     for cliente in clientes:
         resultado.append({
-            'id': cliente['id_cliente'],
+            'id': cliente['id'],
             'nombre': cliente['nombre'],
             'apellido': cliente['apellido'],
             'nombre_completo': f"{cliente['nombre']} {cliente['apellido']}",
             'no_contador': cliente['no_contador'],
-            'sector': cliente['nombre_sector'],
-            'ultima_lectura': float(cliente['ultima_lectura'])
+            'sector': cliente['sector'],
+            'ultima_lectura': cliente['ultima_lectura']
         })
     
     return jsonify({'clientes': resultado})
 
 
+@app.route('/api/buscar-clientes/estadisticas')
+@login_required
+def estadisticas_busqueda():
+    """Aciertos y fallos de la cache de autocompletar de este worker"""
+    if not tiene_permiso(session.get('user_id'), 'usuarios.ver'):
+        return jsonify({'error': 'No tienes permiso para esta acción'}), 403
+    return jsonify(indice_clientes.estadisticas())
+
+
 @app.route('/procesos/pago', methods=['GET'])
 @login_required
 @permiso_required('pagos.ver')
 def ver_facturas_pendientes():
-    """Ver facturas pendientes de pago."""
-    conn = get_db_connection()
+    """Ver facturas pendientes de pago (las filas se piden por página a /api/listas/facturas_pendientes)."""
+    conn = get_db()
     if conn is None: return redirect(url_for('dashboard'))
     
     cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT id_sector, nombre_sector FROM sector ORDER BY nombre_sector")
+    sectores = cursor.fetchall()
     
-    # Obtener todas las facturas pendientes
-    cursor.execute("""
-        SELECT l.id_lectura, c.nombre, c.apellido, c.no_contador, s.nombre_sector,
-               l.fecha_lectura, l.consumo_m3, l.monto_total, 
-               DATEDIFF(CURDATE(), l.fecha_lectura) as dias_mora
-        FROM lectura l
-        JOIN cliente c ON l.id_cliente = c.id_cliente
-        JOIN sector s ON c.id_sector = s.id_sector
-        WHERE l.estado_pago = 'PENDIENTE'
-        ORDER BY l.fecha_lectura ASC
-    """)
-    facturas_pendientes = cursor.fetchall()
+    try:
+        resumen = FACTURAS_PENDIENTES.resumen(get_db, {})
+    except mysql.connector.Error as err:
+        flash(f"Error al consultar facturas pendientes: {err}", "danger")
+        resumen = {'cantidad': 0, 'monto': 0.0, 'dias_mora': 0.0}
     
-    cursor.close()
-    conn.close()
+    return render_template('procesos/pago.html', resumen=resumen, sectores=sectores)
+
+
+@app.route('/api/listas/<nombre>')
+@login_required
+def api_listado(nombre):
+    """
+    Página de un listado declarado en listas.py, en el formato de DataTables
+    (serverSide). Además de los parámetros de DataTables acepta los filtros
+    del listado y despues_de (ver Listado.pagina).
+    """
+    listado = LISTADOS.get(nombre)
+    if listado is None:
+        return jsonify({'error': 'Listado no encontrado'}), 404
+    if not tiene_permiso(session.get('user_id'), listado.permiso):
+        return jsonify({'error': 'No tienes permiso para esta acción'}), 403
+    
+    if get_db() is None:
+        return jsonify({'error': 'Error de conexión'}), 500
     
-    return render_template('procesos/pago.html', facturas=facturas_pendientes)
+    try:
+        return jsonify(listado.pagina(get_db, request.args))
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+    except mysql.connector.Error as err:
+        print(f"ERROR api_listado {nombre}: {err}")
+        return jsonify({'draw': request.args.get('draw', 0, type=int), 'error': 'Error al consultar el listado'}), 500
 
 
 @app.route('/procesos/pago/<int:id_lectura>', methods=['POST'])
 @login_required
 def registrar_pago(id_lectura):
     """Registrar Pago de una Factura (R2)."""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None: 
         flash("Error de conexión a la base de datos.", "danger")
         return redirect(url_for('ver_facturas_pendientes'))
     
-    cursor = conn.cursor(dictionary=True)
-
     try:
-        # 1. Obtener información completa de la lectura y cliente
+        id_pago, repetido = registrar_pago_factura(
+            conn, id_lectura, session['user_id'], request.form.get('clave_idempotencia', '')[:64] or None)
+        
+        # Datos de la factura para la confirmación y el recibo
+        cursor = conn.cursor(dictionary=True)
         cursor.execute("""
             SELECT l.*, c.nombre, c.apellido, c.no_contador, s.nombre_sector
             FROM lectura l
             JOIN cliente c ON l.id_cliente = c.id_cliente
             JOIN sector s ON c.id_sector = s.id_sector
-            WHERE l.id_lectura = %s AND l.estado_pago = 'PENDIENTE'
+            WHERE l.id_lectura = %s
         """, (id_lectura,))
         lectura = cursor.fetchone()
+        cursor.close()
         
-        if not lectura:
-            flash("Factura no encontrada o ya pagada.", "warning")
-            cursor.close()
-            conn.close()
-            return redirect(url_for('ver_facturas_pendientes'))
+        if not repetido:
+            forzar_relectura()
         
         monto_factura = lectura['monto_total']
-
-        # 2. Registrar el pago
-        cursor.execute("""
-            INSERT INTO pago (id_lectura, monto_pagado, id_usuario_receptor)
-            VALUES (%s, %s, %s)
-        """, (id_lectura, monto_factura, session['user_id']))
-        
-        id_pago = cursor.lastrowid
-
-        # 3. Marcar la factura como PAGADA (R3)
-        cursor.execute("UPDATE lectura SET estado_pago = 'PAGADO' WHERE id_lectura = %s", (id_lectura,))
-        
-        conn.commit()
         
         # Guardar información en sesión para el recibo
         session['ultimo_pago'] = {
@@ -734,14 +787,17 @@ def registrar_pago(id_lectura):
             'consumo': float(lectura['consumo_m3'])
         }
         
-        flash(f"Pago registrado exitosamente por Q{monto_factura:.2f}.", "success")
+        if repetido:
+            flash("Este pago ya se había registrado; no se cobró de nuevo.", "info")
+        else:
+            flash(f"Pago registrado exitosamente por Q{monto_factura:.2f}.", "success")
     
+    except ValueError as err:
+        flash(str(err), "warning")
+        return redirect(url_for('ver_facturas_pendientes'))
     except mysql.connector.Error as err:
         flash(f"Error al registrar el pago: {err}", "danger")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
+        return redirect(url_for('ver_facturas_pendientes'))
     
     return redirect(url_for('confirmacion_pago'))
 
@@ -762,7 +818,7 @@ def confirmacion_pago():
 @login_required
 def imprimir_recibo(id_lectura):
     """Generar e imprimir recibo en PDF"""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         flash("Error de conexión.", "danger")
         return redirect(url_for('ver_facturas_pendientes'))
@@ -770,631 +826,222 @@ def imprimir_recibo(id_lectura):
     cursor = conn.cursor(dictionary=True)
     
     try:
-        # Obtener información completa del pago
+        # Si el recibo ya se generó basta con esta consulta por índice
         cursor.execute("""
-            SELECT 
-                l.id_lectura,
-                l.fecha_lectura,
-                l.lectura_anterior,
-                l.lectura_actual,
-                l.consumo_m3,
-                l.monto_total,
-                c.nombre,
-                c.apellido,
-                c.no_contador,
-                s.nombre_sector,
-                p.fecha_pago,
-                p.monto_pagado
-            FROM lectura l
+            SELECT p.id_pago, p.fecha_pago, c.no_contador
+            FROM pago p
+            JOIN lectura l ON p.id_lectura = l.id_lectura
             JOIN cliente c ON l.id_cliente = c.id_cliente
-            JOIN sector s ON c.id_sector = s.id_sector
-            JOIN pago p ON l.id_lectura = p.id_lectura
-            WHERE l.id_lectura = %s
-            ORDER BY p.fecha_pago DESC
-            LIMIT 1
+            WHERE p.id_lectura = %s
         """, (id_lectura,))
+        pago = cursor.fetchone()
         
-        datos = cursor.fetchone()
-        
-        if not datos:
+        if not pago:
             flash("No se encontró información del recibo.", "danger")
             return redirect(url_for('ver_facturas_pendientes'))
         
-        # Generar PDF
-        buffer = io.BytesIO()
-        generar_recibo_pdf(buffer, datos)
-        buffer.seek(0)
-        
-        nombre_archivo = f"Recibo_{datos['no_contador']}_{datos['fecha_pago'].strftime('%Y-%m-%d')}.pdf"
+        clave = f"pago-{pago['id_pago']}-v{RECIBO_PLANTILLA}"
+        ruta = cache_recibos.obtener(clave)
+        if ruta is None:
+            # Obtener información completa del pago
+            cursor.execute("""
+                SELECT 
+                    l.id_lectura,
+                    l.fecha_lectura,
+                    l.lectura_anterior,
+                    l.lectura_actual,
+                    l.consumo_m3,
+                    l.monto_total,
+                    c.nombre,
+                    c.apellido,
+                    c.no_contador,
+                    s.nombre_sector,
+                    p.fecha_pago,
+                    p.monto_pagado
+                FROM pago p
+                JOIN lectura l ON p.id_lectura = l.id_lectura
+                JOIN cliente c ON l.id_cliente = c.id_cliente
+                JOIN sector s ON c.id_sector = s.id_sector
+                WHERE p.id_pago = %s
+            """, (pago['id_pago'],))
+            datos = cursor.fetchone()
+            ruta = cache_recibos.guardar(clave, lambda archivo: generar_recibo_pdf(archivo, datos))
         
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=nombre_archivo
-        )
+        nombre_archivo = f"Recibo_{pago['no_contador']}_{pago['fecha_pago'].strftime('%Y-%m-%d')}.pdf"
+        return enviar_recibo(ruta, clave, nombre_archivo)
         
     except Exception as e:
         flash(f"Error al generar recibo: {str(e)}", "danger")
         return redirect(url_for('ver_facturas_pendientes'))
-    finally:
-        cursor.close()
-        conn.close()
 
 
-def generar_recibo_pdf(buffer, datos):
-    """Generar recibo PDF con dos copias"""
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.units import inch
-    
-    # Crear canvas
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    
-    # Función auxiliar para dibujar una copia del recibo
-    def dibujar_recibo(y_start, tipo_copia):
-        y = y_start
-        
-        # Encabezado
-        c.setFont("Helvetica-Bold", 16)
-        c.drawCentredString(width/2, y, "COMITE DE AGUA POTABLE CORINTO S.L")
-        y -= 20
-        
-        c.setFont("Helvetica", 10)
-        c.drawCentredString(width/2, y, f"({tipo_copia})")
-        y -= 10
-        
-        # Línea separadora
-        c.line(50, y, width-50, y)
-        y -= 25
-        
-        # Información del lado izquierdo
-        c.setFont("Helvetica", 10)
-        fecha_emision = datos['fecha_pago'].strftime('%Y-%m-%d')
-        c.drawString(50, y, f"Fecha Emisión: {fecha_emision}")
-        y -= 15
-        c.drawString(50, y, f"No. Contador: {datos['no_contador']}")
-        y -= 15
-        c.setFont("Helvetica-Bold", 11)
-        c.drawString(50, y, f"Nombre: {datos['nombre']} {datos['apellido']}")
-        y -= 25
-        
-        # Información del lado derecho (lecturas)
-        y_right = y_start - 65
-        c.setFont("Helvetica", 10)
-        c.drawRightString(width-50, y_right, f"Lectura Anterior: {datos['lectura_anterior']:.2f} m³")
-        y_right -= 15
-        c.drawRightString(width-50, y_right, f"Lectura Actual: {datos['lectura_actual']:.2f} m³")
-        y_right -= 15
-        
-        consumo = datos['consumo_m3']
-        if consumo >= 0:
-            c.drawRightString(width-50, y_right, f"CONSUMO: {consumo:.2f} m³")
-        else:
-            c.drawRightString(width-50, y_right, f"CONSUMO: {consumo:.2f} m³")
-        
-        y = y_right - 25
-        
-        # Cuadro de total/crédito
-        monto = datos['monto_total']
-        
-        # Dibujar rectángulo para el monto
-        rect_width = 250
-        rect_height = 40
-        rect_x = (width - rect_width) / 2
-        rect_y = y - rect_height + 10
-        
-        c.setLineWidth(2)
-        c.rect(rect_x, rect_y, rect_width, rect_height)
-        
-        c.setFont("Helvetica-Bold", 14)
-        if monto < 0:
-            texto_monto = "CRÉDITO A FAVOR:"
-            valor_monto = f"Q{abs(monto):.2f}"
-            c.setFillColorRGB(0, 0.5, 0)
-        else:
-            texto_monto = "TOTAL A PAGAR:"
-            valor_monto = f"Q{monto:.2f}"
-            c.setFillColorRGB(0, 0, 0)
-        
-        c.drawString(rect_x + 10, rect_y + rect_height/2 - 5, texto_monto)
-        c.drawRightString(rect_x + rect_width - 10, rect_y + rect_height/2 - 5, valor_monto)
-        
-        y = rect_y - 20
-        
-        # Mensaje de pago
-        c.setFillColorRGB(0, 0, 0)
-        c.setFont("Helvetica-Oblique", 9)
-        c.drawCentredString(width/2, y, "Favor de pagar antes del 5 del siguiente mes.")
-        y -= 30
-        
-        # Línea para firma
-        c.line(width/2 - 100, y, width/2 + 100, y)
-        y -= 15
-        c.setFont("Helvetica", 9)
-        c.drawCentredString(width/2, y, "Firma/Sello")
-        
-        return y
-    
-    # Dibujar primera copia (Usuario)
-    y_usuario = height - 80
-    y_final = dibujar_recibo(y_usuario, "COPIA PARA EL CLIENTE")
-    
-    # Línea de corte
-    y_corte = y_final - 40
-    c.setFont("Helvetica", 9)
-    c.setDash(3, 3)
-    c.line(50, y_corte, width-50, y_corte)
-    c.setDash()
-    c.drawCentredString(width/2, y_corte - 10, "----------- Línea de Corte -----------")
-    
-    # Dibujar segunda copia (Cooperativa)
-    y_cooperativa = y_corte - 60
-    dibujar_recibo(y_cooperativa, "COPIA PARA EL COMITE")
-    
-    # Finalizar PDF
-    c.showPage()
-    c.save()
-
-
-def generar_pdf_reporte_ingresos(buffer, datos, fecha_inicio, fecha_fin):
-    """Generar PDF profesional para reporte de ingresos"""
-    doc = SimpleDocTemplate(buffer, pagesize=letter,
-                            rightMargin=72, leftMargin=72,
-                            topMargin=72, bottomMargin=18)
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#1a472a'),
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=12,
-        textColor=colors.HexColor('#2d5016'),
-        spaceAfter=12,
-        fontName='Helvetica-Bold'
-    )
-    
-    normal_style = styles['Normal']
-    normal_style.fontSize = 10
-    
-    # Contenido
-    story = []
-    
-    # Encabezado
-    story.append(Paragraph("COMITÉ DE AGUA POTABLE CORINTO S.L", title_style))
-    story.append(Paragraph("REPORTE DE INGRESOS", heading_style))
-    story.append(Spacer(1, 12))
+@app.route('/api/clientes/<int:id_cliente>/facturas-pendientes')
+@login_required
+def api_facturas_pendientes_cliente(id_cliente):
+    """Facturas pendientes de un cliente, para elegir cuáles cobrar juntas"""
+    if not tiene_permiso(session.get('user_id'), 'pagos.ver'):
+        return jsonify({'error': 'No tienes permiso para esta acción'}), 403
     
-    # Información del reporte
-    info_text = f"""
-    <b>Período:</b> {fecha_inicio} al {fecha_fin}<br/>
-    <b>Fecha de Generación:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}<br/>
-    <b>Total de Registros:</b> {len(datos)}
-    """
-    story.append(Paragraph(info_text, normal_style))
-    story.append(Spacer(1, 20))
-    
-    # Calcular total
-    total_ingresos = sum(registro['total'] for registro in datos)
-    
-    # Tabla de datos
-    table_data = [['Fecha', 'Monto (Q)']]
-    
-    for registro in datos:
-        fecha_str = registro['fecha'].strftime('%d/%m/%Y') if isinstance(registro['fecha'], date) else str(registro['fecha'])
-        table_data.append([
-            fecha_str,
-            f"{registro['total']:.2f}"
-        ])
-    
-    # Fila de total
-    table_data.append([
-        Paragraph('<b>TOTAL INGRESOS</b>', normal_style),
-        Paragraph(f'<b>Q{total_ingresos:.2f}</b>', normal_style)
-    ])
-    
-    # Crear tabla
-    table = Table(table_data, colWidths=[4*inch, 2*inch])
-    table.setStyle(TableStyle([
-        # Encabezado
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2d5016')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 11),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('TOPPADDING', (0, 0), (-1, 0), 12),
-        # Filas de datos
-        ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
-        ('TEXTCOLOR', (0, 1), (-1, -2), colors.black),
-        ('FONTNAME', (0, 1), (-1, -2), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -2), 10),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, colors.HexColor('#f5f5f5')]),
-        # Fila de total
-        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#d4edda')),
-        ('TEXTCOLOR', (0, -1), (-1, -1), colors.HexColor('#155724')),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, -1), (-1, -1), 11),
-        ('TOPPADDING', (0, -1), (-1, -1), 12),
-        ('BOTTOMPADDING', (0, -1), (-1, -1), 12),
-    ]))
-    
-    story.append(table)
-    story.append(Spacer(1, 20))
-    
-    # Pie de página
-    footer_text = f"<i>Reporte generado el {datetime.now().strftime('%d/%m/%Y a las %H:%M')}</i>"
-    story.append(Paragraph(footer_text, normal_style))
-    
-    # Construir PDF
-    doc.build(story)
-
-
-def generar_pdf_reporte_morosos(buffer, datos):
-    """Generar PDF profesional para reporte de clientes morosos"""
-    doc = SimpleDocTemplate(buffer, pagesize=letter,
-                            rightMargin=72, leftMargin=72,
-                            topMargin=72, bottomMargin=18)
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#721c24'),
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
+    conn = get_db()
+    if conn is None:
+        return jsonify({'error': 'Error de conexión'}), 500
     
-    normal_style = styles['Normal']
-    normal_style.fontSize = 9
-    
-    # Contenido
-    story = []
-    
-    # Encabezado
-    story.append(Paragraph("COMITÉ DE AGUA POTABLE CORINTO S.L", title_style))
-    story.append(Paragraph("REPORTE DE CLIENTES MOROSOS", 
-                          ParagraphStyle('Heading', parent=styles['Heading2'], 
-                                        fontSize=12, textColor=colors.HexColor('#721c24'),
-                                        spaceAfter=12, alignment=TA_CENTER, fontName='Helvetica-Bold')))
-    story.append(Spacer(1, 12))
-    
-    # Información del reporte
-    total_deuda = sum(registro['deuda_total'] for registro in datos)
-    total_facturas = sum(registro['facturas_pendientes'] for registro in datos)
-    
-    info_text = f"""
-    <b>Fecha de Generación:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}<br/>
-    <b>Total de Clientes Morosos:</b> {len(datos)}<br/>
-    <b>Total de Facturas Pendientes:</b> {total_facturas}<br/>
-    <b>Deuda Total:</b> Q{total_deuda:.2f}
-    """
-    story.append(Paragraph(info_text, normal_style))
-    story.append(Spacer(1, 20))
-    
-    # Tabla de datos
-    table_data = [['Cliente', 'Contador', 'Sector', 'Facturas', 'Deuda (Q)', 'Fecha Antigua']]
-    
-    for registro in datos:
-        fecha_antigua = registro['fecha_mas_antigua'].strftime('%d/%m/%Y') if isinstance(registro['fecha_mas_antigua'], date) else str(registro['fecha_mas_antigua'])
-        nombre_completo = f"{registro['nombre']} {registro['apellido']}"
-        # Usar Paragraph para que el texto largo se ajuste automáticamente
-        table_data.append([
-            Paragraph(nombre_completo, normal_style),
-            registro['no_contador'],
-            registro['nombre_sector'],
-            str(registro['facturas_pendientes']),
-            f"{registro['deuda_total']:.2f}",
-            fecha_antigua
-        ])
-    
-    # Fila de total
-    table_data.append([
-        Paragraph('<b>TOTALES</b>', normal_style),
-        '',
-        '',
-        Paragraph(f'<b>{total_facturas}</b>', normal_style),
-        Paragraph(f'<b>Q{total_deuda:.2f}</b>', normal_style),
-        ''
-    ])
-    
-    # Crear tabla con ancho aumentado para la columna de Cliente
-    table = Table(table_data, colWidths=[2.5*inch, 1*inch, 1.2*inch, 0.8*inch, 1*inch, 1*inch])
-    table.setStyle(TableStyle([
-        # Encabezado
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#721c24')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('ALIGN', (0, 1), (0, -2), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('TOPPADDING', (0, 0), (-1, 0), 12),
-        # Filas de datos
-        ('BACKGROUND', (0, 1), (-1, -2), colors.HexColor('#fff3cd')),
-        ('TEXTCOLOR', (0, 1), (-1, -2), colors.black),
-        ('FONTNAME', (0, 1), (-1, -2), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -2), 9),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, colors.HexColor('#fff3cd')]),
-        # Fila de total
-        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#f8d7da')),
-        ('TEXTCOLOR', (0, -1), (-1, -1), colors.HexColor('#721c24')),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, -1), (-1, -1), 10),
-        ('TOPPADDING', (0, -1), (-1, -1), 12),
-        ('BOTTOMPADDING', (0, -1), (-1, -1), 12),
-    ]))
-    
-    story.append(table)
-    story.append(Spacer(1, 20))
-    
-    # Pie de página
-    footer_text = f"<i>Reporte generado el {datetime.now().strftime('%d/%m/%Y a las %H:%M')}</i>"
-    story.append(Paragraph(footer_text, normal_style))
-    
-    # Construir PDF
-    doc.build(story)
-
-
-def generar_pdf_reporte_consumo(buffer, datos, fecha_inicio, fecha_fin):
-    """Generar PDF profesional para reporte de consumo"""
-    doc = SimpleDocTemplate(buffer, pagesize=letter,
-                            rightMargin=72, leftMargin=72,
-                            topMargin=72, bottomMargin=18)
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#004085'),
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
+    try:
+        facturas = facturas_pendientes_cliente(conn, id_cliente)
+    except mysql.connector.Error as err:
+        print(f"ERROR api_facturas_pendientes_cliente: {err}")
+        return jsonify({'error': 'Error al consultar las facturas del cliente'}), 500
     
-    normal_style = styles['Normal']
-    normal_style.fontSize = 9
-    
-    # Contenido
-    story = []
-    
-    # Encabezado
-    story.append(Paragraph("COMITÉ DE AGUA POTABLE CORINTO S.L", title_style))
-    story.append(Paragraph("REPORTE DE CONSUMO DE AGUA", 
-                          ParagraphStyle('Heading', parent=styles['Heading2'], 
-                                        fontSize=12, textColor=colors.HexColor('#004085'),
-                                        spaceAfter=12, alignment=TA_CENTER, fontName='Helvetica-Bold')))
-    story.append(Spacer(1, 12))
-    
-    # Información del reporte
-    info_text = f"""
-    <b>Período:</b> {fecha_inicio} al {fecha_fin}<br/>
-    <b>Fecha de Generación:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}<br/>
-    <b>Total de Clientes:</b> {len(datos)}
-    """
-    story.append(Paragraph(info_text, normal_style))
-    story.append(Spacer(1, 20))
-    
-    # Tabla de datos
-    table_data = [['Cliente', 'Contador', 'Sector', 'Promedio (m³)', 'Máximo (m³)', 'Mínimo (m³)']]
-    
-    for registro in datos:
-        table_data.append([
-            f"{registro['nombre']} {registro['apellido']}",
-            registro['no_contador'],
-            registro['nombre_sector'],
-            f"{registro['consumo_promedio']:.2f}",
-            f"{registro['consumo_maximo']:.2f}",
-            f"{registro['consumo_minimo']:.2f}"
-        ])
-    
-    # Crear tabla
-    table = Table(table_data, colWidths=[2*inch, 1*inch, 1.2*inch, 1*inch, 1*inch, 1*inch])
-    table.setStyle(TableStyle([
-        # Encabezado
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#004085')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('ALIGN', (0, 1), (0, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('TOPPADDING', (0, 0), (-1, 0), 12),
-        # Filas de datos
-        ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#cce5ff')),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#cce5ff')]),
-    ]))
-    
-    story.append(table)
-    story.append(Spacer(1, 20))
-    
-    # Pie de página
-    footer_text = f"<i>Reporte generado el {datetime.now().strftime('%d/%m/%Y a las %H:%M')}</i>"
-    story.append(Paragraph(footer_text, normal_style))
-    
-    # Construir PDF
-    doc.build(story)
-
-
-def generar_pdf_reporte_individual(buffer, cliente, lecturas, pagos, estadisticas, facturas_pendientes):
-    """Generar PDF profesional para reporte individual de cliente"""
-    doc = SimpleDocTemplate(buffer, pagesize=letter,
-                            rightMargin=72, leftMargin=72,
-                            topMargin=72, bottomMargin=18)
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#1a472a'),
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
+    return jsonify([{
+        'id_lectura': factura['id_lectura'],
+        'fecha_lectura': factura['fecha_lectura'].strftime('%d/%m/%Y'),
+        'consumo_m3': float(factura['consumo_m3']),
+        'monto_total': float(factura['monto_total']),
+        'dias_mora': factura['dias_mora'],
+    } for factura in facturas])
+
+
+@app.route('/procesos/pago/cliente/<int:id_cliente>', methods=['POST'])
+@login_required
+@permiso_required('pagos.crear')
+def registrar_pago_cliente(id_cliente):
+    """Cobrar en una sola operación varias facturas pendientes de un cliente."""
+    conn = get_db()
+    if conn is None:
+        flash("Error de conexión a la base de datos.", "danger")
+        return redirect(url_for('ver_facturas_pendientes'))
     
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=12,
-        textColor=colors.HexColor('#2d5016'),
-        spaceAfter=12,
-        fontName='Helvetica-Bold'
-    )
+    try:
+        ids_lectura = [int(valor) for valor in request.form.getlist('id_lectura')]
+        id_pago_grupo, repetido = registrar_pago_grupo(
+            conn, id_cliente, ids_lectura, session['user_id'], request.form.get('clave_idempotencia', '')[:64] or None)
+    except ValueError as err:
+        flash(str(err), "warning")
+        return redirect(url_for('ver_facturas_pendientes'))
+    except mysql.connector.Error as err:
+        flash(f"Error al registrar el pago: {err}", "danger")
+        return redirect(url_for('ver_facturas_pendientes'))
     
-    normal_style = styles['Normal']
-    normal_style.fontSize = 10
-    
-    # Contenido
-    story = []
-    
-    # Encabezado
-    story.append(Paragraph("COMITÉ DE AGUA POTABLE CORINTO S.L", title_style))
-    story.append(Paragraph("REPORTE INDIVIDUAL DE CLIENTE", heading_style))
-    story.append(Spacer(1, 20))
-    
-    # Información del cliente
-    story.append(Paragraph("INFORMACIÓN DEL CLIENTE", heading_style))
-    cliente_text = f"""
-    <b>Nombre:</b> {cliente['nombre']} {cliente['apellido']}<br/>
-    <b>Número de Contador:</b> {cliente['no_contador']}<br/>
-    <b>Sector:</b> {cliente['nombre_sector']}<br/>
-    <b>Teléfono:</b> {cliente.get('telefono', 'No registrado')}<br/>
-    <b>Estado:</b> {'Activo' if cliente.get('activo', True) else 'Inactivo'}
-    """
-    story.append(Paragraph(cliente_text, normal_style))
-    story.append(Spacer(1, 20))
+    if repetido:
+        flash("Este pago ya se había registrado; no se cobró de nuevo.", "info")
+    else:
+        forzar_relectura()
+        flash(f"Pago de {len(set(ids_lectura))} facturas registrado exitosamente.", "success")
+    return redirect(url_for('confirmacion_pago_grupo', id_pago_grupo=id_pago_grupo))
+
+
+@app.route('/procesos/pago/grupo/<int:id_pago_grupo>')
+@login_required
+@permiso_required('pagos.ver')
+def confirmacion_pago_grupo(id_pago_grupo):
+    """Resumen de un cobro de varias facturas con opción de imprimir el recibo"""
+    conn = get_db()
+    if conn is None: return redirect(url_for('ver_facturas_pendientes'))
+    
+    grupo = obtener_pago_grupo(conn, id_pago_grupo)
+    if grupo is None:
+        flash("No se encontró el pago.", "warning")
+        return redirect(url_for('ver_facturas_pendientes'))
     
-    # Estadísticas
-    story.append(Paragraph("ESTADÍSTICAS", heading_style))
-    stats_text = f"""
-    <b>Total de Lecturas:</b> {estadisticas['total_lecturas']}<br/>
-    <b>Consumo Promedio:</b> {estadisticas['consumo_promedio']:.2f} m³<br/>
-    <b>Consumo Máximo:</b> {estadisticas['consumo_maximo']:.2f} m³<br/>
-    <b>Consumo Mínimo:</b> {estadisticas['consumo_minimo']:.2f} m³<br/>
-    <b>Total Pagado:</b> Q{estadisticas['total_pagado']:.2f}<br/>
-    <b>Deuda Actual:</b> Q{estadisticas['deuda_total']:.2f}
-    """
-    story.append(Paragraph(stats_text, normal_style))
-    story.append(Spacer(1, 20))
+    return render_template('procesos/confirmacion_pago_grupo.html', grupo=grupo)
+
+
+@app.route('/procesos/pago/grupo/<int:id_pago_grupo>/recibo')
+@login_required
+@permiso_required('pagos.ver')
+def imprimir_recibo_grupo(id_pago_grupo):
+    """Recibo PDF único de un cobro de varias facturas"""
+    conn = get_db()
+    if conn is None:
+        flash("Error de conexión.", "danger")
+        return redirect(url_for('ver_facturas_pendientes'))
     
-    # Facturas pendientes
-    if facturas_pendientes:
-        story.append(Paragraph("FACTURAS PENDIENTES", heading_style))
-        table_data = [['Fecha Lectura', 'Consumo (m³)', 'Monto (Q)', 'Días Mora']]
-        
-        for factura in facturas_pendientes:
-            fecha_str = factura['fecha_lectura'].strftime('%d/%m/%Y') if isinstance(factura['fecha_lectura'], date) else str(factura['fecha_lectura'])
-            table_data.append([
-                fecha_str,
-                f"{factura['consumo_m3']:.2f}",
-                f"{factura['monto_total']:.2f}",
-                str(factura.get('dias_mora', 0))
-            ])
-        
-        table = Table(table_data, colWidths=[2*inch, 1.5*inch, 1.5*inch, 1*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#721c24')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#fff3cd')),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-        ]))
-        story.append(table)
-        story.append(Spacer(1, 20))
-    
-    # Historial de lecturas
-    if lecturas:
-        story.append(Paragraph("HISTORIAL DE LECTURAS", heading_style))
-        table_data = [['Fecha', 'Lect. Ant.', 'Lect. Act.', 'Consumo (m³)', 'Monto (Q)', 'Estado']]
-        
-        for lectura in lecturas[:20]:  # Limitar a 20 para no hacer el PDF muy largo
-            fecha_str = lectura['fecha_lectura'].strftime('%d/%m/%Y') if isinstance(lectura['fecha_lectura'], date) else str(lectura['fecha_lectura'])
-            estado = 'Pagado' if lectura['estado_pago'] == 'PAGADO' else 'Pendiente'
-            table_data.append([
-                fecha_str,
-                f"{lectura['lectura_anterior']:.2f}",
-                f"{lectura['lectura_actual']:.2f}",
-                f"{lectura['consumo_m3']:.2f}",
-                f"{lectura['monto_total']:.2f}",
-                estado
-            ])
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT g.fecha_pago, c.no_contador
+            FROM pago_grupo g
+            JOIN cliente c ON g.id_cliente = c.id_cliente
+            WHERE g.id_pago_grupo = %s
+        """, (id_pago_grupo,))
+        pago = cursor.fetchone()
+        cursor.close()
+        if pago is None:
+            flash("No se encontró información del recibo.", "danger")
+            return redirect(url_for('ver_facturas_pendientes'))
         
-        table = Table(table_data, colWidths=[1*inch, 1*inch, 1*inch, 1*inch, 1*inch, 0.8*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#004085')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 9),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#cce5ff')),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#cce5ff')]),
-        ]))
-        story.append(table)
-        story.append(Spacer(1, 20))
-    
-    # Historial de pagos
-    if pagos:
-        story.append(Paragraph("HISTORIAL DE PAGOS", heading_style))
-        table_data = [['Fecha Pago', 'Período', 'Consumo (m³)', 'Monto (Q)']]
+        clave = f"grupo-{id_pago_grupo}-v{RECIBO_PLANTILLA}"
+        ruta = cache_recibos.obtener(clave)
+        if ruta is None:
+            grupo = obtener_pago_grupo(conn, id_pago_grupo)
+            ruta = cache_recibos.guardar(clave, lambda archivo: generar_recibo_grupo_pdf(archivo, grupo))
         
-        for pago in pagos[:20]:  # Limitar a 20
-            fecha_pago_str = pago['fecha_pago'].strftime('%d/%m/%Y') if isinstance(pago['fecha_pago'], date) else str(pago['fecha_pago'])
-            fecha_lectura_str = pago['fecha_lectura'].strftime('%d/%m/%Y') if isinstance(pago['fecha_lectura'], date) else str(pago['fecha_lectura'])
-            table_data.append([
-                fecha_pago_str,
-                fecha_lectura_str,
-                f"{pago['consumo_m3']:.2f}",
-                f"{pago['monto_pagado']:.2f}"
-            ])
+        nombre_archivo = f"Recibo_{pago['no_contador']}_{pago['fecha_pago'].strftime('%Y-%m-%d')}_{id_pago_grupo}.pdf"
+        return enviar_recibo(ruta, clave, nombre_archivo)
         
-        table = Table(table_data, colWidths=[2*inch, 2*inch, 1.5*inch, 1.5*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#155724')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#d4edda')),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#d4edda')]),
-        ]))
-        story.append(table)
-    
-    # Pie de página
-    story.append(Spacer(1, 20))
-    footer_text = f"<i>Reporte generado el {datetime.now().strftime('%d/%m/%Y a las %H:%M')}</i>"
-    story.append(Paragraph(footer_text, normal_style))
-    
-    # Construir PDF
-    doc.build(story)
+    except Exception as e:
+        flash(f"Error al generar recibo: {str(e)}", "danger")
+        return redirect(url_for('ver_facturas_pendientes'))
+
+
+def enviar_recibo(ruta, clave, nombre_archivo):
+    """
+    Envía un recibo de la cache. La clave sirve de ETag: si el navegador ya
+    tiene esa versión del recibo recibe un 304 sin volver a descargarlo.
+    """
+    respuesta = send_file(
+        ruta,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=nombre_archivo,
+        etag=clave,
+        conditional=True
+    )
+    respuesta.cache_control.private = True
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+
+# --- TRABAJOS EN SEGUNDO PLANO ---
+# Los ejecuta el despachador de trabajos.py en sus propios hilos, fuera de una
+# petición: reciben su conexión, escriben el archivo en `ruta` y devuelven
+# (nombre_archivo, mimetype). La descarga pasa por /trabajos/<id>/descargar.
+# Los reportes grandes se dibujan en el pool de procesos de renderizado_pdf.py.
+
+@tipo_trabajo('reporte_pdf')
+def trabajo_reporte_pdf(conn, parametros, ruta):
+    """PDF de los reportes de ingresos, morosos y consumo"""
+    reporte = REPORTES.get(parametros['tipo_reporte'])
+    if reporte is None:
+        raise ValueError("Tipo de reporte no válido")
+    valores = reporte.leer_parametros(parametros.get('fecha_inicio'), parametros.get('fecha_fin'))
+    filas = reporte.resultado(lambda: conn, valores)
+    renderizar(reporte.nombre, ruta, *reporte.argumentos_pdf(filas, valores))
+    return reporte.nombre_archivo(valores, 'pdf'), 'application/pdf'
+
+
+@tipo_trabajo('reporte_individual_pdf')
+def trabajo_reporte_individual_pdf(conn, parametros, ruta):
+    """PDF del reporte individual de un cliente"""
+    estado = cargar_estado_cuenta(lambda: conn, parametros['id_cliente'])
+    if estado is None:
+        raise ValueError("Cliente no encontrado")
+    
+    renderizar('individual', ruta, estado['cliente'], estado['lecturas'], estado['pagos'],
+               estado['estadisticas'], estado['facturas_pendientes'])
+    nombre_archivo = f"Reporte_Individual_{estado['cliente']['no_contador']}_{datetime.now().strftime('%Y%m%d')}.pdf"
+    return nombre_archivo, 'application/pdf'
+
+
+@tipo_trabajo('avisos')
+def trabajo_avisos(conn, parametros, ruta):
+    """Avisos de cobro de un rango: un PDF, o un ZIP con un PDF por sector"""
+    # El temporal en el mismo directorio que `ruta`, para que os.replace no cruce de sistema de archivos
+    temporal, es_zip, cantidad = generar_avisos(conn, parametros['fecha_inicio'], parametros['fecha_fin'],
+                                                parametros.get('id_sector'), os.path.dirname(ruta))
+    os.replace(temporal, ruta)
+    nombre_archivo = f"Avisos_{parametros['fecha_inicio']}_{parametros['fecha_fin']}.{'zip' if es_zip else 'pdf'}"
+    return nombre_archivo, 'application/zip' if es_zip else 'application/pdf'
 
 
 # --- RUTAS DE REPORTES ---
@@ -1404,7 +1051,49 @@ def generar_pdf_reporte_individual(buffer, cliente, lecturas, pagos, estadistica
 @permiso_required('reportes.ver')
 def generador_reportes():
     """Generador de reportes."""
-    return render_template('reportes/generador.html')
+    conn = get_db()
+    sectores = []
+    if conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT id_sector, nombre_sector FROM sector ORDER BY nombre_sector")
+        sectores = cursor.fetchall()
+        cursor.close()
+    return render_template('reportes/generador.html', sectores=sectores)
+
+
+@app.route('/reportes/avisos')
+@login_required
+@permiso_required('reportes.ver')
+def generar_avisos_cobro():
+    """Encolar los avisos de cobro de las lecturas pendientes de un rango, para imprimir por sector"""
+    try:
+        fecha_inicio = fecha_iso(request.args.get('fecha_inicio'))
+        fecha_fin = fecha_iso(request.args.get('fecha_fin'))
+    except (ValueError, TypeError):
+        fecha_inicio = fecha_fin = None
+    if fecha_inicio is None or fecha_inicio > fecha_fin:
+        flash("Seleccione un período válido", "danger")
+        return redirect(url_for('generador_reportes'))
+    
+    return encolar_trabajo('avisos', {
+        'fecha_inicio': fecha_inicio,
+        'fecha_fin': fecha_fin,
+        'id_sector': request.args.get('id_sector', type=int),
+    }, url_for('generador_reportes'))
+
+
+def encolar_trabajo(tipo, parametros, volver):
+    """Guarda el trabajo en la cola y lleva al usuario a la página que muestra su avance"""
+    conn = get_db()
+    if conn is None:
+        return redirect(volver)
+    try:
+        id_trabajo = encolar(conn, tipo, parametros, session['user_id'])
+    except mysql.connector.Error as err:
+        flash(f"Error al encolar el trabajo: {err}", "danger")
+        print(f"ERROR encolar trabajo {tipo}: {err}")
+        return redirect(volver)
+    return redirect(url_for('ver_trabajo', id_trabajo=id_trabajo, volver=volver))
 
 
 @app.route('/reportes/generar', methods=['POST'])
@@ -1416,177 +1105,178 @@ def generar_reporte():
     fecha_inicio = request.form.get('fecha_inicio')
     fecha_fin = request.form.get('fecha_fin')
     
-    conn = get_db_connection()
-    if conn is None: 
-        flash("Error de conexión", "danger")
-        return redirect(url_for('generador_reportes'))
-    
-    cursor = conn.cursor(dictionary=True)
-    
-    if tipo_reporte == 'ingresos':
-        cursor.execute("""
-            SELECT DATE(p.fecha_pago) as fecha, SUM(p.monto_pagado) as total
-            FROM pago p
-            WHERE p.fecha_pago BETWEEN %s AND %s
-            GROUP BY DATE(p.fecha_pago)
-            ORDER BY fecha DESC
-        """, (fecha_inicio, fecha_fin))
-        datos = cursor.fetchall()
-        titulo = "Reporte de Ingresos"
-        
-    elif tipo_reporte == 'morosos':
-        cursor.execute("""
-            SELECT c.nombre, c.apellido, c.no_contador, s.nombre_sector,
-                   COUNT(l.id_lectura) as facturas_pendientes,
-                   SUM(l.monto_total) as deuda_total,
-                   MIN(l.fecha_lectura) as fecha_mas_antigua
-            FROM cliente c
-            JOIN lectura l ON c.id_cliente = l.id_cliente
-            JOIN sector s ON c.id_sector = s.id_sector
-            WHERE l.estado_pago = 'PENDIENTE'
-            GROUP BY c.id_cliente
-            ORDER BY deuda_total DESC
-        """)
-        datos = cursor.fetchall()
-        titulo = "Reporte de Clientes Morosos"
-        
-    elif tipo_reporte == 'consumo':
-        cursor.execute("""
-            SELECT c.nombre, c.apellido, c.no_contador, s.nombre_sector,
-                   AVG(l.consumo_m3) as consumo_promedio,
-                   MAX(l.consumo_m3) as consumo_maximo,
-                   MIN(l.consumo_m3) as consumo_minimo
-            FROM cliente c
-            JOIN lectura l ON c.id_cliente = l.id_cliente
-            JOIN sector s ON c.id_sector = s.id_sector
-            WHERE l.fecha_lectura BETWEEN %s AND %s
-            GROUP BY c.id_cliente
-            ORDER BY consumo_promedio DESC
-        """, (fecha_inicio, fecha_fin))
-        datos = cursor.fetchall()
-        titulo = "Reporte de Consumo de Agua"
-        
-    else:
+    # Las filas se piden por página a /api/reportes/<tipo>
+    reporte = REPORTES.get(tipo_reporte)
+    if reporte is None:
         flash("Tipo de reporte no válido", "danger")
-        cursor.close()
-        conn.close()
         return redirect(url_for('generador_reportes'))
     
-    cursor.close()
-    conn.close()
+    try:
+        reporte.leer_parametros(fecha_inicio, fecha_fin)
+    except ValueError as err:
+        flash(str(err), "danger")
+        return redirect(url_for('generador_reportes'))
     
     # Pasar fecha_generacion al template
     return render_template('reportes/resultado.html', 
-                         datos=datos, 
-                         titulo=titulo, 
+                         titulo=reporte.titulo, 
                          tipo=tipo_reporte,
                          fecha_inicio=fecha_inicio,
                          fecha_fin=fecha_fin,
                          fecha_generacion=datetime.now())
 
 
+@app.route('/api/reportes/<tipo_reporte>', methods=['GET'])
+@login_required
+def api_reporte(tipo_reporte):
+    """
+    API: página de un reporte en el formato de DataTables (serverSide). Las
+    filas salen del resultado en cache del reporte (ver reportes.py), el
+    mismo que usan el PDF y las exportaciones.
+    """
+    reporte = REPORTES.get(tipo_reporte)
+    if reporte is None:
+        return jsonify({'error': 'Reporte no encontrado'}), 404
+    if not tiene_permiso(session.get('user_id'), 'reportes.ver'):
+        return jsonify({'error': 'No tienes permiso para esta acción'}), 403
+    
+    if get_db() is None:
+        return jsonify({'error': 'Error de conexión'}), 500
+    
+    try:
+        parametros = reporte.leer_parametros(request.args.get('desde'), request.args.get('hasta'))
+        return jsonify(reporte.pagina(reporte.resultado(get_db, parametros), request.args))
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+    except mysql.connector.Error as err:
+        print(f"ERROR api_reporte {tipo_reporte}: {err}")
+        return jsonify({'draw': request.args.get('draw', 0, type=int), 'error': 'Error al consultar el reporte'}), 500
+
+
+@app.route('/api/consumo/mensual')
+@login_required
+def api_consumo_mensual():
+    """
+    API: serie mensual de consumo para gráficas de tendencia, de un sector
+    (?id_sector=), de un cliente (?id_cliente=) o de todos, entre los meses
+    de ?desde= y ?hasta= (YYYY-MM-DD, opcionales).
+    """
+    if not tiene_permiso(session.get('user_id'), 'reportes.ver'):
+        return jsonify({'error': 'No tienes permiso para esta acción'}), 403
+    
+    conn = get_db()
+    if conn is None:
+        return jsonify({'error': 'Error de conexión'}), 500
+    
+    try:
+        desde, hasta = request.args.get('desde'), request.args.get('hasta')
+        serie = consumo_por_mes(conn,
+                                id_sector=request.args.get('id_sector', type=int),
+                                id_cliente=request.args.get('id_cliente', type=int),
+                                desde=fecha_iso(desde) if desde else None,
+                                hasta=fecha_iso(hasta) if hasta else None)
+    except ValueError:
+        return jsonify({'error': 'Fecha no válida'}), 400
+    except mysql.connector.Error as err:
+        print(f"ERROR api_consumo_mensual: {err}")
+        return jsonify({'error': 'Error al consultar el consumo'}), 500
+    
+    return jsonify([{columna: valor_json(valor) for columna, valor in fila.items()} for fila in serie])
+
+
 @app.route('/reportes/exportar-pdf/<tipo_reporte>')
 @login_required
 @permiso_required('reportes.ver')
 def exportar_reporte_pdf(tipo_reporte):
-    """Exportar reporte en formato PDF profesional"""
+    """Encolar el reporte en PDF; se descarga desde la página del trabajo"""
+    reporte = REPORTES.get(tipo_reporte)
+    if reporte is None:
+        flash("Tipo de reporte no válido", "danger")
+        return redirect(url_for('generador_reportes'))
+    
     fecha_inicio = request.args.get('fecha_inicio')
     fecha_fin = request.args.get('fecha_fin')
-    
-    # Solo validar fechas si el reporte las requiere
-    if tipo_reporte != 'morosos' and (not fecha_inicio or not fecha_fin):
-        flash("Fechas no especificadas", "danger")
+    try:
+        reporte.leer_parametros(fecha_inicio, fecha_fin)
+    except ValueError as err:
+        flash(str(err), "danger")
         return redirect(url_for('generador_reportes'))
     
-    conn = get_db_connection()
-    if conn is None:
-        flash("Error de conexión", "danger")
+    return encolar_trabajo('reporte_pdf', {'tipo_reporte': tipo_reporte, 'fecha_inicio': fecha_inicio,
+                                           'fecha_fin': fecha_fin}, url_for('generador_reportes'))
+
+
+def enviar_exportacion(formato, nombre_archivo, encabezados, abrir_filas, volver):
+    """
+    Respuesta que envía un CSV o XLSX por partes mientras se leen las filas.
+
+    abrir_filas(conn) ejecuta la consulta en una conexión propia de la
+    exportación y devuelve las filas (ver exportaciones.py); la conexión
+    vuelve al pool cuando termina de enviarse la respuesta.
+    """
+    if formato not in FORMATOS:
+        flash("Formato de exportación no válido", "danger")
+        return redirect(volver)
+    
+    try:
+        conn = obtener_conexion()
+    except mysql.connector.Error as err:
+        print(f"Error al conectar a MySQL: {err}")
+        flash("Error de conexión a la base de datos.", "danger")
+        return redirect(volver)
+    
+    try:
+        filas = abrir_filas(conn)
+    except mysql.connector.Error as err:
+        print(f"ERROR exportación {nombre_archivo}: {err}")
+        cerrar_exportacion(conn)
+        flash(f"Error al exportar: {err}", "danger")
+        return redirect(volver)
+    
+    respuesta = Response(generar_exportacion(formato, encabezados, filas), mimetype=FORMATOS[formato])
+    respuesta.headers['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+    respuesta.call_on_close(lambda: cerrar_exportacion(conn))
+    return respuesta
+
+
+@app.route('/reportes/exportar/<tipo_reporte>/<formato>')
+@login_required
+@permiso_required('reportes.ver')
+def exportar_reporte(tipo_reporte, formato):
+    """Exportar un reporte completo en CSV o XLSX"""
+    reporte = REPORTES.get(tipo_reporte)
+    if reporte is None:
+        flash("Tipo de reporte no válido", "danger")
         return redirect(url_for('generador_reportes'))
     
-    cursor = conn.cursor(dictionary=True)
+    try:
+        parametros = reporte.leer_parametros(request.args.get('fecha_inicio'), request.args.get('fecha_fin'))
+    except ValueError as err:
+        flash(str(err), "danger")
+        return redirect(url_for('generador_reportes'))
     
+    return enviar_exportacion(formato, reporte.nombre_archivo(parametros, formato), reporte.encabezados,
+                              lambda conn: reporte.exportar(lambda: conn, parametros),
+                              url_for('generador_reportes'))
+
+
+@app.route('/reportes/pagos/exportar/<formato>')
+@login_required
+@permiso_required('reportes.ver')
+def exportar_pagos(formato):
+    """Exportar el detalle de todos los pagos de un período (uno por fila) en CSV o XLSX"""
     try:
-        if tipo_reporte == 'ingresos':
-            cursor.execute("""
-                SELECT DATE(p.fecha_pago) as fecha, SUM(p.monto_pagado) as total
-                FROM pago p
-                WHERE p.fecha_pago BETWEEN %s AND %s
-                GROUP BY DATE(p.fecha_pago)
-                ORDER BY fecha DESC
-            """, (fecha_inicio, fecha_fin))
-            datos = cursor.fetchall()
-            
-            buffer = io.BytesIO()
-            generar_pdf_reporte_ingresos(buffer, datos, fecha_inicio, fecha_fin)
-            buffer.seek(0)
-            
-            nombre_archivo = f"Reporte_Ingresos_{fecha_inicio}_{fecha_fin}.pdf"
-            
-        elif tipo_reporte == 'morosos':
-            cursor.execute("""
-                SELECT c.nombre, c.apellido, c.no_contador, s.nombre_sector,
-                       COUNT(l.id_lectura) as facturas_pendientes,
-                       SUM(l.monto_total) as deuda_total,
-                       MIN(l.fecha_lectura) as fecha_mas_antigua
-                FROM cliente c
-                JOIN lectura l ON c.id_cliente = l.id_cliente
-                JOIN sector s ON c.id_sector = s.id_sector
-                WHERE l.estado_pago = 'PENDIENTE'
-                GROUP BY c.id_cliente
-                ORDER BY deuda_total DESC
-            """)
-            datos = cursor.fetchall()
-            
-            buffer = io.BytesIO()
-            generar_pdf_reporte_morosos(buffer, datos)
-            buffer.seek(0)
-            
-            nombre_archivo = f"Reporte_Morosos_{datetime.now().strftime('%Y%m%d')}.pdf"
-            
-        elif tipo_reporte == 'consumo':
-            cursor.execute("""
-                SELECT c.nombre, c.apellido, c.no_contador, s.nombre_sector,
-                       AVG(l.consumo_m3) as consumo_promedio,
-                       MAX(l.consumo_m3) as consumo_maximo,
-                       MIN(l.consumo_m3) as consumo_minimo
-                FROM cliente c
-                JOIN lectura l ON c.id_cliente = l.id_cliente
-                JOIN sector s ON c.id_sector = s.id_sector
-                WHERE l.fecha_lectura BETWEEN %s AND %s
-                GROUP BY c.id_cliente
-                ORDER BY consumo_promedio DESC
-            """, (fecha_inicio, fecha_fin))
-            datos = cursor.fetchall()
-            
-            buffer = io.BytesIO()
-            generar_pdf_reporte_consumo(buffer, datos, fecha_inicio, fecha_fin)
-            buffer.seek(0)
-            
-            nombre_archivo = f"Reporte_Consumo_{fecha_inicio}_{fecha_fin}.pdf"
-            
-        else:
-            flash("Tipo de reporte no válido", "danger")
-            cursor.close()
-            conn.close()
-            return redirect(url_for('generador_reportes'))
-        
-        cursor.close()
-        conn.close()
-        
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=nombre_archivo
-        )
-        
-    except Exception as e:
-        flash(f"Error al generar PDF: {str(e)}", "danger")
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        parametros = REPORTES['ingresos'].leer_parametros(request.args.get('fecha_inicio'),
+                                                          request.args.get('fecha_fin'))
+    except ValueError as err:
+        flash(str(err), "danger")
         return redirect(url_for('generador_reportes'))
+    
+    exportacion = EXPORTACIONES['pagos']
+    return enviar_exportacion(formato,
+                              nombre_exportacion(exportacion.archivo, formato, parametros['desde'], parametros['hasta']),
+                              exportacion.encabezados, lambda conn: exportacion.abrir(conn, parametros),
+                              url_for('generador_reportes'))
 
 
 @app.route('/reportes/individual')
@@ -1594,7 +1284,7 @@ def exportar_reporte_pdf(tipo_reporte):
 @permiso_required('reportes.ver')
 def reporte_individual_form():
     """Formulario para seleccionar cliente para reporte individual"""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         flash("Error de conexión", "danger")
         return redirect(url_for('generador_reportes'))
@@ -1611,9 +1301,6 @@ def reporte_individual_form():
     """)
     clientes = cursor.fetchall()
     
-    cursor.close()
-    conn.close()
-    
     return render_template('reportes/individual_form.html', clientes=clientes)
 
 
@@ -1621,108 +1308,23 @@ def reporte_individual_form():
 @login_required
 @permiso_required('reportes.ver')
 def reporte_individual_cliente(id_cliente):
-    """Generar reporte individual de un cliente"""
-    conn = get_db_connection()
-    if conn is None:
+    """Generar reporte individual de un cliente (ver estado_cuenta.py)"""
+    if get_db() is None:
         flash("Error de conexión", "danger")
         return redirect(url_for('generador_reportes'))
     
-    cursor = conn.cursor(dictionary=True)
-    
     try:
-        # Información del cliente
-        cursor.execute("""
-            SELECT c.*, s.nombre_sector
-            FROM cliente c
-            JOIN sector s ON c.id_sector = s.id_sector
-            WHERE c.id_cliente = %s
-        """, (id_cliente,))
-        cliente = cursor.fetchone()
-        
-        if not cliente:
+        estado = cargar_estado_cuenta(get_db, id_cliente)
+        if estado is None:
             flash("Cliente no encontrado", "danger")
-            cursor.close()
-            conn.close()
             return redirect(url_for('reporte_individual_form'))
         
-        # Historial de lecturas
-        cursor.execute("""
-            SELECT 
-                l.id_lectura,
-                l.fecha_lectura,
-                l.lectura_anterior,
-                l.lectura_actual,
-                l.consumo_m3,
-                l.monto_total,
-                l.estado_pago,
-                CONCAT(u.nombre, ' ', u.apellido) as lector
-            FROM lectura l
-            JOIN usuario u ON l.id_usuario_lector = u.id_usuario
-            WHERE l.id_cliente = %s
-            ORDER BY l.fecha_lectura DESC
-        """, (id_cliente,))
-        lecturas = cursor.fetchall()
-        
-        # Historial de pagos
-        cursor.execute("""
-            SELECT 
-                p.id_pago,
-                p.fecha_pago,
-                p.monto_pagado,
-                l.fecha_lectura,
-                l.consumo_m3,
-                CONCAT(u.nombre, ' ', u.apellido) as receptor
-            FROM pago p
-            JOIN lectura l ON p.id_lectura = l.id_lectura
-            JOIN usuario u ON p.id_usuario_receptor = u.id_usuario
-            WHERE l.id_cliente = %s
-            ORDER BY p.fecha_pago DESC
-        """, (id_cliente,))
-        pagos = cursor.fetchall()
-        
-        # Estadísticas del cliente
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_lecturas,
-                COALESCE(AVG(consumo_m3), 0) as consumo_promedio,
-                COALESCE(MAX(consumo_m3), 0) as consumo_maximo,
-                COALESCE(MIN(consumo_m3), 0) as consumo_minimo,
-                COALESCE(SUM(CASE WHEN estado_pago = 'PENDIENTE' THEN monto_total ELSE 0 END), 0) as deuda_total,
-                COALESCE(SUM(CASE WHEN estado_pago = 'PAGADO' THEN monto_total ELSE 0 END), 0) as total_pagado
-            FROM lectura
-            WHERE id_cliente = %s
-        """, (id_cliente,))
-        estadisticas = cursor.fetchone()
-        
-        # Facturas pendientes
-        cursor.execute("""
-            SELECT 
-                id_lectura,
-                fecha_lectura,
-                consumo_m3,
-                monto_total,
-                DATEDIFF(CURDATE(), fecha_lectura) as dias_mora
-            FROM lectura
-            WHERE id_cliente = %s AND estado_pago = 'PENDIENTE'
-            ORDER BY fecha_lectura ASC
-        """, (id_cliente,))
-        facturas_pendientes = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
         return render_template('reportes/individual_resultado.html',
-                             cliente=cliente,
-                             lecturas=lecturas,
-                             pagos=pagos,
-                             estadisticas=estadisticas,
-                             facturas_pendientes=facturas_pendientes,
-                             fecha_generacion=datetime.now())
+                             fecha_generacion=datetime.now(),
+                             **estado)
         
     except Exception as e:
         flash(f"Error al generar reporte: {str(e)}", "danger")
-        cursor.close()
-        conn.close()
         return redirect(url_for('reporte_individual_form'))
 
 
@@ -1730,117 +1332,87 @@ def reporte_individual_cliente(id_cliente):
 @login_required
 @permiso_required('reportes.ver')
 def exportar_reporte_individual_pdf(id_cliente):
-    """Exportar reporte individual en formato PDF profesional"""
-    conn = get_db_connection()
+    """Encolar el reporte individual en PDF"""
+    return encolar_trabajo('reporte_individual_pdf', {'id_cliente': id_cliente},
+                           url_for('reporte_individual_cliente', id_cliente=id_cliente))
+
+
+@app.route('/reportes/individual/<int:id_cliente>/exportar/<historial>/<formato>')
+@login_required
+@permiso_required('reportes.ver')
+def exportar_historial_cliente(id_cliente, historial, formato):
+    """Exportar el historial completo de lecturas o de pagos de un cliente en CSV o XLSX"""
+    if historial not in ('lecturas', 'pagos'):
+        flash("Historial no válido", "danger")
+        return redirect(url_for('reporte_individual_cliente', id_cliente=id_cliente))
+    
+    exportacion = EXPORTACIONES[f"{historial}_cliente"]
+    return enviar_exportacion(formato, nombre_exportacion(exportacion.archivo, formato, f"cliente_{id_cliente}"),
+                              exportacion.encabezados,
+                              lambda conn: exportacion.abrir(conn, {'id_cliente': id_cliente}),
+                              url_for('reporte_individual_cliente', id_cliente=id_cliente))
+
+
+# --- RUTAS DE TRABAJOS EN SEGUNDO PLANO ---
+
+def trabajo_del_usuario(id_trabajo):
+    """Trabajo de la cola si pertenece al usuario de la sesión (None si no)"""
+    conn = get_db()
     if conn is None:
-        flash("Error de conexión", "danger")
+        return None
+    trabajo = obtener_trabajo(conn, id_trabajo)
+    if trabajo is None or trabajo['id_usuario'] != session.get('user_id'):
+        return None
+    return trabajo
+
+
+def estado_trabajo_json(trabajo):
+    return {
+        'id_trabajo': trabajo['id_trabajo'],
+        'estado': trabajo['estado'],
+        'mensaje': trabajo['mensaje'],
+        'en_espera': int(trabajo['en_espera'] or 0),
+        'nombre_archivo': trabajo['nombre_archivo'],
+        'descarga': (url_for('descargar_trabajo', id_trabajo=trabajo['id_trabajo'])
+                     if trabajo['estado'] == TRABAJO_TERMINADO else None),
+    }
+
+
+@app.route('/trabajos/<int:id_trabajo>')
+@login_required
+def ver_trabajo(id_trabajo):
+    """Página que muestra el avance de un trabajo y ofrece la descarga al terminar"""
+    trabajo = trabajo_del_usuario(id_trabajo)
+    if trabajo is None:
+        flash("Trabajo no encontrado", "danger")
         return redirect(url_for('generador_reportes'))
-    
-    cursor = conn.cursor(dictionary=True)
-    
-    try:
-        # Información del cliente
-        cursor.execute("""
-            SELECT c.*, s.nombre_sector
-            FROM cliente c
-            JOIN sector s ON c.id_sector = s.id_sector
-            WHERE c.id_cliente = %s
-        """, (id_cliente,))
-        cliente = cursor.fetchone()
-        
-        if not cliente:
-            flash("Cliente no encontrado", "danger")
-            cursor.close()
-            conn.close()
-            return redirect(url_for('reporte_individual_form'))
-        
-        # Historial de lecturas
-        cursor.execute("""
-            SELECT 
-                l.id_lectura,
-                l.fecha_lectura,
-                l.lectura_anterior,
-                l.lectura_actual,
-                l.consumo_m3,
-                l.monto_total,
-                l.estado_pago,
-                CONCAT(u.nombre, ' ', u.apellido) as lector
-            FROM lectura l
-            JOIN usuario u ON l.id_usuario_lector = u.id_usuario
-            WHERE l.id_cliente = %s
-            ORDER BY l.fecha_lectura DESC
-        """, (id_cliente,))
-        lecturas = cursor.fetchall()
-        
-        # Historial de pagos
-        cursor.execute("""
-            SELECT 
-                p.id_pago,
-                p.fecha_pago,
-                p.monto_pagado,
-                l.fecha_lectura,
-                l.consumo_m3,
-                CONCAT(u.nombre, ' ', u.apellido) as receptor
-            FROM pago p
-            JOIN lectura l ON p.id_lectura = l.id_lectura
-            JOIN usuario u ON p.id_usuario_receptor = u.id_usuario
-            WHERE l.id_cliente = %s
-            ORDER BY p.fecha_pago DESC
-        """, (id_cliente,))
-        pagos = cursor.fetchall()
-        
-        # Estadísticas del cliente
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_lecturas,
-                COALESCE(AVG(consumo_m3), 0) as consumo_promedio,
-                COALESCE(MAX(consumo_m3), 0) as consumo_maximo,
-                COALESCE(MIN(consumo_m3), 0) as consumo_minimo,
-                COALESCE(SUM(CASE WHEN estado_pago = 'PENDIENTE' THEN monto_total ELSE 0 END), 0) as deuda_total,
-                COALESCE(SUM(CASE WHEN estado_pago = 'PAGADO' THEN monto_total ELSE 0 END), 0) as total_pagado
-            FROM lectura
-            WHERE id_cliente = %s
-        """, (id_cliente,))
-        estadisticas = cursor.fetchone()
-        
-        # Facturas pendientes
-        cursor.execute("""
-            SELECT 
-                id_lectura,
-                fecha_lectura,
-                consumo_m3,
-                monto_total,
-                DATEDIFF(CURDATE(), fecha_lectura) as dias_mora
-            FROM lectura
-            WHERE id_cliente = %s AND estado_pago = 'PENDIENTE'
-            ORDER BY fecha_lectura ASC
-        """, (id_cliente,))
-        facturas_pendientes = cursor.fetchall()
-        
-        # Generar PDF
-        buffer = io.BytesIO()
-        generar_pdf_reporte_individual(buffer, cliente, lecturas, pagos, estadisticas, facturas_pendientes)
-        buffer.seek(0)
-        
-        nombre_archivo = f"Reporte_Individual_{cliente['no_contador']}_{datetime.now().strftime('%Y%m%d')}.pdf"
-        
-        cursor.close()
-        conn.close()
-        
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=nombre_archivo
-        )
-        
-    except Exception as e:
-        flash(f"Error al generar PDF: {str(e)}", "danger")
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
-        return redirect(url_for('reporte_individual_form'))
+    volver = request.args.get('volver', '')
+    if not volver.startswith('/') or volver.startswith('//'):  # Solo rutas de esta aplicación
+        volver = url_for('generador_reportes')
+    return render_template('trabajos/estado.html', trabajo=trabajo,
+                           estado=estado_trabajo_json(trabajo), volver=volver)
+
+
+@app.route('/api/trabajos/<int:id_trabajo>', methods=['GET'])
+@login_required
+def api_estado_trabajo(id_trabajo):
+    """API: estado de un trabajo (la página del trabajo lo consulta periódicamente)"""
+    trabajo = trabajo_del_usuario(id_trabajo)
+    if trabajo is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(estado_trabajo_json(trabajo))
+
+
+@app.route('/trabajos/<int:id_trabajo>/descargar')
+@login_required
+def descargar_trabajo(id_trabajo):
+    """Descargar el resultado de un trabajo terminado"""
+    trabajo = trabajo_del_usuario(id_trabajo)
+    if trabajo is None or trabajo['estado'] != TRABAJO_TERMINADO or not os.path.exists(trabajo['archivo'] or ''):
+        flash("El archivo ya no está disponible; vuelva a generarlo.", "warning")
+        return redirect(url_for('generador_reportes'))
+    return send_file(trabajo['archivo'], mimetype=trabajo['mimetype'], as_attachment=True,
+                     download_name=trabajo['nombre_archivo'])
 
 
 # --- RUTAS DE SECTORES ---
@@ -1849,7 +1421,7 @@ def exportar_reporte_individual_pdf(id_cliente):
 @login_required
 def ver_sectores():
     """Ver clientes por sector."""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None: return redirect(url_for('dashboard'))
     
     cursor = conn.cursor(dictionary=True)
@@ -1867,9 +1439,6 @@ def ver_sectores():
     """)
     sectores = cursor.fetchall()
     
-    cursor.close()
-    conn.close()
-    
     return render_template('sectores/lista.html', sectores=sectores)
 
 
@@ -1877,7 +1446,7 @@ def ver_sectores():
 @login_required
 def obtener_sectores_api():
     """Obtener todos los sectores para uso en API"""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         return jsonify({'error': 'Error de conexión'}), 500
     
@@ -1885,17 +1454,15 @@ def obtener_sectores_api():
     cursor.execute("SELECT id_sector, nombre_sector FROM sector ORDER BY nombre_sector")
     sectores = cursor.fetchall()
     
-    cursor.close()
-    conn.close()
-    
     return jsonify(sectores)
 
 
 @app.route('/sectores/<int:id_sector>')
 @login_required
+@permiso_required('sectores.ver')
 def ver_clientes_sector(id_sector):
-    """Ver clientes de un sector específico."""
-    conn = get_db_connection()
+    """Ver clientes de un sector específico (las filas se piden a /api/listas/clientes_sector)."""
+    conn = get_db()
     if conn is None: return redirect(url_for('ver_sectores'))
     
     cursor = conn.cursor(dictionary=True)
@@ -1906,26 +1473,38 @@ def ver_clientes_sector(id_sector):
     
     if not sector:
         flash("Sector no encontrado", "danger")
-        cursor.close()
-        conn.close()
         return redirect(url_for('ver_sectores'))
     
-    # Obtener clientes del sector
-    cursor.execute("""
-        SELECT c.id_cliente, c.nombre, c.apellido, c.no_contador, c.telefono,
-               COALESCE(SUM(CASE WHEN l.estado_pago = 'PENDIENTE' THEN l.monto_total ELSE 0 END), 0) as deuda
-        FROM cliente c
-        LEFT JOIN lectura l ON c.id_cliente = l.id_cliente
-        WHERE c.id_sector = %s AND c.activo = TRUE
-        GROUP BY c.id_cliente
-        ORDER BY c.nombre, c.apellido
-    """, (id_sector,))
-    clientes = cursor.fetchall()
+    # Totales del sector (en cache hasta que cambien clientes, lecturas o pagos)
+    try:
+        resumen = CLIENTES_SECTOR.resumen(get_db, {'id_sector': id_sector})
+    except mysql.connector.Error as err:
+        flash(f"Error al consultar los clientes del sector: {err}", "danger")
+        resumen = {'cantidad': 0, 'deuda': 0.0, 'con_deuda': 0}
     
-    cursor.close()
-    conn.close()
+    # Consumo de los últimos 12 meses (suma de consumo_mensual de los clientes del sector)
+    hoy = date.today()
+    desde = date(hoy.year, 1, 1) if hoy.month == 12 else date(hoy.year - 1, hoy.month + 1, 1)
+    try:
+        consumo_mensual = consumo_por_mes(conn, id_sector=id_sector, desde=desde, hasta=hoy)
+    except mysql.connector.Error as err:
+        print(f"ERROR consumo mensual del sector {id_sector}: {err}")
+        consumo_mensual = []
     
-    return render_template('sectores/detalle.html', sector=sector, clientes=clientes)
+    return render_template('sectores/detalle.html', sector=sector, resumen=resumen,
+                           consumo_mensual=consumo_mensual)
+
+
+@app.route('/sectores/<int:id_sector>/exportar/<formato>')
+@login_required
+@permiso_required('sectores.ver')
+def exportar_clientes_sector(id_sector, formato):
+    """Exportar el padrón de clientes activos de un sector, con su deuda, en CSV o XLSX"""
+    exportacion = EXPORTACIONES['clientes_sector']
+    return enviar_exportacion(formato, nombre_exportacion(exportacion.archivo, formato, f"sector_{id_sector}"),
+                              exportacion.encabezados,
+                              lambda conn: exportacion.abrir(conn, {'id_sector': id_sector}),
+                              url_for('ver_clientes_sector', id_sector=id_sector))
 
 
 # --- RUTAS DE ADMINISTRACIÓN DE USUARIOS ---
@@ -1934,25 +1513,8 @@ def ver_clientes_sector(id_sector):
 @login_required
 @permiso_required('usuarios.ver')
 def listar_usuarios():
-    """Listar todos los usuarios del sistema (Solo ADMIN)"""
-    conn = get_db_connection()
-    if conn is None: 
-        return redirect(url_for('dashboard'))
-    
-    cursor = conn.cursor(dictionary=True)
-    
-    # Obtener todos los usuarios
-    cursor.execute("""
-        SELECT id_usuario, nombre, apellido, correo_electronico, rol, activo, fecha_creacion
-        FROM usuario
-        ORDER BY fecha_creacion DESC
-    """)
-    usuarios = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    
-    return render_template('admin/usuarios.html', usuarios=usuarios)
+    """Listar todos los usuarios del sistema (las filas se piden a /api/listas/usuarios)"""
+    return render_template('admin/usuarios.html')
 
 
 @app.route('/admin/usuarios/nuevo', methods=['GET'])
@@ -1968,7 +1530,7 @@ def nuevo_usuario_form():
 @permiso_required('usuarios.crear')
 def crear_usuario():
     """Crear nuevo usuario (Solo ADMIN)"""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         flash("Error de conexión a la base de datos.", "danger")
         return redirect(url_for('nuevo_usuario_form'))
@@ -1986,34 +1548,24 @@ def crear_usuario():
     # Validaciones
     if not nombre or not apellido or not email or not password:
         flash("Todos los campos son obligatorios.", "danger")
-        cursor.close()
-        conn.close()
         return redirect(url_for('nuevo_usuario_form'))
     
     if password != password_confirm:
         flash("Las contraseñas no coinciden.", "danger")
-        cursor.close()
-        conn.close()
         return redirect(url_for('nuevo_usuario_form'))
     
     if len(password) < 6:
         flash("La contraseña debe tener al menos 6 caracteres.", "danger")
-        cursor.close()
-        conn.close()
         return redirect(url_for('nuevo_usuario_form'))
     
     if rol not in ['ADMIN', 'LECTOR', 'TESORERO', 'PRESIDENTE']:
         flash("Rol no válido.", "danger")
-        cursor.close()
-        conn.close()
         return redirect(url_for('nuevo_usuario_form'))
     
     # Verificar si el email ya existe
     cursor.execute("SELECT id_usuario FROM usuario WHERE correo_electronico = %s", (email,))
     if cursor.fetchone():
         flash(f"El correo electrónico {email} ya está registrado.", "danger")
-        cursor.close()
-        conn.close()
         return redirect(url_for('nuevo_usuario_form'))
     
     # Generar hash de contraseña
@@ -2025,19 +1577,17 @@ def crear_usuario():
             INSERT INTO usuario (nombre, apellido, correo_electronico, contrasena_hash, rol)
             VALUES (%s, %s, %s, %s, %s)
         """, (nombre, apellido, email, password_hash, rol))
+        incrementar_version(cursor, 'usuarios')
         
         conn.commit()
+        forzar_relectura()
         
         flash(f"Usuario {nombre} {apellido} creado exitosamente con rol {rol}.", "success")
-        cursor.close()
-        conn.close()
         return redirect(url_for('listar_usuarios'))
         
     except mysql.connector.Error as err:
         flash(f"Error al crear usuario: {err}", "danger")
         conn.rollback()
-        cursor.close()
-        conn.close()
         return redirect(url_for('nuevo_usuario_form'))
 
 
@@ -2051,7 +1601,7 @@ def toggle_usuario(id_usuario):
         flash("No puedes desactivar tu propia cuenta.", "warning")
         return redirect(url_for('listar_usuarios'))
     
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         flash("Error de conexión a la base de datos.", "danger")
         return redirect(url_for('listar_usuarios'))
@@ -2065,14 +1615,15 @@ def toggle_usuario(id_usuario):
         
         if not usuario:
             flash("Usuario no encontrado.", "danger")
-            cursor.close()
-            conn.close()
             return redirect(url_for('listar_usuarios'))
         
         # Cambiar estado
         nuevo_estado = not usuario['activo']
         cursor.execute("UPDATE usuario SET activo = %s WHERE id_usuario = %s", (nuevo_estado, id_usuario))
+        incrementar_version(cursor, 'permisos')
+        incrementar_version(cursor, 'usuarios')
         conn.commit()
+        invalidar_cache_permisos(id_usuario)
         
         estado_texto = "activado" if nuevo_estado else "desactivado"
         flash(f"Usuario {usuario['nombre']} {usuario['apellido']} {estado_texto} exitosamente.", "success")
@@ -2080,9 +1631,6 @@ def toggle_usuario(id_usuario):
     except mysql.connector.Error as err:
         flash(f"Error al cambiar estado del usuario: {err}", "danger")
         conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
     
     return redirect(url_for('listar_usuarios'))
 
@@ -2094,7 +1642,7 @@ def obtener_usuario(id_usuario):
     if not tiene_permiso(session.get('user_id'), 'usuarios.editar'):
         return jsonify({'error': 'No tienes permiso para esta acción'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         return jsonify({'error': 'Error de conexión'}), 500
     
@@ -2106,9 +1654,6 @@ def obtener_usuario(id_usuario):
     """, (id_usuario,))
     usuario = cursor.fetchone()
     
-    cursor.close()
-    conn.close()
-    
     if not usuario:
         return jsonify({'error': 'Usuario no encontrado'}), 404
     
@@ -2123,7 +1668,7 @@ def actualizar_usuario(id_usuario):
         return jsonify({'error': 'No tienes permiso para esta acción'}), 403
     
     data = request.json
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         return jsonify({'error': 'Error de conexión'}), 500
     
@@ -2144,8 +1689,6 @@ def actualizar_usuario(id_usuario):
             WHERE correo_electronico = %s AND id_usuario != %s
         """, (data['correo_electronico'], id_usuario))
         if cursor.fetchone():
-            cursor.close()
-            conn.close()
             return jsonify({'error': 'El correo electrónico ya está registrado en otro usuario'}), 400
         
         # Actualizar usuario (sin cambiar contraseña)
@@ -2156,6 +1699,8 @@ def actualizar_usuario(id_usuario):
             WHERE id_usuario = %s
         """, (data['nombre'], data['apellido'], data['correo_electronico'], 
               data['rol'], id_usuario))
+        incrementar_version(cursor, 'permisos')
+        incrementar_version(cursor, 'usuarios')
         
         # Si el usuario modificado es el mismo que está logueado y cambió su rol, actualizar sesión
         if id_usuario == session.get('user_id'):
@@ -2165,19 +1710,14 @@ def actualizar_usuario(id_usuario):
             print(f"DEBUG: Sesión actualizada para usuario {id_usuario} (rol: {data['rol']})")
         
         conn.commit()
-        cursor.close()
-        conn.close()
+        invalidar_cache_permisos(id_usuario)
         
         return jsonify({'success': True, 'message': 'Usuario actualizado exitosamente'})
     except mysql.connector.Error as err:
         conn.rollback()
-        cursor.close()
-        conn.close()
         return jsonify({'error': str(err)}), 400
     except Exception as e:
         conn.rollback()
-        cursor.close()
-        conn.close()
         return jsonify({'error': f'Error inesperado: {str(e)}'}), 500
 
 
@@ -2186,7 +1726,7 @@ def actualizar_usuario(id_usuario):
 @permiso_required('usuarios.cambiar_password')
 def cambiar_password_usuario(id_usuario):
     """Cambiar contraseña de un usuario (Solo ADMIN)"""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         flash("Error de conexión a la base de datos.", "danger")
         return redirect(url_for('listar_usuarios'))
@@ -2199,8 +1739,6 @@ def cambiar_password_usuario(id_usuario):
     
     if not usuario:
         flash("Usuario no encontrado.", "danger")
-        cursor.close()
-        conn.close()
         return redirect(url_for('listar_usuarios'))
     
     if request.method == 'POST':
@@ -2210,14 +1748,10 @@ def cambiar_password_usuario(id_usuario):
         # Validaciones
         if nueva_password != password_confirm:
             flash("Las contraseñas no coinciden.", "danger")
-            cursor.close()
-            conn.close()
             return render_template('admin/cambiar_password.html', usuario=usuario)
         
         if len(nueva_password) < 6:
             flash("La contraseña debe tener al menos 6 caracteres.", "danger")
-            cursor.close()
-            conn.close()
             return render_template('admin/cambiar_password.html', usuario=usuario)
         
         # Actualizar contraseña
@@ -2232,19 +1766,13 @@ def cambiar_password_usuario(id_usuario):
             conn.commit()
             
             flash(f"Contraseña actualizada para {usuario['nombre']} {usuario['apellido']}.", "success")
-            cursor.close()
-            conn.close()
             return redirect(url_for('listar_usuarios'))
             
         except mysql.connector.Error as err:
             flash(f"Error al actualizar contraseña: {err}", "danger")
             conn.rollback()
-            cursor.close()
-            conn.close()
             return render_template('admin/cambiar_password.html', usuario=usuario)
     
-    cursor.close()
-    conn.close()
     return render_template('admin/cambiar_password.html', usuario=usuario)
 
 
@@ -2255,7 +1783,7 @@ def cambiar_password_usuario(id_usuario):
 @permiso_required('usuarios.permisos')
 def gestionar_permisos_usuario(id_usuario):
     """Gestionar permisos de un usuario específico"""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         flash("Error de conexión a la base de datos.", "danger")
         return redirect(url_for('listar_usuarios'))
@@ -2268,8 +1796,6 @@ def gestionar_permisos_usuario(id_usuario):
     
     if not usuario:
         flash("Usuario no encontrado.", "danger")
-        cursor.close()
-        conn.close()
         return redirect(url_for('listar_usuarios'))
     
     # Obtener todos los permisos agrupados por módulo
@@ -2299,9 +1825,6 @@ def gestionar_permisos_usuario(id_usuario):
         permiso['tiene_permiso'] = permiso['id_permiso'] in permisos_usuario
         permisos_por_modulo[modulo].append(permiso)
     
-    cursor.close()
-    conn.close()
-    
     return render_template('admin/permisos.html', 
                          usuario=usuario, 
                          permisos_por_modulo=permisos_por_modulo,
@@ -2313,7 +1836,7 @@ def gestionar_permisos_usuario(id_usuario):
 @permiso_required('usuarios.permisos')
 def actualizar_permisos_usuario(id_usuario):
     """Actualizar permisos de un usuario"""
-    conn = get_db_connection()
+    conn = get_db()
     if conn is None:
         flash("Error de conexión a la base de datos.", "danger")
         return redirect(url_for('listar_usuarios'))
@@ -2333,8 +1856,6 @@ def actualizar_permisos_usuario(id_usuario):
         
         if not usuario:
             flash("Usuario no encontrado.", "danger")
-            cursor.close()
-            conn.close()
             return redirect(url_for('listar_usuarios'))
         
         # Eliminar todos los permisos actuales del usuario
@@ -2354,7 +1875,9 @@ def actualizar_permisos_usuario(id_usuario):
         else:
             print("DEBUG: No se seleccionaron permisos")
         
+        incrementar_version(cursor, 'permisos')
         conn.commit()
+        invalidar_cache_permisos(id_usuario)
         
         # Actualizar sesión de TODOS los usuarios que puedan estar logueados
         # Si el usuario modificado es el mismo que está logueado, actualizar su sesión
@@ -2375,18 +1898,70 @@ def actualizar_permisos_usuario(id_usuario):
         flash(f"Error inesperado: {str(e)}", "danger")
         conn.rollback()
         print(f"ERROR INESPERADO: {e}")
-    finally:
-        cursor.close()
-        conn.close()
     
     return redirect(url_for('gestionar_permisos_usuario', id_usuario=id_usuario))
 
 
+@app.route('/admin/refacturacion', methods=['GET', 'POST'])
+@login_required
+@permiso_required('lecturas.refacturar')
+def refacturacion():
+    """Recalcular las facturas pendientes con las tarifas vigentes"""
+    conn = get_db()
+    if conn is None:
+        return redirect(url_for('dashboard'))
+
+    if request.method == 'POST':
+        accion = request.form.get('accion')
+        try:
+            if accion == 'iniciar':
+                id_refacturacion = iniciar_refacturacion(
+                    conn,
+                    simulacion=request.form.get('simulacion') == '1',
+                    fecha_tarifa=request.form.get('fecha_tarifa') or None,
+                    id_usuario=session['user_id'])
+            else:
+                id_refacturacion = int(request.form.get('id_refacturacion', 0))
+
+            if accion == 'cancelar':
+                if cancelar_refacturacion(conn, id_refacturacion):
+                    flash(f"Refacturación #{id_refacturacion} cancelada. Los lotes ya procesados se conservan.", "warning")
+                return redirect(url_for('refacturacion', id=id_refacturacion))
+
+            # Se procesa por tramos de tiempo para no retener el worker; el
+            # avance queda guardado y se continúa con el botón "Continuar"
+            trabajo = ejecutar_refacturacion(conn, id_refacturacion,
+                                             limite_segundos=Config.REFACTURACION_LIMITE_WEB)
+            if trabajo['estado'] == ESTADO_EN_CURSO:
+                flash(f"Refacturación #{id_refacturacion}: {trabajo['lecturas_revisadas']} facturas revisadas. "
+                      f"Presione Continuar para seguir.", "info")
+            else:
+                flash(f"Refacturación #{id_refacturacion} terminada: {trabajo['lecturas_cambiadas']} de "
+                      f"{trabajo['lecturas_revisadas']} facturas {'cambiarían' if trabajo['simulacion'] else 'actualizadas'}.",
+                      "success")
+        except (mysql.connector.Error, ValueError) as err:
+            conn.rollback()
+            flash(f"Error en la refacturación: {err}", "danger")
+            print(f"ERROR refacturacion: {err}")
+            return redirect(url_for('refacturacion'))
+        return redirect(url_for('refacturacion', id=id_refacturacion))
+
+    try:
+        trabajos = listar_refacturaciones(conn)
+        seleccionado = request.args.get('id', type=int)
+        if seleccionado is None and trabajos:
+            seleccionado = trabajos[0]['id_refacturacion']
+        trabajo = obtener_refacturacion(conn, seleccionado) if seleccionado else None
+    except mysql.connector.Error as err:
+        flash(f"Error al consultar refacturaciones: {err}", "danger")
+        trabajos, trabajo = [], None
+
+    return render_template('admin/refacturacion.html', trabajos=trabajos, trabajo=trabajo,
+                           tarifa=tarifa_vigente(get_db))
 
 
 # --- Ejecución de la Aplicación ---
 if __name__ == '__main__':
-    import os
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
     app.run(debug=debug, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,103 @@
+# avisos.py - Avisos de cobro por lotes al inicio de cada ciclo
+"""
+Un aviso de cobro por cada lectura pendiente de un rango de fechas, para
+repartirlos impresos por sector.
+
+- seleccionar_avisos() trae en una sola consulta las lecturas pendientes del
+  rango (y opcionalmente de un sector), ordenadas por sector y contador.
+- generar_avisos() reparte las páginas en partes de AVISOS_POR_PARTE dentro
+  de cada sector y las dibuja en el pool de procesos compartido de
+  renderizado_pdf.py: ReportLab es Python puro y con hilos no aprovecharía
+  más de un núcleo, y un pool por lote multiplicaría los procesos cuando
+  hay varios lotes a la vez.
+- El resultado se escribe en un archivo temporal (en el directorio que
+  indique quien llama) a medida que terminan las partes: un PDF si todo cabe en una parte, o un ZIP con un PDF por sector
+  (varios si el sector es muy grande).
+"""
+
+import os
+import re
+import tempfile
+import time
+import zipfile
+from itertools import groupby
+
+from config import Config
+from renderizado_pdf import Filas, renderizar_partes
+
+COLUMNAS_AVISO = ('id_lectura', 'fecha_lectura', 'lectura_anterior', 'lectura_actual', 'consumo_m3',
+                  'monto_total', 'nombre', 'apellido', 'no_contador', 'id_sector', 'nombre_sector')
+
+
+def seleccionar_avisos(conn, fecha_inicio, fecha_fin, id_sector=None):
+    """Lecturas pendientes del rango como tuplas (ver COLUMNAS_AVISO)"""
+    condicion_sector = "AND c.id_sector = %s" if id_sector else ""
+    parametros = [fecha_inicio, fecha_fin] + ([id_sector] if id_sector else [])
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT l.id_lectura, l.fecha_lectura, l.lectura_anterior, l.lectura_actual, l.consumo_m3,
+                   l.monto_total, c.nombre, c.apellido, c.no_contador, s.id_sector, s.nombre_sector
+            FROM lectura l
+            JOIN cliente c ON l.id_cliente = c.id_cliente
+            JOIN sector s ON c.id_sector = s.id_sector
+            WHERE l.estado_pago = 'PENDIENTE' AND l.fecha_lectura BETWEEN %s AND %s {condicion_sector}
+            ORDER BY s.nombre_sector, s.id_sector, c.no_contador, l.fecha_lectura
+        """, parametros)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def _partes(filas):
+    """Divide las filas en (nombre de archivo, filas), por sector y en partes de AVISOS_POR_PARTE"""
+    por_parte = Config.AVISOS_POR_PARTE
+    indice_sector = COLUMNAS_AVISO.index('id_sector')
+    for _, grupo in groupby(filas, key=lambda fila: fila[indice_sector]):
+        grupo = list(grupo)
+        sector = re.sub(r'[^\w-]+', '_', grupo[0][-1]).strip('_') or f"sector_{grupo[0][indice_sector]}"
+        for numero, inicio in enumerate(range(0, len(grupo), por_parte), start=1):
+            sufijo = f"_parte{numero}" if len(grupo) > por_parte else ""
+            yield f"Avisos_{sector}{sufijo}.pdf", grupo[inicio:inicio + por_parte]
+
+
+def generar_avisos(conn, fecha_inicio, fecha_fin, id_sector=None, directorio=None):
+    """
+    Genera los avisos del rango en un archivo temporal de `directorio` (el
+    temporal del sistema si es None).
+
+    Devuelve (ruta, es_zip, cantidad de avisos). Quien llama debe borrar el
+    archivo. ValueError si no hay lecturas pendientes en el rango o si son
+    más de AVISOS_MAX.
+    """
+    inicio = time.perf_counter()
+    filas = seleccionar_avisos(conn, fecha_inicio, fecha_fin, id_sector)
+    if not filas:
+        raise ValueError("No hay lecturas pendientes en ese rango de fechas")
+    if len(filas) > Config.AVISOS_MAX:
+        raise ValueError(f"Son {len(filas)} avisos; el máximo por lote es {Config.AVISOS_MAX}. "
+                         "Reduzca el rango de fechas o elija un sector.")
+
+    partes = list(_partes(filas))
+    del filas
+    es_zip = len(partes) > 1
+
+    descriptor, ruta = tempfile.mkstemp(prefix='avisos_', suffix='.zip' if es_zip else '.pdf', dir=directorio)
+    pdfs = renderizar_partes('avisos', [[Filas(COLUMNAS_AVISO, filas_parte)] for _, filas_parte in partes])
+    try:
+        with os.fdopen(descriptor, 'wb') as archivo:
+            if es_zip:
+                with zipfile.ZipFile(archivo, 'w', zipfile.ZIP_DEFLATED) as zip_avisos:
+                    for (nombre, _), pdf in zip(partes, pdfs):
+                        zip_avisos.writestr(nombre, pdf)
+            else:
+                archivo.write(next(iter(pdfs)))
+    except BaseException:
+        os.remove(ruta)
+        raise
+    finally:
+        pdfs.close()
+
+    cantidad = sum(len(filas_parte) for _, filas_parte in partes)
+    print(f"DEBUG avisos: {cantidad} avisos en {len(partes)} partes, {time.perf_counter() - inicio:.1f} s")
+    return ruta, es_zip, cantidad
@@ -0,0 +1,379 @@
+# busqueda.py - Índice en memoria para el autocompletado de clientes
+"""
+Índice de búsqueda de clientes activos por nombre, apellido y número de
+contador.
+
+Cada worker mantiene un índice de n-gramas (bigramas y trigramas) sobre el
+texto normalizado (minúsculas y sin tildes) de los clientes activos. Una
+búsqueda obtiene los candidatos intersectando las listas de n-gramas de cada
+palabra de la consulta, verifica la coincidencia y ordena por relevancia, sin
+recorrer toda la tabla cliente.
+
+El índice se mantiene al día con la tabla cliente_cambio: cada escritura en
+cliente agrega una fila con el id del cliente modificado en la misma
+transacción, y los workers aplican esos cambios de forma incremental (como
+máximo cada VERSIONES_INTERVALO segundos). Cada BUSQUEDA_INDICE_TTL segundos
+el índice se recarga completo por seguridad.
+
+Cada entrada guarda además la última lectura del cliente. En el mismo paso,
+si el sello 'lecturas' cambió desde la sincronización anterior, se leen de
+cliente_ultima_lectura solo las filas con un sello_lecturas mayor al ya
+aplicado (ver lecturas.py): cada transacción anota en las filas que cambia
+el valor del sello que incrementó, y esos valores crecen en orden de
+commit. El sello se lee antes que las filas, así que ninguna transacción
+confirmada se pierde, sin importar cuánto tardó en confirmar. Así el
+autocompletado se responde por completo desde memoria.
+
+Los resultados de autocompletar se guardan en una cache LRU por consulta
+normalizada. Una consulta que extiende a otra ya guardada ("mar" -> "mari")
+se resuelve filtrando el resultado guardado, sin volver al índice. La cache
+se vacía cuando cambia algún cliente; las lecturas nuevas no la invalidan
+porque los resultados guardados apuntan a las mismas entradas del índice,
+que ya tienen la última lectura al día.
+"""
+
+import heapq
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+from cache import CacheLRU, incrementar_version, version_actual
+from config import Config
+
+_SQL_CLIENTES = """
+    SELECT c.id_cliente, c.nombre, c.apellido, c.no_contador, c.activo, s.nombre_sector,
+           ul.lectura_actual AS ultima_lectura
+    FROM cliente c
+    JOIN sector s ON c.id_sector = s.id_sector
+    LEFT JOIN cliente_ultima_lectura ul ON ul.id_cliente = c.id_cliente
+"""
+
+
+def normalizar(texto):
+    """Minúsculas, sin tildes y con espacios simples"""
+    if texto is None:
+        return ''
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    texto = ''.join(caracter for caracter in texto if not unicodedata.combining(caracter))
+    return ' '.join(texto.split())
+
+
+def _ngramas(palabra):
+    """Bigramas y trigramas de una palabra"""
+    gramas = set()
+    for n in (2, 3):
+        for i in range(len(palabra) - n + 1):
+            gramas.add(palabra[i:i + n])
+    return gramas
+
+
+def registrar_cambio_cliente(cursor, id_cliente):
+    """
+    Anota en cliente_cambio que un cliente fue creado o modificado e
+    incrementa el sello 'clientes' (misma transacción).
+    """
+    cursor.execute("INSERT INTO cliente_cambio (id_cliente) VALUES (%s)", (id_cliente,))
+    incrementar_version(cursor, 'clientes')
+
+
+class IndiceClientes:
+    """Índice de n-gramas de los clientes activos de un worker"""
+
+    def __init__(self):
+        self._clientes = {}                  # id_cliente -> entrada
+        self._gramas = defaultdict(set)      # n-grama -> {id_cliente}
+        self._ultimo_cambio = None           # último id_cambio aplicado
+        self._version_lecturas = None        # sello 'lecturas' de las últimas lecturas cargadas
+        self._sincronizado_en = None
+        self._cargado_en = None
+        self._lock = threading.RLock()
+
+        # Cache de resultados de autocompletar: consulta normalizada -> entradas
+        self._resultados = CacheLRU(max_entradas=Config.BUSQUEDA_CACHE_MAX)
+        self._generacion = 0                 # cambia cada vez que se vacía la cache
+        self.aciertos = 0
+        self.aciertos_prefijo = 0
+        self.fallos = 0
+
+    # --- Mantenimiento ---
+
+    def _crear_entrada(self, fila):
+        nombre = normalizar(fila['nombre'])
+        apellido = normalizar(fila['apellido'])
+        contador = normalizar(fila['no_contador'])
+        return {
+            'id': fila['id_cliente'],
+            'nombre': fila['nombre'],
+            'apellido': fila['apellido'],
+            'no_contador': fila['no_contador'],
+            'sector': fila['nombre_sector'],
+            'nombre_norm': f"{nombre} {apellido}".strip(),
+            'contador_norm': contador,
+            'texto': f"{nombre} {apellido} {contador}".strip(),
+            'palabras': tuple(f"{nombre} {apellido} {contador}".split()),
+            'ultima_lectura': float(fila['ultima_lectura'] or 0),
+        }
+
+    def _agregar(self, fila):
+        self._quitar(fila['id_cliente'])
+        if not fila['activo']:
+            return
+        entrada = self._crear_entrada(fila)
+        self._clientes[entrada['id']] = entrada
+        for palabra in entrada['palabras']:
+            for grama in _ngramas(palabra):
+                self._gramas[grama].add(entrada['id'])
+
+    def _quitar(self, id_cliente):
+        entrada = self._clientes.pop(id_cliente, None)
+        if entrada is None:
+            return
+        for palabra in entrada['palabras']:
+            for grama in _ngramas(palabra):
+                ids = self._gramas.get(grama)
+                if ids is not None:
+                    ids.discard(id_cliente)
+                    if not ids:
+                        del self._gramas[grama]
+
+    def cargar(self, conn):
+        """Recarga el índice completo desde la BD"""
+        cursor = conn.cursor(dictionary=True)
+        # Primero la posición del registro de cambios: lo que cambie durante la
+        # carga se vuelve a aplicar en la siguiente sincronización
+        cursor.execute("SELECT COALESCE(MAX(id_cambio), 0) AS ultimo FROM cliente_cambio")
+        ultimo_cambio = cursor.fetchone()['ultimo']
+        version_lecturas = version_actual(lambda: conn, 'lecturas')
+        cursor.execute(_SQL_CLIENTES + " WHERE c.activo = TRUE")
+        filas = cursor.fetchall()
+
+        with self._lock:
+            self._clientes = {}
+            self._gramas = defaultdict(set)
+            for fila in filas:
+                self._agregar(fila)
+            ahora = time.monotonic()
+            self._ultimo_cambio = ultimo_cambio
+            self._version_lecturas = version_lecturas
+            self._sincronizado_en = ahora
+            self._cargado_en = ahora
+            self._vaciar_resultados()
+        print(f"DEBUG busqueda: Índice cargado con {len(filas)} clientes")
+
+    def aplicar_cambios(self, conn):
+        """Aplica los cambios registrados en cliente_cambio desde la última sincronización"""
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT id_cambio, id_cliente FROM cliente_cambio
+            WHERE id_cambio > %s
+            ORDER BY id_cambio
+        """, (self._ultimo_cambio,))
+        cambios = cursor.fetchall()
+        if not cambios:
+            return set()
+
+        ids = sorted({cambio['id_cliente'] for cambio in cambios})
+        marcadores = ', '.join(['%s'] * len(ids))
+        cursor.execute(_SQL_CLIENTES + f" WHERE c.id_cliente IN ({marcadores})", ids)
+        filas = {fila['id_cliente']: fila for fila in cursor.fetchall()}
+
+        with self._lock:
+            for id_cliente in ids:
+                if id_cliente in filas:
+                    self._agregar(filas[id_cliente])
+                else:
+                    self._quitar(id_cliente)
+            self._ultimo_cambio = cambios[-1]['id_cambio']
+            self._vaciar_resultados()
+        return set(ids)
+
+    def aplicar_lecturas(self, conn):
+        """
+        Si el sello 'lecturas' cambió desde la sincronización anterior,
+        actualiza la última lectura de los clientes que cambiaron desde
+        entonces. Devuelve el número de filas leídas (0 si no hizo falta).
+        """
+        version = version_actual(lambda: conn, 'lecturas')
+        if version is None or version == self._version_lecturas:
+            return 0
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id_cliente, lectura_actual FROM cliente_ultima_lectura
+            WHERE sello_lecturas > %s AND sello_lecturas <= %s
+        """, (self._version_lecturas or 0, version))
+        filas = cursor.fetchall()
+
+        with self._lock:
+            for id_cliente, lectura_actual in filas:
+                entrada = self._clientes.get(id_cliente)
+                if entrada is not None:
+                    entrada['ultima_lectura'] = float(lectura_actual)
+            self._version_lecturas = version
+        return len(filas)
+
+    def sincronizar(self, obtener_conn):
+        """
+        Deja el índice al día si corresponde.
+
+        Devuelve el conjunto de clientes que cambiaron (o None si se recargó
+        completo); no consulta la BD si la última sincronización es reciente.
+        """
+        ahora = time.monotonic()
+        if self._cargado_en is None or ahora - self._cargado_en >= Config.BUSQUEDA_INDICE_TTL:
+            conn = obtener_conn()
+            if conn is not None:
+                self.cargar(conn)
+            return None
+
+        if self._sincronizado_en is not None and ahora - self._sincronizado_en < Config.VERSIONES_INTERVALO:
+            return set()
+
+        conn = obtener_conn()
+        if conn is None:
+            return set()
+        cambios = self.aplicar_cambios(conn)
+        self.aplicar_lecturas(conn)
+        self._sincronizado_en = time.monotonic()
+        return cambios
+
+    def forzar_sincronizacion(self):
+        """Hace que la próxima búsqueda aplique los cambios pendientes de inmediato"""
+        self._sincronizado_en = None
+
+    # --- Consulta ---
+
+    def _candidatos(self, palabras):
+        """Ids cuyo texto contiene todas las palabras de la consulta"""
+        resultado = None
+        for palabra in palabras:
+            if len(palabra) < 2:
+                continue
+            n = 2 if len(palabra) == 2 else 3
+            listas = [self._gramas.get(palabra[i:i + n], ()) for i in range(len(palabra) - n + 1)]
+            listas.sort(key=len)
+            ids = set(listas[0])
+            for lista in listas[1:]:
+                ids &= lista
+                if not ids:
+                    break
+            resultado = ids if resultado is None else resultado & ids
+            if not resultado:
+                return set()
+        return resultado if resultado is not None else set()
+
+    def _puntaje(self, entrada, consulta, palabras):
+        """Menor es mejor: contador exacto, prefijos y por último coincidencia parcial"""
+        if entrada['contador_norm'] == consulta:
+            return 0
+        if entrada['contador_norm'].startswith(consulta):
+            return 1
+        if entrada['nombre_norm'].startswith(consulta):
+            return 2
+        if all(any(p.startswith(palabra) for p in entrada['palabras']) for palabra in palabras):
+            return 3
+        return 4
+
+    def filtrar(self, entradas, consulta, limite=None):
+        """
+        Entradas que contienen todas las palabras de la consulta, ordenadas por
+        relevancia y luego por nombre (todas si limite es None).
+        """
+        consulta = normalizar(consulta)
+        palabras = consulta.split()
+        coincidencias = (
+            (self._puntaje(entrada, consulta, palabras), entrada['nombre_norm'], entrada['id'], entrada)
+            for entrada in entradas
+            if all(palabra in entrada['texto'] for palabra in palabras)
+        )
+        if limite is None:
+            ordenadas = sorted(coincidencias, key=lambda fila: fila[:3])
+        else:
+            ordenadas = heapq.nsmallest(limite, coincidencias, key=lambda fila: fila[:3])
+        return [fila[3] for fila in ordenadas]
+
+    def buscar(self, consulta, limite=None):
+        """Busca clientes activos por nombre, apellido o número de contador"""
+        palabras = normalizar(consulta).split()
+        if not palabras:
+            return []
+
+        with self._lock:
+            ids = self._candidatos(palabras)
+            entradas = [self._clientes[id_cliente] for id_cliente in ids if id_cliente in self._clientes]
+        return self.filtrar(entradas, consulta, limite)
+
+    # --- Cache de resultados ---
+
+    def _vaciar_resultados(self):
+        with self._lock:
+            self._generacion += 1
+            self._resultados.limpiar()
+
+    def _resultado_prefijo(self, clave):
+        """Resultado guardado de la consulta más larga que es prefijo de `clave`"""
+        for fin in range(len(clave) - 1, 1, -1):
+            prefijo = clave[:fin]
+            if prefijo.endswith(' '):
+                continue
+            entradas = self._resultados.obtener(prefijo)
+            if entradas is not None:
+                return entradas
+        return None
+
+    def autocompletar(self, consulta, limite=10):
+        """
+        Igual que buscar(), pero usando la cache de resultados.
+
+        Si la consulta ya está guardada se responde directamente; si extiende a
+        una consulta guardada se filtra ese resultado (quien contiene "mari"
+        también contiene "mar"); en otro caso se busca en el índice.
+        """
+        clave = normalizar(consulta)
+        if not clave:
+            return []
+
+        with self._lock:
+            generacion = self._generacion
+
+        entradas = self._resultados.obtener(clave)
+        if entradas is not None:
+            with self._lock:
+                self.aciertos += 1
+            return entradas[:limite]
+
+        base = self._resultado_prefijo(clave)
+        if base is not None:
+            entradas = self.filtrar(base, clave)
+            with self._lock:
+                self.aciertos_prefijo += 1
+        else:
+            entradas = self.buscar(clave)
+            with self._lock:
+                self.fallos += 1
+
+        # No guardar resultados calculados con el índice anterior a un cambio
+        with self._lock:
+            if generacion == self._generacion:
+                self._resultados.guardar(clave, entradas)
+        return entradas[:limite]
+
+    def estadisticas(self):
+        """Contadores de la cache de autocompletar"""
+        with self._lock:
+            consultas = self.aciertos + self.aciertos_prefijo + self.fallos
+            return {
+                'clientes_indexados': len(self._clientes),
+                'consultas_en_cache': len(self._resultados),
+                'max_consultas': self._resultados.max_entradas,
+                'aciertos': self.aciertos,
+                'aciertos_prefijo': self.aciertos_prefijo,
+                'fallos': self.fallos,
+                'tasa_aciertos': round((self.aciertos + self.aciertos_prefijo) / consultas, 4) if consultas else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._clientes)
+
+
+indice_clientes = IndiceClientes()
@@ -0,0 +1,284 @@
+# cache.py - Caches en memoria del proceso y sellos de versión compartidos entre workers
+"""
+Utilidades de cache para la aplicación.
+
+- CacheLRU: cache en memoria del proceso con límite de entradas (LRU) y
+  expiración opcional por tiempo.
+- CacheArchivos: cache en disco de archivos que no cambian (recibos PDF),
+  compartida por todos los workers del servidor, con límite de tamaño (LRU).
+- Sellos de versión: la tabla version_cache guarda un contador por tipo de
+  dato (permisos, clientes, lecturas, ...). Quien modifica esos datos
+  incrementa el contador en la misma transacción; los demás workers releen
+  la tabla como máximo cada VERSIONES_INTERVALO segundos y descartan lo que
+  tengan guardado con una versión anterior.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import mysql.connector
+
+from config import Config
+
+
+class CacheLRU:
+    """Cache en memoria con política LRU y expiración opcional (ttl en segundos)"""
+
+    def __init__(self, max_entradas=1024, ttl=None):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._datos = OrderedDict()  # clave -> (valor, expira_en)
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, defecto=None):
+        """Devuelve el valor guardado o `defecto` si no existe o ya expiró"""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return defecto
+
+            valor, expira_en = entrada
+            if expira_en is not None and expira_en < time.monotonic():
+                del self._datos[clave]
+                self.fallos += 1
+                return defecto
+
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave, valor):
+        """Guarda un valor, descartando el menos usado si se supera el límite"""
+        expira_en = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._datos[clave] = (valor, expira_en)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def descartar(self, clave):
+        """Elimina una entrada si existe"""
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def descartar_si(self, condicion):
+        """Elimina las entradas para las que condicion(clave, valor) es verdadera"""
+        with self._lock:
+            claves = [clave for clave, (valor, _) in self._datos.items() if condicion(clave, valor)]
+            for clave in claves:
+                del self._datos[clave]
+            return len(claves)
+
+    def limpiar(self):
+        """Elimina todas las entradas"""
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self):
+        """Contadores de uso de la cache"""
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._datos),
+                'max_entradas': self.max_entradas,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': round(self.aciertos / consultas, 4) if consultas else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class CacheArchivos:
+    """
+    Cache en disco de archivos inmutables, un archivo por clave.
+
+    La clave debe servir como nombre de archivo y cambiar si cambia el
+    contenido (por ejemplo, incluir la versión de la plantilla). Cada uso
+    actualiza la fecha de modificación del archivo; cuando el directorio pasa
+    de max_bytes se borran los archivos usados hace más tiempo.
+
+    Los archivos se escriben en un temporal y se renombran al terminar, así
+    que varios workers pueden compartir el directorio sin ver archivos a medias.
+    """
+
+    # Cada cuántas escrituras se vuelve a medir el directorio completo
+    REVISAR_CADA = 100
+
+    def __init__(self, directorio, max_bytes, extension=''):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.aciertos = 0
+        self.fallos = 0
+        self._bytes = None  # Tamaño estimado del directorio (None: hay que medirlo)
+        self._escrituras = 0
+        self._lock = threading.Lock()
+
+    def ruta(self, clave):
+        return os.path.join(self.directorio, clave + self.extension)
+
+    def obtener(self, clave):
+        """Ruta del archivo guardado con esa clave, o None si no está"""
+        ruta = self.ruta(clave)
+        try:
+            os.utime(ruta)  # Marca el archivo como usado recientemente
+        except FileNotFoundError:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        return ruta
+
+    def guardar(self, clave, generar):
+        """
+        Crea el archivo de la clave llamando a generar(archivo), que recibe un
+        archivo binario abierto para escribir. Devuelve la ruta del archivo.
+        """
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta = self.ruta(clave)
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as archivo:
+                generar(archivo)
+            tamano = os.path.getsize(temporal)
+            os.replace(temporal, ruta)
+        except BaseException:
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            self._escrituras += 1
+            if self._bytes is not None:
+                self._bytes += tamano
+            medir = (self._bytes is None or self._bytes > self.max_bytes
+                     or self._escrituras % self.REVISAR_CADA == 0)
+        if medir:
+            self._recortar()
+        return ruta
+
+    def obtener_o_generar(self, clave, generar):
+        """Ruta del archivo de la clave, creándolo con generar() si no existe"""
+        return self.obtener(clave) or self.guardar(clave, generar)
+
+    def _recortar(self):
+        """Mide el directorio y borra los archivos menos usados si pasa del límite"""
+        archivos = []
+        total = 0
+        with os.scandir(self.directorio) as entradas:
+            for entrada in entradas:
+                if not entrada.name.endswith(self.extension) or entrada.name.endswith('.tmp'):
+                    continue
+                try:
+                    datos = entrada.stat()
+                except FileNotFoundError:  # Lo borró otro worker
+                    continue
+                archivos.append((datos.st_mtime, datos.st_size, entrada.path))
+                total += datos.st_size
+
+        if total > self.max_bytes:
+            archivos.sort()
+            borrados = 0
+            for _, tamano, ruta in archivos:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(ruta)
+                    borrados += 1
+                except FileNotFoundError:
+                    pass
+                total -= tamano
+            print(f"DEBUG CacheArchivos {self.directorio}: {borrados} archivos descartados")
+
+        with self._lock:
+            self._bytes = total
+
+    def estadisticas(self):
+        """Contadores de uso de la cache"""
+        consultas = self.aciertos + self.fallos
+        return {
+            'directorio': self.directorio,
+            'bytes_estimados': self._bytes,
+            'max_bytes': self.max_bytes,
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'tasa_aciertos': round(self.aciertos / consultas, 4) if consultas else 0.0,
+        }
+
+
+# --- Sellos de versión compartidos entre workers ---
+
+_versiones = {}
+_versiones_leidas_en = None
+_versiones_lock = threading.Lock()
+
+
+def versiones_actuales(obtener_conn):
+    """
+    Devuelve {nombre: version} de la tabla version_cache.
+
+    La tabla se relee como máximo cada VERSIONES_INTERVALO segundos; entre
+    lecturas se devuelve la copia en memoria sin consultar la BD (ni pedir
+    conexión: obtener_conn solo se llama si hay que releer). Devuelve None
+    si no se pudo leer, en cuyo caso quien llama no debe usar su cache.
+    """
+    global _versiones, _versiones_leidas_en
+
+    ahora = time.monotonic()
+    with _versiones_lock:
+        if _versiones_leidas_en is not None and ahora - _versiones_leidas_en < Config.VERSIONES_INTERVALO:
+            return _versiones
+
+    conn = obtener_conn()
+    if conn is None:
+        return None
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT nombre, version FROM version_cache")
+        versiones = {nombre: version for nombre, version in cursor.fetchall()}
+    except mysql.connector.Error as err:
+        print(f"ERROR al leer version_cache: {err}")
+        return None
+
+    with _versiones_lock:
+        _versiones = versiones
+        _versiones_leidas_en = ahora
+    return versiones
+
+
+def version_actual(obtener_conn, nombre):
+    """Versión vigente de un tipo de dato (None si no se pudo leer)"""
+    versiones = versiones_actuales(obtener_conn)
+    if versiones is None:
+        return None
+    return versiones.get(nombre, 0)
+
+
+def incrementar_version(cursor, nombre):
+    """
+    Incrementa la versión de un tipo de dato dentro de la transacción en curso.
+
+    Después de confirmar la transacción se debe llamar a forzar_relectura()
+    para que este mismo worker vea la nueva versión de inmediato.
+    """
+    cursor.execute("""
+        INSERT INTO version_cache (nombre, version) VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, (nombre,))
+
+
+def forzar_relectura():
+    """Obliga a releer version_cache en la próxima consulta de versiones"""
+    global _versiones_leidas_en
+    with _versiones_lock:
+        _versiones_leidas_en = None
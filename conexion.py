@@ -0,0 +1,121 @@
+# conexion.py - Pool de conexiones MySQL compartido por la aplicación y las utilidades
+"""
+Pool de conexiones MySQL por proceso.
+
+Cada worker de gunicorn crea su propio pool la primera vez que necesita una
+conexión (el pool no se comparte entre procesos después de un fork). Al
+pedir una conexión el pool verifica que el socket siga vivo y reconecta si
+el servidor la cerró por inactividad. Cerrar la conexión (conn.close())
+la devuelve al pool en lugar de cerrar el socket.
+"""
+
+import os
+import random
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError, InterfaceError, OperationalError
+
+from config import Config
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _parametros_conexion():
+    """Parámetros de conexión comunes a las conexiones del pool y las directas"""
+    return {
+        'host': Config.DB_HOST,
+        'port': Config.DB_PORT,
+        'user': Config.DB_USER,
+        'password': Config.DB_PASSWORD,
+        'database': Config.DB_NAME,
+        'connection_timeout': Config.DB_CONNECT_TIMEOUT,
+    }
+
+
+def obtener_pool():
+    """Obtiene (o crea) el pool de conexiones del proceso actual"""
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = pooling.MySQLConnectionPool(
+                pool_name=f"{Config.DB_POOL_NAME}_{pid}",
+                pool_size=Config.DB_POOL_SIZE,
+                pool_reset_session=Config.DB_POOL_RESET_SESSION,
+                **_parametros_conexion()
+            )
+            _pool_pid = pid
+            print(f"DEBUG conexion: Pool '{_pool.pool_name}' creado con {Config.DB_POOL_SIZE} conexiones")
+    return _pool
+
+
+def obtener_conexion():
+    """
+    Obtiene una conexión del pool.
+
+    El pool hace un ping a la conexión antes de entregarla y reconecta si el
+    socket está caído. Si la reconexión falla se reintenta hasta
+    DB_POOL_REINTENTOS veces. Si el pool está agotado se espera hasta
+    DB_POOL_ESPERA segundos y, si sigue sin haber conexiones libres, se abre
+    una conexión directa fuera del pool para no rechazar la petición.
+
+    Lanza mysql.connector.Error si no es posible conectar.
+    """
+    pool = obtener_pool()
+    limite_espera = time.monotonic() + Config.DB_POOL_ESPERA
+    intentos = 0
+
+    while True:
+        try:
+            return pool.get_connection()
+        except PoolError:
+            if time.monotonic() < limite_espera:
+                time.sleep(0.05)
+                continue
+            print("ADVERTENCIA conexion: Pool agotado, abriendo conexión directa")
+            return mysql.connector.connect(**_parametros_conexion())
+        except (InterfaceError, OperationalError) as err:
+            # Socket obsoleto que no se pudo reconectar; el pool ya recuperó la conexión
+            intentos += 1
+            if intentos > Config.DB_POOL_REINTENTOS:
+                raise
+            print(f"ADVERTENCIA conexion: Reintentando conexión ({intentos}): {err}")
+            time.sleep(0.1 * intentos)
+
+
+# Errores con los que MySQL aborta una transacción por contención de filas;
+# se resuelven repitiéndola completa: ER_LOCK_DEADLOCK y ER_LOCK_WAIT_TIMEOUT
+ERRORES_REINTENTABLES = (1213, 1205)
+
+
+def ejecutar_con_reintentos(conn, transaccion):
+    """
+    Ejecuta transaccion(conn) y la repite si MySQL la abortó por un
+    interbloqueo o por esperar demasiado un bloqueo de fila.
+
+    La transacción debe poder repetirse desde el principio y hacer su propio
+    commit. Entre intentos se revierte y se espera un tiempo creciente con
+    algo de azar, para que las transacciones que chocaron no vuelvan a
+    coincidir. Después de DB_REINTENTOS_BLOQUEO intentos se lanza el error.
+    """
+    intento = 0
+    while True:
+        try:
+            return transaccion(conn)
+        except mysql.connector.Error as err:
+            if err.errno not in ERRORES_REINTENTABLES or intento >= Config.DB_REINTENTOS_BLOQUEO:
+                raise
+            conn.rollback()
+            intento += 1
+            espera = Config.DB_REINTENTO_ESPERA * 2 ** (intento - 1) * random.uniform(0.5, 1.5)
+            print(f"ADVERTENCIA conexion: {err.msg}; reintento {intento} en {espera:.2f} s")
+            time.sleep(espera)
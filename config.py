@@ -1,5 +1,6 @@
 # config.py
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Cargar variables de entorno desde .env
@@ -23,4 +24,64 @@ class Config:
     SESSION_COOKIE_SECURE = os.environ.get('SESSION_COOKIE_SECURE', 'False').lower() == 'true'  # Cambiar a True en producción con HTTPS
     SESSION_COOKIE_HTTPONLY = os.environ.get('SESSION_COOKIE_HTTPONLY', 'True').lower() == 'true'
     SESSION_COOKIE_SAMESITE = os.environ.get('SESSION_COOKIE_SAMESITE') or 'Lax'
-    PERMANENT_SESSION_LIFETIME = int(os.environ.get('PERMANENT_SESSION_LIFETIME') or 3600)  # 1 hora
\ No newline at end of file
+    PERMANENT_SESSION_LIFETIME = int(os.environ.get('PERMANENT_SESSION_LIFETIME') or 3600)  # 1 hora
+
+    # Pool de conexiones MySQL (uno por worker de gunicorn)
+    DB_POOL_NAME = os.environ.get('DB_POOL_NAME') or 'gestion_agua'
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)  # Máximo 32 (límite de mysql-connector)
+    DB_POOL_RESET_SESSION = os.environ.get('DB_POOL_RESET_SESSION', 'True').lower() == 'true'
+    DB_POOL_ESPERA = float(os.environ.get('DB_POOL_ESPERA') or 2)  # Segundos de espera si el pool está agotado
+    DB_POOL_REINTENTOS = int(os.environ.get('DB_POOL_REINTENTOS') or 2)  # Reintentos al reconectar sockets caídos
+    DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT') or 10)
+    DB_REINTENTOS_BLOQUEO = int(os.environ.get('DB_REINTENTOS_BLOQUEO') or 3)  # Reintentos tras un interbloqueo o espera de bloqueo
+    DB_REINTENTO_ESPERA = float(os.environ.get('DB_REINTENTO_ESPERA') or 0.05)  # Segundos antes del primer reintento
+
+    # Caches en memoria (por worker) y sellos de versión compartidos
+    VERSIONES_INTERVALO = float(os.environ.get('VERSIONES_INTERVALO') or 2)  # Segundos entre lecturas de version_cache
+    PERMISOS_CACHE_TTL = int(os.environ.get('PERMISOS_CACHE_TTL') or 300)  # Segundos
+    PERMISOS_CACHE_MAX = int(os.environ.get('PERMISOS_CACHE_MAX') or 1000)  # Usuarios en cache
+    BUSQUEDA_INDICE_TTL = int(os.environ.get('BUSQUEDA_INDICE_TTL') or 600)  # Segundos entre recargas completas del índice de clientes
+    BUSQUEDA_CACHE_MAX = int(os.environ.get('BUSQUEDA_CACHE_MAX') or 512)  # Consultas de autocompletado en cache
+    LISTADOS_CONTEO_TTL = int(os.environ.get('LISTADOS_CONTEO_TTL') or 300)  # Segundos que se guardan los totales de los listados
+    LISTADOS_CONTEO_MAX = int(os.environ.get('LISTADOS_CONTEO_MAX') or 256)  # Combinaciones de filtros con totales en cache
+    LISTADOS_MAX_FILAS = int(os.environ.get('LISTADOS_MAX_FILAS') or 100)  # Filas máximas por página de un listado
+
+    # Resultados de los reportes, compartidos por la tabla, el PDF y las exportaciones
+    REPORTES_CACHE_TTL = int(os.environ.get('REPORTES_CACHE_TTL') or 120)  # Segundos que se guarda un resultado
+    REPORTES_CACHE_MAX = int(os.environ.get('REPORTES_CACHE_MAX') or 32)  # Resultados guardados por worker
+    ESTADO_CUENTA_CACHE_TTL = int(os.environ.get('ESTADO_CUENTA_CACHE_TTL') or 300)  # Segundos que se guarda el reporte individual de un cliente
+    ESTADO_CUENTA_CACHE_MAX = int(os.environ.get('ESTADO_CUENTA_CACHE_MAX') or 200)  # Clientes guardados por worker
+
+    # Exportaciones CSV/XLSX (se envían por partes, sin cargar todas las filas)
+    EXPORTAR_LOTE = int(os.environ.get('EXPORTAR_LOTE') or 2000)  # Filas que se leen de la BD por vez
+
+    RECIBOS_CACHE_DIR = os.environ.get('RECIBOS_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'recibos_cache')
+    RECIBOS_CACHE_MAX_MB = int(os.environ.get('RECIBOS_CACHE_MAX_MB') or 200)  # Tamaño máximo de los recibos PDF en disco
+
+    # Importación masiva de lecturas
+    LECTURAS_IMPORTACION_LOTE = int(os.environ.get('LECTURAS_IMPORTACION_LOTE') or 500)  # Filas por transacción
+
+    # Cobro de varias facturas de un cliente en una sola operación
+    PAGOS_MAX_FACTURAS = int(os.environ.get('PAGOS_MAX_FACTURAS') or 36)  # Facturas por cobro
+
+    # Avisos de cobro por lotes
+    AVISOS_MAX = int(os.environ.get('AVISOS_MAX') or 20000)  # Avisos por lote
+    AVISOS_POR_PARTE = int(os.environ.get('AVISOS_POR_PARTE') or 500)  # Páginas por PDF (y por tarea del pool)
+
+    # Pool de procesos que dibuja los reportes PDF grandes y los avisos (ver renderizado_pdf.py)
+    PDF_PROCESOS = int(os.environ.get('PDF_PROCESOS') or 2)  # 0: dibujar siempre en el mismo proceso
+    PDF_TAREAS_POR_PROCESO = int(os.environ.get('PDF_TAREAS_POR_PROCESO') or 50)  # Reportes antes de reemplazar el proceso
+    PDF_FILAS_EN_PROCESO = int(os.environ.get('PDF_FILAS_EN_PROCESO') or 300)  # Con menos filas no se usa el pool
+
+    # Trabajos en segundo plano (PDF de reportes, avisos de cobro)
+    TRABAJOS_DIR = os.environ.get('TRABAJOS_DIR') or os.path.join(tempfile.gettempdir(), 'trabajos')
+    TRABAJOS_HILOS = int(os.environ.get('TRABAJOS_HILOS') or 1)  # Trabajos simultáneos por proceso
+    TRABAJOS_MAX_SIMULTANEOS = int(os.environ.get('TRABAJOS_MAX_SIMULTANEOS') or 2)  # Trabajos simultáneos en el servidor
+    TRABAJOS_INTERVALO = float(os.environ.get('TRABAJOS_INTERVALO') or 5)  # Segundos entre revisiones de la cola
+    TRABAJOS_EXPIRACION_HORAS = int(os.environ.get('TRABAJOS_EXPIRACION_HORAS') or 24)  # Horas que se guarda el resultado
+    TRABAJOS_TIEMPO_MAX = int(os.environ.get('TRABAJOS_TIEMPO_MAX') or 1800)  # Segundos antes de dar por perdido un trabajo
+
+    # Refacturación de facturas pendientes
+    REFACTURACION_LOTE = int(os.environ.get('REFACTURACION_LOTE') or 1000)  # Lecturas por transacción
+    REFACTURACION_PAUSA = float(os.environ.get('REFACTURACION_PAUSA') or 0.05)  # Segundos entre lotes
+    REFACTURACION_LIMITE_WEB = int(os.environ.get('REFACTURACION_LIMITE_WEB') or 20)  # Segundos por petición
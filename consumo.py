@@ -0,0 +1,174 @@
+# consumo.py - Consumo y facturación por mes, por cliente y por sector
+"""
+Consumo y facturación por cliente y mes (tabla consumo_mensual): suma,
+mínimo y máximo de m³, cantidad de lecturas y monto facturado.
+
+Quien inserta o modifica lecturas llama a refrescar_consumo_mensual() en la
+misma transacción, antes del commit: se recalculan desde las lecturas los
+meses del cliente a partir del mes más antiguo que cambió. Recalcular (en
+lugar de sumar diferencias) mantiene exactos el mínimo y el máximo cuando
+se edita una lectura.
+
+Antes de tocar las lecturas de un cliente se bloquea su fila de
+cliente_ultima_lectura (obtener_ultima_lectura(bloquear=True) o
+bloquear_ultimas_lecturas(), en orden de id_cliente): es el único bloqueo
+que toman todos los que escriben lecturas, y como cada fila de
+consumo_mensual es de un solo cliente, los registros de clientes distintos
+no se esperan entre sí.
+
+Los totales por sector no se guardan (una fila por sector y mes obligaría a
+turnarse a todos los lectores del sector): consumo_por_mes() los suma desde
+consumo_mensual, una fila por cliente y mes en lugar de todas sus lecturas.
+
+El reporte de consumo usa los meses completos del período desde
+consumo_mensual y solo lee lecturas sueltas para los días de los meses
+incompletos de los extremos (ver meses_completos()).
+"""
+
+from datetime import datetime, timedelta
+
+from cache import incrementar_version
+
+# Primer día del mes de l.fecha_lectura
+_MES_LECTURA = "DATE_SUB(l.fecha_lectura, INTERVAL DAYOFMONTH(l.fecha_lectura) - 1 DAY)"
+
+
+def _marcadores(valores):
+    return ', '.join(['%s'] * len(valores))
+
+
+def inicio_mes(fecha):
+    """Primer día del mes de `fecha` (date o 'YYYY-MM-DD')"""
+    if isinstance(fecha, str):
+        fecha = datetime.strptime(fecha[:10], '%Y-%m-%d').date()
+    return fecha.replace(day=1)
+
+
+def _mes_siguiente(mes):
+    return (mes.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def meses_completos(parametros):
+    """
+    Agrega a {'desde', 'hasta'} el rango de meses completos del período:
+    mes_desde (incluido) y mes_hasta (excluido). Los días desde..mes_desde
+    y mes_hasta..hasta se leen de las lecturas; si el período no tiene un
+    mes completo, mes_desde = mes_hasta = el día siguiente a hasta.
+    """
+    desde, hasta = parametros['desde'], parametros['hasta']
+    mes_desde = desde if desde.day == 1 else _mes_siguiente(desde)
+    siguiente = hasta + timedelta(days=1)
+    mes_hasta = siguiente if siguiente.day == 1 else inicio_mes(hasta)
+    if mes_desde >= mes_hasta:
+        mes_desde = mes_hasta = siguiente
+    return dict(parametros, mes_desde=mes_desde, mes_hasta=mes_hasta)
+
+
+def refrescar_consumo_mensual(cursor, ids_clientes, desde=None):
+    """
+    Recalcula consumo_mensual de los clientes desde el mes de `desde` (todo
+    su historial si es None).
+
+    Debe ejecutarse en la misma transacción que inserta o modifica las
+    lecturas, con las filas de cliente_ultima_lectura de los clientes ya
+    bloqueadas.
+    """
+    ids_clientes = sorted(set(ids_clientes))
+    if not ids_clientes:
+        return
+    marcadores = _marcadores(ids_clientes)
+    desde_mes, parametros_mes = ("", []) if desde is None else ("AND {} >= %s", [inicio_mes(desde)])
+
+    cursor.execute(f"""
+        INSERT INTO consumo_mensual (id_cliente, mes, consumo_total, consumo_minimo, consumo_maximo,
+                                     lecturas, monto_facturado)
+        SELECT l.id_cliente, {_MES_LECTURA} AS mes, SUM(l.consumo_m3), MIN(l.consumo_m3),
+               MAX(l.consumo_m3), COUNT(*), SUM(l.monto_total)
+        FROM lectura l
+        WHERE l.id_cliente IN ({marcadores}) {desde_mes.format('l.fecha_lectura')}
+        GROUP BY l.id_cliente, mes
+        ON DUPLICATE KEY UPDATE
+            consumo_total = VALUES(consumo_total),
+            consumo_minimo = VALUES(consumo_minimo),
+            consumo_maximo = VALUES(consumo_maximo),
+            lecturas = VALUES(lecturas),
+            monto_facturado = VALUES(monto_facturado)
+    """, ids_clientes + parametros_mes)
+    # Meses que se quedaron sin lecturas (una lectura editada que cambió de mes)
+    cursor.execute(f"""
+        DELETE m FROM consumo_mensual m
+        WHERE m.id_cliente IN ({marcadores}) {desde_mes.format('m.mes')}
+          AND NOT EXISTS (SELECT 1 FROM lectura l
+                          WHERE l.id_cliente = m.id_cliente
+                            AND l.fecha_lectura >= m.mes AND l.fecha_lectura < m.mes + INTERVAL 1 MONTH)
+    """, ids_clientes + parametros_mes)
+
+
+def reconstruir_consumo_mensual(conn):
+    """
+    Reconstruye consumo_mensual completa desde las lecturas. Devuelve la
+    cantidad de filas (cliente y mes). Hace commit al terminar.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM consumo_mensual")
+        cursor.execute(f"""
+            INSERT INTO consumo_mensual (id_cliente, mes, consumo_total, consumo_minimo, consumo_maximo,
+                                         lecturas, monto_facturado)
+            SELECT l.id_cliente, {_MES_LECTURA} AS mes, SUM(l.consumo_m3), MIN(l.consumo_m3),
+                   MAX(l.consumo_m3), COUNT(*), SUM(l.monto_total)
+            FROM lectura l
+            GROUP BY l.id_cliente, mes
+        """)
+        total = cursor.rowcount
+        incrementar_version(cursor, 'lecturas')
+        conn.commit()
+        return total
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def consumo_por_mes(conn, id_sector=None, id_cliente=None, desde=None, hasta=None):
+    """
+    Serie mensual de consumo (para tendencias): de un sector (sus clientes
+    actuales), de un cliente o de todos, entre los meses de `desde` y
+    `hasta` (date, incluidos). Cada fila: mes, consumo_total,
+    consumo_promedio, consumo_minimo, consumo_maximo, lecturas,
+    monto_facturado y clientes (con lecturas en el mes).
+    """
+    unir, condiciones, parametros = "", [], []
+    if id_cliente is not None:
+        condiciones.append("m.id_cliente = %s")
+        parametros.append(id_cliente)
+    if id_sector is not None:
+        unir = "JOIN cliente c ON m.id_cliente = c.id_cliente"
+        condiciones.append("c.id_sector = %s")
+        parametros.append(id_sector)
+    if desde is not None:
+        condiciones.append("m.mes >= %s")
+        parametros.append(inicio_mes(desde))
+    if hasta is not None:
+        condiciones.append("m.mes <= %s")
+        parametros.append(inicio_mes(hasta))
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"""
+            SELECT m.mes, SUM(m.consumo_total) AS consumo_total,
+                   SUM(m.consumo_total) / SUM(m.lecturas) AS consumo_promedio,
+                   MIN(m.consumo_minimo) AS consumo_minimo, MAX(m.consumo_maximo) AS consumo_maximo,
+                   CAST(SUM(m.lecturas) AS SIGNED) AS lecturas, SUM(m.monto_facturado) AS monto_facturado,
+                   COUNT(*) AS clientes
+            FROM consumo_mensual m
+            {unir}
+            {where}
+            GROUP BY m.mes
+            ORDER BY m.mes
+        """, parametros)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
@@ -0,0 +1,280 @@
+-- database_rendimiento.sql
+-- Tablas auxiliares para caches, índices y agregados del sistema.
+-- Ejecutar después de database.sql y database_permisos.sql:
+--   mysql -u root -p gestion_agua < database_rendimiento.sql
+
+-- Sellos de versión compartidos entre workers (ver cache.py)
+CREATE TABLE IF NOT EXISTS version_cache (
+    nombre VARCHAR(50) NOT NULL PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    actualizado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB;
+
+INSERT IGNORE INTO version_cache (nombre, version) VALUES ('permisos', 0), ('lecturas', 0), ('pagos', 0);
+
+-- Puntero a la última lectura de cada cliente (ver lecturas.py)
+CREATE TABLE IF NOT EXISTS cliente_ultima_lectura (
+    id_cliente INT NOT NULL PRIMARY KEY,
+    id_lectura INT NOT NULL,
+    lectura_actual DECIMAL(10,2) NOT NULL,
+    fecha_lectura DATE NOT NULL,
+    actualizado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT fk_ultima_lectura_cliente FOREIGN KEY (id_cliente) REFERENCES cliente(id_cliente),
+    CONSTRAINT fk_ultima_lectura_lectura FOREIGN KEY (id_lectura) REFERENCES lectura(id_lectura)
+) ENGINE=InnoDB;
+
+-- Índice para recalcular la última lectura de un cliente sin ordenar todo su historial
+-- (omitir si el índice ya existe)
+CREATE INDEX idx_lectura_cliente_fecha ON lectura (id_cliente, fecha_lectura, id_lectura);
+
+-- Carga inicial del puntero (equivale a: python utilidades.py reconstruir-ultimas-lecturas)
+INSERT INTO cliente_ultima_lectura (id_cliente, id_lectura, lectura_actual, fecha_lectura)
+SELECT id_cliente, id_lectura, lectura_actual, fecha_lectura
+FROM (
+    SELECT id_cliente, id_lectura, lectura_actual, fecha_lectura,
+           ROW_NUMBER() OVER (PARTITION BY id_cliente ORDER BY fecha_lectura DESC, id_lectura DESC) AS posicion
+    FROM lectura
+) ordenadas
+WHERE posicion = 1
+ON DUPLICATE KEY UPDATE
+    id_lectura = VALUES(id_lectura),
+    lectura_actual = VALUES(lectura_actual),
+    fecha_lectura = VALUES(fecha_lectura);
+
+-- Registro de clientes creados o modificados, para actualizar de forma
+-- incremental el índice de búsqueda de cada worker (ver busqueda.py).
+-- Las filas antiguas se pueden borrar sin riesgo: los workers recargan el
+-- índice completo cada BUSQUEDA_INDICE_TTL segundos.
+CREATE TABLE IF NOT EXISTS cliente_cambio (
+    id_cambio BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    id_cliente INT NOT NULL,
+    fecha_cambio TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB;
+
+
+-- Esquemas de tarifas (ver facturacion.py). Cada esquema tiene bloques de
+-- consumo contiguos desde 0 m³ (hasta_m3 NULL = sin límite) y cargos fijos.
+-- Se aplica el esquema activo con la mayor vigente_desde que no sea
+-- posterior a la fecha de la lectura. Después de modificar estas tablas
+-- ejecutar: python utilidades.py publicar-tarifas
+CREATE TABLE IF NOT EXISTS tarifa_esquema (
+    id_esquema INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    nombre VARCHAR(100) NOT NULL,
+    consumo_negativo ENUM('CREDITO', 'SOLO_CARGO_FIJO') NOT NULL DEFAULT 'CREDITO',
+    vigente_desde DATE NOT NULL,
+    activo BOOLEAN NOT NULL DEFAULT TRUE,
+    fecha_creacion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS tarifa_bloque (
+    id_bloque INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    id_esquema INT NOT NULL,
+    desde_m3 DECIMAL(10,2) NOT NULL,
+    hasta_m3 DECIMAL(10,2) NULL,
+    precio_m3 DECIMAL(10,4) NOT NULL,
+    UNIQUE KEY uk_tarifa_bloque (id_esquema, desde_m3),
+    CONSTRAINT fk_tarifa_bloque_esquema FOREIGN KEY (id_esquema) REFERENCES tarifa_esquema(id_esquema)
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS tarifa_cargo (
+    id_cargo INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    id_esquema INT NOT NULL,
+    concepto VARCHAR(100) NOT NULL,
+    monto DECIMAL(10,2) NOT NULL,
+    CONSTRAINT fk_tarifa_cargo_esquema FOREIGN KEY (id_esquema) REFERENCES tarifa_esquema(id_esquema)
+) ENGINE=InnoDB;
+
+-- Tarifa vigente hasta ahora: Q2 por m³ hasta 25 m³ y Q4 por m³ de exceso
+INSERT INTO tarifa_esquema (id_esquema, nombre, consumo_negativo, vigente_desde)
+SELECT 1, 'Tarifa inicial', 'CREDITO', '2000-01-01'
+FROM DUAL WHERE NOT EXISTS (SELECT 1 FROM tarifa_esquema);
+
+INSERT INTO tarifa_bloque (id_esquema, desde_m3, hasta_m3, precio_m3)
+SELECT 1, 0, 25, 2.00 FROM DUAL WHERE NOT EXISTS (SELECT 1 FROM tarifa_bloque)
+UNION ALL
+SELECT 1, 25, NULL, 4.00 FROM DUAL WHERE NOT EXISTS (SELECT 1 FROM tarifa_bloque);
+
+INSERT IGNORE INTO version_cache (nombre, version) VALUES ('tarifas', 0);
+
+-- Trabajos de refacturación de facturas pendientes (ver refacturacion.py).
+-- Cada lote confirmado guarda aquí su avance para poder reanudar.
+CREATE TABLE IF NOT EXISTS refacturacion (
+    id_refacturacion INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    estado ENUM('EN_CURSO', 'TERMINADA', 'CANCELADA') NOT NULL DEFAULT 'EN_CURSO',
+    simulacion BOOLEAN NOT NULL DEFAULT FALSE,
+    fecha_tarifa DATE NULL,
+    ultimo_id_lectura INT NOT NULL DEFAULT 0,
+    lecturas_revisadas INT NOT NULL DEFAULT 0,
+    lecturas_cambiadas INT NOT NULL DEFAULT 0,
+    monto_anterior DECIMAL(14,2) NOT NULL DEFAULT 0,
+    monto_nuevo DECIMAL(14,2) NOT NULL DEFAULT 0,
+    muestra TEXT NULL,
+    id_usuario INT NULL,
+    iniciada_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    actualizada_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    terminada_en TIMESTAMP NULL
+) ENGINE=InnoDB;
+
+-- Recorrer las facturas pendientes por id sin leer las pagadas
+-- (omitir si el índice ya existe)
+CREATE INDEX idx_lectura_estado_id ON lectura (estado_pago, id_lectura);
+
+-- Permiso para ejecutar la refacturación, asignado a los administradores
+INSERT INTO permiso (codigo_permiso, nombre_permiso, descripcion, modulo)
+SELECT 'lecturas.refacturar', 'Refacturar pendientes',
+       'Recalcular el monto de las facturas pendientes con las tarifas vigentes', 'lecturas'
+FROM DUAL WHERE NOT EXISTS (SELECT 1 FROM permiso WHERE codigo_permiso = 'lecturas.refacturar');
+
+INSERT INTO usuario_permiso (id_usuario, id_permiso, asignado_por)
+SELECT u.id_usuario, p.id_permiso, u.id_usuario
+FROM usuario u
+JOIN permiso p ON p.codigo_permiso = 'lecturas.refacturar'
+WHERE u.rol = 'ADMIN'
+  AND NOT EXISTS (SELECT 1 FROM usuario_permiso up
+                  WHERE up.id_usuario = u.id_usuario AND up.id_permiso = p.id_permiso);
+
+UPDATE version_cache SET version = version + 1 WHERE nombre = 'permisos';
+
+-- Listado paginado de facturas pendientes ordenado por fecha o monto
+-- (omitir los índices que ya existan)
+CREATE INDEX idx_lectura_estado_fecha ON lectura (estado_pago, fecha_lectura);
+CREATE INDEX idx_lectura_estado_monto ON lectura (estado_pago, monto_total);
+
+-- Listados paginados en el servidor (ver listas.py): sellos de versión de
+-- clientes y usuarios para los totales en cache, e índices para filtrar por
+-- sector, buscar por prefijo del nombre y acotar los reportes por fecha
+-- (omitir los índices que ya existan)
+INSERT IGNORE INTO version_cache (nombre, version) VALUES ('clientes', 0), ('usuarios', 0);
+
+CREATE INDEX idx_cliente_sector_activo ON cliente (id_sector, activo);
+CREATE INDEX idx_cliente_nombre ON cliente (nombre, apellido);
+CREATE INDEX idx_pago_fecha ON pago (fecha_pago);
+
+-- Cobro de varias facturas de un cliente en una sola operación (ver pagos.py).
+-- Cada pago del grupo apunta a su pago_grupo; los pagos individuales quedan con NULL.
+CREATE TABLE IF NOT EXISTS pago_grupo (
+    id_pago_grupo INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    id_cliente INT NOT NULL,
+    cantidad_facturas INT NOT NULL,
+    monto_total DECIMAL(10,2) NOT NULL,
+    id_usuario_receptor INT NULL,
+    fecha_pago TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_pago_grupo_cliente (id_cliente, fecha_pago),
+    CONSTRAINT fk_pago_grupo_cliente FOREIGN KEY (id_cliente) REFERENCES cliente(id_cliente),
+    CONSTRAINT fk_pago_grupo_usuario FOREIGN KEY (id_usuario_receptor) REFERENCES usuario(id_usuario)
+) ENGINE=InnoDB;
+
+-- (omitir si la columna ya existe)
+ALTER TABLE pago
+    ADD COLUMN id_pago_grupo INT NULL,
+    ADD INDEX idx_pago_grupo (id_pago_grupo),
+    ADD CONSTRAINT fk_pago_pago_grupo FOREIGN KEY (id_pago_grupo) REFERENCES pago_grupo(id_pago_grupo);
+
+-- Cobros simultáneos (ver pagos.py).
+-- Una factura solo puede tener un pago. Antes de crear el índice, revisar que no
+-- haya pagos duplicados:
+--   SELECT id_lectura, COUNT(*) FROM pago GROUP BY id_lectura HAVING COUNT(*) > 1;
+-- (omitir si el índice ya existe)
+CREATE UNIQUE INDEX uk_pago_lectura ON pago (id_lectura);
+
+-- Claves de idempotencia de los formularios de cobro: si el mismo formulario
+-- llega dos veces se devuelve el pago ya registrado en vez de cobrar de nuevo.
+-- Las filas antiguas se pueden borrar sin problema, por ejemplo:
+--   DELETE FROM pago_solicitud WHERE creado_en < NOW() - INTERVAL 30 DAY;
+CREATE TABLE IF NOT EXISTS pago_solicitud (
+    clave VARCHAR(64) NOT NULL PRIMARY KEY,
+    id_usuario INT NULL,
+    id_pago INT NULL,
+    id_pago_grupo INT NULL,
+    creado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_pago_solicitud_creado (creado_en)
+) ENGINE=InnoDB;
+
+-- Trabajos en segundo plano: PDF de reportes y avisos de cobro (ver trabajos.py).
+-- El archivo de resultado vive en TRABAJOS_DIR hasta expira_en.
+CREATE TABLE IF NOT EXISTS trabajo (
+    id_trabajo INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    tipo VARCHAR(40) NOT NULL,
+    parametros TEXT NOT NULL,
+    estado ENUM('PENDIENTE', 'EN_CURSO', 'TERMINADO', 'ERROR', 'EXPIRADO') NOT NULL DEFAULT 'PENDIENTE',
+    id_usuario INT NULL,
+    mensaje VARCHAR(500) NULL,
+    archivo VARCHAR(255) NULL,
+    nombre_archivo VARCHAR(200) NULL,
+    mimetype VARCHAR(100) NULL,
+    creado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    iniciado_en TIMESTAMP NULL,
+    terminado_en TIMESTAMP NULL,
+    expira_en TIMESTAMP NULL,
+    INDEX idx_trabajo_estado (estado, id_trabajo),
+    INDEX idx_trabajo_usuario (id_usuario, creado_en),
+    CONSTRAINT fk_trabajo_usuario FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario)
+) ENGINE=InnoDB;
+
+-- Ingresos por día y cajero receptor (ver pagos.py). Cada cobro suma su monto
+-- en la misma transacción; el reporte de ingresos lee esta tabla en lugar de
+-- agrupar todos los pagos del período.
+CREATE TABLE IF NOT EXISTS ingreso_diario (
+    fecha DATE NOT NULL,
+    id_usuario_receptor INT NOT NULL,
+    total DECIMAL(14,2) NOT NULL DEFAULT 0,
+    cantidad INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (fecha, id_usuario_receptor),
+    CONSTRAINT fk_ingreso_diario_usuario FOREIGN KEY (id_usuario_receptor) REFERENCES usuario(id_usuario)
+) ENGINE=InnoDB;
+
+-- Carga inicial (equivale a: python utilidades.py reconstruir-ingresos)
+INSERT INTO ingreso_diario (fecha, id_usuario_receptor, total, cantidad)
+SELECT DATE(fecha_pago), id_usuario_receptor, SUM(monto_pagado), COUNT(*)
+FROM pago
+GROUP BY DATE(fecha_pago), id_usuario_receptor
+ON DUPLICATE KEY UPDATE
+    total = VALUES(total),
+    cantidad = VALUES(cantidad);
+
+-- Consumo por cliente y mes (ver consumo.py). Se recalcula desde las lecturas
+-- en la misma transacción que las registra, edita o refactura; el reporte de
+-- consumo lee los meses completos del período de aquí, y los totales por
+-- sector se suman desde aquí con los clientes de cada sector.
+CREATE TABLE IF NOT EXISTS consumo_mensual (
+    id_cliente INT NOT NULL,
+    mes DATE NOT NULL,
+    consumo_total DECIMAL(14,2) NOT NULL DEFAULT 0,
+    consumo_minimo DECIMAL(12,2) NOT NULL DEFAULT 0,
+    consumo_maximo DECIMAL(12,2) NOT NULL DEFAULT 0,
+    lecturas INT NOT NULL DEFAULT 0,
+    monto_facturado DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (id_cliente, mes),
+    INDEX idx_consumo_mensual_mes (mes),
+    CONSTRAINT fk_consumo_mensual_cliente FOREIGN KEY (id_cliente) REFERENCES cliente(id_cliente)
+) ENGINE=InnoDB;
+
+-- Días sueltos de los extremos del período en el reporte de consumo
+-- (omitir si el índice ya existe)
+CREATE INDEX idx_lectura_fecha ON lectura (fecha_lectura);
+
+-- Carga inicial (equivale a: python utilidades.py reconstruir-consumo)
+INSERT INTO consumo_mensual (id_cliente, mes, consumo_total, consumo_minimo, consumo_maximo,
+                             lecturas, monto_facturado)
+SELECT id_cliente, DATE_SUB(fecha_lectura, INTERVAL DAYOFMONTH(fecha_lectura) - 1 DAY) AS mes,
+       SUM(consumo_m3), MIN(consumo_m3), MAX(consumo_m3), COUNT(*), SUM(monto_total)
+FROM lectura
+GROUP BY id_cliente, mes;
+
+-- Versión de las lecturas de cada cliente: la incrementa cada lectura
+-- registrada, editada, importada o refacturada. El estado de cuenta en cache
+-- de un cliente se descarta cuando cambia (ver estado_cuenta.py).
+-- (omitir si la columna ya existe)
+ALTER TABLE cliente_ultima_lectura ADD COLUMN version INT NOT NULL DEFAULT 0;
+
+-- Tipo de cobro de cada clave de idempotencia ('FACTURA' o 'GRUPO'): una
+-- clave usada en un tipo de cobro y reenviada al otro se rechaza (ver pagos.py)
+-- (omitir si la columna ya existe)
+ALTER TABLE pago_solicitud ADD COLUMN tipo VARCHAR(10) NULL AFTER id_usuario;
+
+-- Sello 'lecturas' de la última transacción que cambió el puntero de cada
+-- cliente: el índice de búsqueda lee solo las filas con un sello mayor al que
+-- ya aplicó (ver lecturas.py y busqueda.py)
+-- (omitir si la columna ya existe)
+ALTER TABLE cliente_ultima_lectura ADD COLUMN sello_lecturas BIGINT UNSIGNED NOT NULL DEFAULT 0;
+CREATE INDEX idx_ultima_lectura_sello ON cliente_ultima_lectura (sello_lecturas);
@@ -0,0 +1,157 @@
+# estado_cuenta.py - Estado de cuenta de un cliente (reporte individual)
+"""
+Datos del reporte individual de un cliente, compartidos por la página HTML
+y el PDF: el cliente, su historial de lecturas y de pagos, las estadísticas
+y las facturas pendientes.
+
+Solo se consultan el cliente y los dos historiales; las estadísticas y las
+facturas pendientes se calculan en Python desde el historial de lecturas,
+que ya trae todas las lecturas del cliente, en lugar de volver a recorrer
+lectura dos veces más.
+
+El resultado se guarda por cliente en cache_estados. La clave lleva las
+marcas de ese cliente, leídas con una consulta por índices (_MARCAS): la
+última modificación del cliente, la versión y fecha de su fila de
+cliente_ultima_lectura (cambian con cada lectura registrada, editada,
+importada o refacturada) y su último id_pago. Solo una lectura o un pago
+de ese mismo cliente lo invalidan; la fecha mantiene al día los días de
+mora.
+"""
+
+from datetime import date
+
+from cache import CacheLRU
+from config import Config
+
+# {(id_cliente, fecha, marcas): estado de cuenta}
+cache_estados = CacheLRU(max_entradas=Config.ESTADO_CUENTA_CACHE_MAX, ttl=Config.ESTADO_CUENTA_CACHE_TTL)
+
+# Marcas de los datos de un cliente (None si el cliente no existe)
+_MARCAS = """
+    SELECT c.ultima_actualizacion, ul.version, ul.actualizado_en,
+           (SELECT MAX(p.id_pago)
+            FROM lectura l
+            JOIN pago p ON p.id_lectura = l.id_lectura
+            WHERE l.id_cliente = c.id_cliente) AS ultimo_pago
+    FROM cliente c
+    LEFT JOIN cliente_ultima_lectura ul ON ul.id_cliente = c.id_cliente
+    WHERE c.id_cliente = %s
+"""
+
+
+def _estadisticas(lecturas):
+    """Las mismas estadísticas que antes se calculaban con AVG/MAX/MIN/SUM sobre lectura"""
+    consumos = [lectura['consumo_m3'] for lectura in lecturas if lectura['consumo_m3'] is not None]
+    return {
+        'total_lecturas': len(lecturas),
+        'consumo_promedio': sum(consumos) / len(consumos) if consumos else 0,
+        'consumo_maximo': max(consumos, default=0),
+        'consumo_minimo': min(consumos, default=0),
+        'deuda_total': sum(lectura['monto_total'] for lectura in lecturas if lectura['estado_pago'] == 'PENDIENTE'),
+        'total_pagado': sum(lectura['monto_total'] for lectura in lecturas if lectura['estado_pago'] == 'PAGADO'),
+    }
+
+
+def _facturas_pendientes(lecturas, hoy):
+    """Lecturas pendientes de la más antigua a la más reciente, con sus días de mora"""
+    pendientes = sorted((lectura for lectura in lecturas if lectura['estado_pago'] == 'PENDIENTE'),
+                        key=lambda lectura: lectura['fecha_lectura'])
+    return [
+        {
+            'id_lectura': lectura['id_lectura'],
+            'fecha_lectura': lectura['fecha_lectura'],
+            'consumo_m3': lectura['consumo_m3'],
+            'monto_total': lectura['monto_total'],
+            'dias_mora': (hoy - lectura['fecha_lectura']).days,
+        }
+        for lectura in pendientes
+    ]
+
+
+def _consultar(conn, id_cliente, hoy):
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT c.*, s.nombre_sector
+            FROM cliente c
+            JOIN sector s ON c.id_sector = s.id_sector
+            WHERE c.id_cliente = %s
+        """, (id_cliente,))
+        cliente = cursor.fetchone()
+        if not cliente:
+            return None
+
+        cursor.execute("""
+            SELECT
+                l.id_lectura,
+                l.fecha_lectura,
+                l.lectura_anterior,
+                l.lectura_actual,
+                l.consumo_m3,
+                l.monto_total,
+                l.estado_pago,
+                CONCAT(u.nombre, ' ', u.apellido) as lector
+            FROM lectura l
+            JOIN usuario u ON l.id_usuario_lector = u.id_usuario
+            WHERE l.id_cliente = %s
+            ORDER BY l.fecha_lectura DESC
+        """, (id_cliente,))
+        lecturas = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT
+                p.id_pago,
+                p.fecha_pago,
+                p.monto_pagado,
+                l.fecha_lectura,
+                l.consumo_m3,
+                CONCAT(u.nombre, ' ', u.apellido) as receptor
+            FROM pago p
+            JOIN lectura l ON p.id_lectura = l.id_lectura
+            JOIN usuario u ON p.id_usuario_receptor = u.id_usuario
+            WHERE l.id_cliente = %s
+            ORDER BY p.fecha_pago DESC
+        """, (id_cliente,))
+        pagos = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    return {
+        'cliente': cliente,
+        'lecturas': lecturas,
+        'pagos': pagos,
+        'estadisticas': _estadisticas(lecturas),
+        'facturas_pendientes': _facturas_pendientes(lecturas, hoy),
+    }
+
+
+def _marcas(conn, id_cliente):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(_MARCAS, (id_cliente,))
+        fila = cursor.fetchone()
+    finally:
+        cursor.close()
+    return None if fila is None else tuple(fila)
+
+
+def cargar_estado_cuenta(obtener_conn, id_cliente):
+    """
+    Estado de cuenta del cliente: {'cliente', 'lecturas', 'pagos',
+    'estadisticas', 'facturas_pendientes'} (no modificarlo), o None si el
+    cliente no existe. Desde la cache mientras no cambien sus marcas.
+    """
+    conn = obtener_conn()
+    hoy = date.today()
+    marcas = _marcas(conn, id_cliente)
+    if marcas is None:
+        return None
+    clave = (id_cliente, hoy, marcas)
+    estado = cache_estados.obtener(clave)
+    if estado is not None:
+        return estado
+
+    estado = _consultar(conn, id_cliente, hoy)
+    if estado is not None:
+        cache_estados.guardar(clave, estado)
+    return estado
@@ -0,0 +1,355 @@
+# exportaciones.py - Exportaciones CSV y XLSX enviadas por partes
+"""
+Exportaciones de reportes y listados completos (años de pagos, padrones de
+sector) sin cargar todas las filas en memoria:
+
+- La consulta se ejecuta con un cursor sin buffer y las filas se leen de
+  la BD de EXPORTAR_LOTE en EXPORTAR_LOTE (fetchmany).
+- generar() convierte cada lote en bytes CSV o XLSX y los entrega en
+  cuanto están listos; la vista los envía con un Response que recibe el
+  generador. El XLSX es un ZIP escrito sobre la marcha (hoja con textos en
+  línea, sin sharedStrings), así que tampoco necesita tener todo el libro.
+- La conexión es propia de la exportación (no la de flask.g): la respuesta
+  se sigue enviando después de que termina la vista. cerrar() la devuelve
+  al pool cuando termina la respuesta, aunque se haya cortado a medias.
+"""
+
+import codecs
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+import mysql.connector
+
+from config import Config
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+XLSX_MAX_FILAS = 1048575  # Filas de datos que admite una hoja de Excel (más el encabezado)
+
+
+class Exportacion:
+    """
+    Declaración de una exportación.
+
+    sql: consulta completa con parámetros por nombre (%(id_sector)s, ...).
+    columnas: ((campo, encabezado), ...) en el orden del archivo; los campos
+    son los que selecciona la consulta.
+    archivo: prefijo del nombre del archivo.
+    """
+
+    def __init__(self, nombre, sql, columnas, archivo):
+        self.nombre = nombre
+        self.sql = sql
+        self.columnas = columnas
+        self.archivo = archivo
+
+    @property
+    def campos(self):
+        return tuple(campo for campo, _ in self.columnas)
+
+    @property
+    def encabezados(self):
+        return tuple(encabezado for _, encabezado in self.columnas)
+
+    def abrir(self, conn, parametros):
+        """Ejecuta la consulta y devuelve las filas (tuplas) como generador por lotes"""
+        return leer_por_lotes(abrir_consulta(conn, self.sql, parametros), self.campos)
+
+
+def abrir_consulta(conn, sql, parametros):
+    """
+    Ejecuta la consulta en un cursor sin buffer. Los errores de la consulta
+    salen aquí, antes de empezar a enviar el archivo.
+    """
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    cursor.execute(sql, parametros)
+    return cursor
+
+
+def leer_por_lotes(cursor, campos):
+    """Filas del cursor como tuplas con `campos`, leídas de EXPORTAR_LOTE en EXPORTAR_LOTE"""
+    try:
+        while True:
+            lote = cursor.fetchmany(Config.EXPORTAR_LOTE)
+            if not lote:
+                break
+            for fila in lote:
+                yield tuple(fila[campo] for campo in campos)
+    except mysql.connector.Error as err:
+        print(f"ERROR exportación: {err}")
+        raise
+
+
+def cerrar(conn):
+    """Descarta las filas sin leer (si se cortó la descarga) y devuelve la conexión al pool"""
+    try:
+        if conn.unread_result:
+            conn.consume_results()
+        conn.rollback()
+    except mysql.connector.Error as err:
+        print(f"ERROR al cerrar la conexión de la exportación: {err}")
+    finally:
+        conn.close()
+
+
+def nombre_archivo(prefijo, formato, *partes):
+    partes = [str(parte) for parte in partes] or [datetime.now().strftime('%Y%m%d')]
+    return f"{'_'.join([prefijo] + partes)}.{formato}"
+
+
+def generar(formato, encabezados, filas):
+    """Bytes del archivo en partes (un bloque cada EXPORTAR_LOTE filas)"""
+    if formato == 'xlsx':
+        return _xlsx(encabezados, filas)
+    return _csv(encabezados, filas)
+
+
+def _csv(encabezados, filas):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(encabezados)
+    # Con la marca BOM, Excel abre el archivo como UTF-8 (tildes y eñes)
+    yield codecs.BOM_UTF8 + _vaciar_texto(buffer)
+
+    for numero, fila in enumerate(filas, start=1):
+        escritor.writerow(fila)
+        if numero % Config.EXPORTAR_LOTE == 0:
+            yield _vaciar_texto(buffer)
+    yield _vaciar_texto(buffer)
+
+
+def _vaciar_texto(buffer):
+    datos = buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+    return datos
+
+
+# --- XLSX ---
+
+class _Salida:
+    """Archivo de solo escritura donde zipfile deja lo comprimido hasta que el generador lo entrega"""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_NS_PAQUETE = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+_PARTES_FIJAS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<Relationships xmlns="{_NS_PAQUETE}">'
+        f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<workbook xmlns="{_NS}" xmlns:r="{_NS_REL}">'
+        '<sheets><sheet name="Datos" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<Relationships xmlns="{_NS_PAQUETE}">'
+        f'<Relationship Id="rId1" Type="{_NS_REL}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{_NS_REL}/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Estilos de celda: 0 normal, 1 fecha, 2 fecha y hora, 3 encabezado en negrita
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<styleSheet xmlns="{_NS}">'
+        '<numFmts count="2"><numFmt numFmtId="164" formatCode="dd/mm/yyyy"/>'
+        '<numFmt numFmtId="165" formatCode="dd/mm/yyyy hh:mm"/></numFmts>'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="4">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+        '</cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+_EPOCA_EXCEL = datetime(1899, 12, 30)
+# Caracteres de control que XML no admite
+_NO_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _letra_columna(indice):
+    letras = ''
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def _celda(referencia, valor, estilo_texto=''):
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return f'<c r="{referencia}" t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c r="{referencia}"><v>{valor}</v></c>'
+    if isinstance(valor, datetime):
+        serial = (valor - _EPOCA_EXCEL).total_seconds() / 86400
+        return f'<c r="{referencia}" s="2"><v>{serial:.6f}</v></c>'
+    if isinstance(valor, date):
+        return f'<c r="{referencia}" s="1"><v>{(valor - _EPOCA_EXCEL.date()).days}</v></c>'
+    texto = escape(_NO_XML.sub('', str(valor)))
+    return f'<c r="{referencia}" t="inlineStr"{estilo_texto}><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _fila_xml(numero, letras, valores, estilo_texto=''):
+    celdas = ''.join(_celda(f'{letra}{numero}', valor, estilo_texto) for letra, valor in zip(letras, valores))
+    return f'<row r="{numero}">{celdas}</row>'
+
+
+def _xlsx(encabezados, filas):
+    salida = _Salida()
+    letras = [_letra_columna(indice) for indice in range(len(encabezados))]
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as libro:
+        for nombre, contenido in _PARTES_FIJAS.items():
+            libro.writestr(nombre, contenido)
+
+        with libro.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as hoja:
+            hoja.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                f'<worksheet xmlns="{_NS}"><sheetData>'
+                + _fila_xml(1, letras, encabezados, ' s="3"')
+            ).encode('utf-8'))
+            partes = []
+            for numero, fila in enumerate(filas, start=2):
+                if numero > XLSX_MAX_FILAS + 1:
+                    print(f"ERROR exportación XLSX: más de {XLSX_MAX_FILAS} filas; el resto se omite")
+                    break
+                partes.append(_fila_xml(numero, letras, fila))
+                if len(partes) == Config.EXPORTAR_LOTE:
+                    hoja.write(''.join(partes).encode('utf-8'))
+                    partes.clear()
+                    yield salida.vaciar()
+            hoja.write((''.join(partes) + '</sheetData></worksheet>').encode('utf-8'))
+    yield salida.vaciar()
+
+
+# --- Exportaciones que no son reportes (los reportes se exportan desde reportes.py) ---
+
+PAGOS = Exportacion(
+    'pagos',
+    # Incluye los pagos de todo el día final, como el reporte de ingresos
+    """
+        SELECT p.id_pago, p.fecha_pago, p.monto_pagado,
+               CONCAT(c.nombre, ' ', c.apellido) as cliente, c.no_contador, s.nombre_sector,
+               l.fecha_lectura, l.consumo_m3, CONCAT(u.nombre, ' ', u.apellido) as receptor
+        FROM pago p
+        JOIN lectura l ON p.id_lectura = l.id_lectura
+        JOIN cliente c ON l.id_cliente = c.id_cliente
+        JOIN sector s ON c.id_sector = s.id_sector
+        JOIN usuario u ON p.id_usuario_receptor = u.id_usuario
+        WHERE p.fecha_pago >= %(desde)s AND p.fecha_pago < %(hasta)s + INTERVAL 1 DAY
+        ORDER BY p.fecha_pago, p.id_pago
+    """,
+    columnas=(('id_pago', 'No. Pago'), ('fecha_pago', 'Fecha de pago'), ('monto_pagado', 'Monto (Q)'),
+              ('cliente', 'Cliente'), ('no_contador', 'Contador'), ('nombre_sector', 'Sector'),
+              ('fecha_lectura', 'Fecha de lectura'), ('consumo_m3', 'Consumo (m³)'), ('receptor', 'Recibido por')),
+    archivo='Pagos',
+)
+
+LECTURAS_CLIENTE = Exportacion(
+    'lecturas_cliente',
+    """
+        SELECT l.id_lectura, l.fecha_lectura, l.lectura_anterior, l.lectura_actual, l.consumo_m3,
+               l.monto_total, l.estado_pago, CONCAT(u.nombre, ' ', u.apellido) as lector
+        FROM lectura l
+        JOIN usuario u ON l.id_usuario_lector = u.id_usuario
+        WHERE l.id_cliente = %(id_cliente)s
+        ORDER BY l.fecha_lectura DESC
+    """,
+    columnas=(('id_lectura', 'No. Lectura'), ('fecha_lectura', 'Fecha'), ('lectura_anterior', 'Lectura anterior'),
+              ('lectura_actual', 'Lectura actual'), ('consumo_m3', 'Consumo (m³)'), ('monto_total', 'Monto (Q)'),
+              ('estado_pago', 'Estado'), ('lector', 'Lector')),
+    archivo='Lecturas',
+)
+
+PAGOS_CLIENTE = Exportacion(
+    'pagos_cliente',
+    """
+        SELECT p.id_pago, p.fecha_pago, p.monto_pagado, l.fecha_lectura, l.consumo_m3,
+               CONCAT(u.nombre, ' ', u.apellido) as receptor
+        FROM pago p
+        JOIN lectura l ON p.id_lectura = l.id_lectura
+        JOIN usuario u ON p.id_usuario_receptor = u.id_usuario
+        WHERE l.id_cliente = %(id_cliente)s
+        ORDER BY p.fecha_pago DESC
+    """,
+    columnas=(('id_pago', 'No. Pago'), ('fecha_pago', 'Fecha de pago'), ('monto_pagado', 'Monto (Q)'),
+              ('fecha_lectura', 'Fecha de lectura'), ('consumo_m3', 'Consumo (m³)'), ('receptor', 'Recibido por')),
+    archivo='Pagos',
+)
+
+CLIENTES_SECTOR = Exportacion(
+    'clientes_sector',
+    # Deuda pendiente de cada cliente (usa idx_lectura_cliente_fecha)
+    """
+        SELECT c.id_cliente, c.nombre, c.apellido, c.no_contador, c.telefono,
+               (SELECT COUNT(*) FROM lectura lp
+                WHERE lp.id_cliente = c.id_cliente AND lp.estado_pago = 'PENDIENTE') as facturas_pendientes,
+               (SELECT COALESCE(SUM(lp.monto_total), 0) FROM lectura lp
+                WHERE lp.id_cliente = c.id_cliente AND lp.estado_pago = 'PENDIENTE') as deuda
+        FROM cliente c
+        WHERE c.id_sector = %(id_sector)s AND c.activo = TRUE
+        ORDER BY c.nombre, c.apellido
+    """,
+    columnas=(('id_cliente', 'No. Cliente'), ('nombre', 'Nombre'), ('apellido', 'Apellido'),
+              ('no_contador', 'Contador'), ('telefono', 'Teléfono'), ('facturas_pendientes', 'Facturas pendientes'),
+              ('deuda', 'Deuda (Q)')),
+    archivo='Clientes',
+)
+
+EXPORTACIONES = {exportacion.nombre: exportacion for exportacion in (
+    PAGOS, LECTURAS_CLIENTE, PAGOS_CLIENTE, CLIENTES_SECTOR,
+)}
@@ -0,0 +1,326 @@
+# facturacion.py - Motor de tarifas para el cálculo de facturas de agua
+"""
+Cálculo del monto a cobrar por una lectura según un esquema de tarifas.
+
+Un esquema de tarifas tiene:
+- bloques de consumo (desde_m3, hasta_m3, precio_m3), el último puede no
+  tener límite; cada m³ se cobra al precio del bloque en que cae;
+- cargos fijos que se suman a toda factura;
+- el tratamiento del consumo negativo (lectura menor que la anterior):
+  crédito por el valor de ese consumo, o solo los cargos fijos.
+
+Los esquemas se guardan en las tablas tarifa_esquema, tarifa_bloque y
+tarifa_cargo (database_rendimiento.sql). Se cargan una vez por worker y se
+recargan cuando cambia el sello de versión 'tarifas'. Si no hay esquemas en
+la BD se usa ESQUEMA_PREDETERMINADO, que reproduce la tarifa histórica.
+
+Hay dos formas de calcular con el mismo resultado:
+- EsquemaTarifa.calcular(consumo) / calcular_factura(): un valor;
+- EsquemaTarifa.calcular_lote(consumos) / calcular_facturas(): un arreglo
+  de NumPy, para importaciones, refacturación y simulaciones.
+Ambas hacen las mismas operaciones en el mismo orden y redondean igual
+(a centavos, mitad hacia arriba), de modo que dan el mismo monto.
+"""
+
+import math
+import threading
+from datetime import date
+
+import mysql.connector
+import numpy as np
+
+from cache import version_actual
+
+CONSUMO_CREDITO = 'CREDITO'                  # el consumo negativo genera crédito
+CONSUMO_SOLO_CARGO_FIJO = 'SOLO_CARGO_FIJO'  # el consumo negativo solo paga cargos fijos
+
+
+def _redondear(valor):
+    """Redondeo a centavos, mitad hacia arriba (igual que _redondear_lote)"""
+    valor = round(valor * 1e6) / 1e6  # descarta el ruido binario (2.675 -> 2.675000)
+    signo = -1.0 if valor < 0 else 1.0
+    return signo * math.floor(abs(valor) * 100 + 0.5) / 100
+
+
+def _redondear_lote(valores):
+    """Versión vectorizada de _redondear"""
+    valores = np.rint(valores * 1e6) / 1e6
+    signos = np.where(valores < 0, -1.0, 1.0)
+    return signos * np.floor(np.abs(valores) * 100 + 0.5) / 100
+
+
+class EsquemaTarifa:
+    """Esquema de tarifas por bloques de consumo"""
+
+    def __init__(self, bloques, cargos_fijos=(), consumo_negativo=CONSUMO_CREDITO,
+                 nombre='', id_esquema=None, vigente_desde=None):
+        """
+        bloques: secuencia de (desde_m3, hasta_m3, precio_m3) contiguos desde 0;
+        hasta_m3 None significa sin límite (solo el último bloque).
+        cargos_fijos: secuencia de (concepto, monto).
+        """
+        self.nombre = nombre
+        self.id_esquema = id_esquema
+        self.vigente_desde = vigente_desde
+        self.consumo_negativo = consumo_negativo
+        self.cargos_fijos = tuple((concepto, float(monto)) for concepto, monto in cargos_fijos)
+        self.cargo_fijo = sum(monto for _, monto in self.cargos_fijos)
+
+        self.bloques = tuple(sorted(
+            (float(desde), None if hasta is None else float(hasta), float(precio))
+            for desde, hasta, precio in bloques
+        ))
+        if not self.bloques:
+            raise ValueError("El esquema de tarifas no tiene bloques")
+        limite = 0.0
+        for desde, hasta, _ in self.bloques:
+            if desde != limite:
+                raise ValueError(f"Los bloques deben ser contiguos desde 0 m³ (falta el tramo {limite}-{desde})")
+            if hasta is not None and hasta <= desde:
+                raise ValueError(f"Bloque inválido: {desde}-{hasta} m³")
+            limite = math.inf if hasta is None else hasta
+        if consumo_negativo not in (CONSUMO_CREDITO, CONSUMO_SOLO_CARGO_FIJO):
+            raise ValueError(f"Tratamiento de consumo negativo desconocido: {consumo_negativo}")
+
+        # (inicio, ancho, precio) de cada bloque; el último puede tener ancho infinito
+        self._tramos = tuple(
+            (desde, math.inf if hasta is None else hasta - desde, precio)
+            for desde, hasta, precio in self.bloques
+        )
+
+    def _por_bloques(self, consumo):
+        """Valor del consumo (>= 0) según los bloques"""
+        total = 0.0
+        for inicio, ancho, precio in self._tramos:
+            total += min(max(consumo - inicio, 0.0), ancho) * precio
+        return total
+
+    def _por_bloques_lote(self, consumos):
+        total = np.zeros_like(consumos)
+        for inicio, ancho, precio in self._tramos:
+            total += np.minimum(np.maximum(consumos - inicio, 0.0), ancho) * precio
+        return total
+
+    def calcular(self, consumo):
+        """Monto de la factura para un consumo en m³ (negativo = crédito)"""
+        consumo = float(consumo)
+        if consumo >= 0:
+            monto = self.cargo_fijo + self._por_bloques(consumo)
+        elif self.consumo_negativo == CONSUMO_CREDITO:
+            monto = self.cargo_fijo - self._por_bloques(-consumo)
+        else:
+            monto = self.cargo_fijo
+        return _redondear(monto)
+
+    def calcular_lote(self, consumos):
+        """Montos de un arreglo de consumos (mismo resultado que calcular() para cada uno)"""
+        consumos = np.asarray(consumos, dtype=np.float64)
+        valor = self._por_bloques_lote(np.abs(consumos))
+        if self.consumo_negativo == CONSUMO_CREDITO:
+            montos = np.where(consumos >= 0, self.cargo_fijo + valor, self.cargo_fijo - valor)
+        else:
+            montos = np.where(consumos >= 0, self.cargo_fijo + valor, self.cargo_fijo)
+        return _redondear_lote(montos)
+
+    def describir(self):
+        """Resumen legible del esquema (para la consola y los reportes)"""
+        lineas = [f"Esquema: {self.nombre or 'sin nombre'}"]
+        for desde, hasta, precio in self.bloques:
+            tramo = f"{desde:g}-{hasta:g} m³" if hasta is not None else f"más de {desde:g} m³"
+            lineas.append(f"  {tramo}: Q{precio:g} por m³")
+        for concepto, monto in self.cargos_fijos:
+            lineas.append(f"  {concepto}: Q{monto:.2f}")
+        lineas.append(f"  Consumo negativo: {self.consumo_negativo}")
+        return '\n'.join(lineas)
+
+
+# Tarifa histórica: Q2 por m³ hasta 25 m³, Q4 por m³ de exceso, sin cargo fijo
+ESQUEMA_PREDETERMINADO = EsquemaTarifa(
+    bloques=[(0, 25, 2.00), (25, None, 4.00)],
+    cargos_fijos=[],
+    consumo_negativo=CONSUMO_CREDITO,
+    nombre='Tarifa predeterminada',
+)
+
+
+# --- Carga desde la BD ---
+
+_esquemas = None           # [EsquemaTarifa] ordenados por vigente_desde descendente
+_esquemas_version = None
+_esquemas_lock = threading.Lock()
+
+
+def cargar_esquemas(conn, solo_activos=True):
+    """Lee los esquemas de tarifas de la BD, del más reciente al más antiguo"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"""
+            SELECT id_esquema, nombre, consumo_negativo, vigente_desde
+            FROM tarifa_esquema
+            {'WHERE activo = TRUE' if solo_activos else ''}
+            ORDER BY vigente_desde DESC, id_esquema DESC
+        """)
+        filas = cursor.fetchall()
+        if not filas:
+            return []
+        ids = [fila['id_esquema'] for fila in filas]
+        marcadores = ', '.join(['%s'] * len(ids))
+        cursor.execute(f"""
+            SELECT id_esquema, desde_m3, hasta_m3, precio_m3
+            FROM tarifa_bloque
+            WHERE id_esquema IN ({marcadores})
+        """, ids)
+        bloques = {}
+        for bloque in cursor.fetchall():
+            bloques.setdefault(bloque['id_esquema'], []).append(
+                (bloque['desde_m3'], bloque['hasta_m3'], bloque['precio_m3']))
+        cursor.execute(f"""
+            SELECT id_esquema, concepto, monto
+            FROM tarifa_cargo
+            WHERE id_esquema IN ({marcadores})
+            ORDER BY id_cargo
+        """, ids)
+        cargos = {}
+        for cargo in cursor.fetchall():
+            cargos.setdefault(cargo['id_esquema'], []).append((cargo['concepto'], cargo['monto']))
+    finally:
+        cursor.close()
+
+    esquemas = []
+    for fila in filas:
+        try:
+            esquemas.append(EsquemaTarifa(
+                bloques=bloques.get(fila['id_esquema'], []),
+                cargos_fijos=cargos.get(fila['id_esquema'], []),
+                consumo_negativo=fila['consumo_negativo'],
+                nombre=fila['nombre'],
+                id_esquema=fila['id_esquema'],
+                vigente_desde=fila['vigente_desde'],
+            ))
+        except ValueError as err:
+            print(f"ERROR esquema de tarifas {fila['id_esquema']} ignorado: {err}")
+    return esquemas
+
+
+def _esquemas_vigentes(obtener_conn):
+    """Esquemas en memoria, recargados si cambió el sello de versión 'tarifas'"""
+    global _esquemas, _esquemas_version
+
+    version = version_actual(obtener_conn, 'tarifas')
+    with _esquemas_lock:
+        if _esquemas is not None and version is not None and version == _esquemas_version:
+            return _esquemas
+        if _esquemas is not None and version is None:
+            return _esquemas  # sin BD: se sigue con lo que hay en memoria
+
+    conn = obtener_conn()
+    if conn is None:
+        return _esquemas or []
+    try:
+        esquemas = cargar_esquemas(conn)
+    except mysql.connector.Error as err:
+        print(f"ERROR al cargar esquemas de tarifas: {err}")
+        return _esquemas or []
+
+    with _esquemas_lock:
+        _esquemas = esquemas
+        _esquemas_version = version
+    print(f"DEBUG facturacion: {len(esquemas)} esquemas de tarifas cargados (versión {version})")
+    return esquemas
+
+
+def tarifa_vigente(obtener_conn, fecha=None):
+    """
+    Esquema de tarifas vigente en `fecha` (hoy por omisión): el activo con la
+    mayor vigente_desde que no sea posterior a la fecha.
+    """
+    if isinstance(fecha, str):
+        try:
+            fecha = date.fromisoformat(fecha[:10])
+        except ValueError:
+            fecha = None
+    fecha = fecha or date.today()
+    for esquema in _esquemas_vigentes(obtener_conn):
+        if esquema.vigente_desde is None or esquema.vigente_desde <= fecha:
+            return esquema
+    return ESQUEMA_PREDETERMINADO
+
+
+def descartar_tarifas_en_memoria():
+    """Obliga a recargar los esquemas en la próxima consulta (tras editarlos en este worker)"""
+    global _esquemas
+    with _esquemas_lock:
+        _esquemas = None
+
+
+# --- API de cálculo ---
+
+def calcular_factura(consumo, esquema=None):
+    """Calcula el monto total de la factura según el consumo y tarifas."""
+    return (esquema or ESQUEMA_PREDETERMINADO).calcular(consumo)
+
+
+def calcular_facturas(consumos, esquema=None):
+    """Calcula de una vez los montos de un arreglo de consumos (numpy.ndarray de float64)"""
+    return (esquema or ESQUEMA_PREDETERMINADO).calcular_lote(consumos)
+
+
+def calcular_facturas_por_fecha(obtener_conn, consumos, fechas):
+    """
+    Montos de un arreglo de consumos, cada uno con el esquema vigente en su
+    fecha de lectura. Se calcula un lote por esquema.
+    """
+    consumos = np.asarray(consumos, dtype=np.float64)
+    montos = np.empty_like(consumos)
+    esquema_por_fecha = {}
+    indices = {}  # id(esquema) -> (esquema, [posiciones])
+    for posicion, fecha in enumerate(fechas):
+        esquema = esquema_por_fecha.get(fecha)
+        if esquema is None:
+            esquema = esquema_por_fecha[fecha] = tarifa_vigente(obtener_conn, fecha)
+        indices.setdefault(id(esquema), (esquema, []))[1].append(posicion)
+    for esquema, posiciones in indices.values():
+        posiciones = np.array(posiciones, dtype=np.intp)
+        montos[posiciones] = esquema.calcular_lote(consumos[posiciones])
+    return montos
+
+
+def simular_tarifa(conn, esquema, fecha_inicio=None, fecha_fin=None):
+    """
+    Factura con `esquema` todas las lecturas del rango (o de toda la tabla) y
+    compara con los montos registrados. No modifica nada.
+
+    Devuelve {'lecturas', 'monto_actual', 'monto_simulado', 'diferencia', 'cambian'}.
+    """
+    condiciones, parametros = [], []
+    if fecha_inicio:
+        condiciones.append("fecha_lectura >= %s")
+        parametros.append(fecha_inicio)
+    if fecha_fin:
+        condiciones.append("fecha_lectura <= %s")
+        parametros.append(fecha_fin)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+
+    consumos, montos = [], []
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT lectura_actual - lectura_anterior, monto_total FROM lectura {where}", parametros)
+        while True:
+            filas = cursor.fetchmany(10000)
+            if not filas:
+                break
+            for consumo, monto in filas:
+                consumos.append(consumo)
+                montos.append(monto)
+    finally:
+        cursor.close()
+
+    actuales = np.array(montos, dtype=np.float64)
+    simulados = esquema.calcular_lote(np.array(consumos, dtype=np.float64))
+    return {
+        'lecturas': len(consumos),
+        'monto_actual': round(float(actuales.sum()), 2),
+        'monto_simulado': round(float(simulados.sum()), 2),
+        'diferencia': round(float(simulados.sum() - actuales.sum()), 2),
+        'cambian': int(np.count_nonzero(np.abs(simulados - actuales) >= 0.005)),
+    }
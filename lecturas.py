@@ -0,0 +1,427 @@
+# lecturas.py - Lógica de lecturas compartida por la aplicación y las utilidades
+"""
+Funciones sobre la tabla lectura que usan tanto las rutas de app.py como
+los comandos de utilidades.py.
+
+La tabla cliente_ultima_lectura guarda, por cliente, un puntero a su lectura
+más reciente (id, valor y fecha). Se actualiza en la misma transacción que
+inserta o edita una lectura, de modo que obtener la lectura anterior de un
+cliente es una búsqueda por clave primaria en lugar de ordenar su historial.
+Cada fila guarda también en sello_lecturas el valor del sello 'lecturas'
+(version_cache) de la transacción que la cambió por última vez: como cada
+transacción lo incrementa con la fila de version_cache bloqueada hasta el
+commit, los valores crecen en el orden en que se confirman, y el índice de
+búsqueda lee solo las filas con un sello mayor al que ya aplicó (ver
+busqueda.py).
+
+importar_lecturas() carga en bloque lecturas tomadas en papel u hoja de
+cálculo (CSV o JSON con no_contador, fecha_lectura y lectura_actual).
+"""
+
+import csv
+import json
+import time
+from collections import defaultdict
+from datetime import date, datetime
+
+import mysql.connector
+
+from cache import incrementar_version
+from consumo import refrescar_consumo_mensual
+from config import Config
+from facturacion import calcular_facturas_por_fecha
+
+COLUMNAS_IMPORTACION = ('no_contador', 'fecha_lectura', 'lectura_actual')
+FORMATOS_FECHA = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y')
+
+
+def obtener_ultima_lectura(cursor, id_cliente, bloquear=False):
+    """
+    Devuelve {'id_lectura', 'lectura_actual', 'fecha_lectura'} de la última
+    lectura del cliente, o None si no tiene lecturas.
+
+    Con bloquear=True la fila queda bloqueada (FOR UPDATE) hasta el fin de la
+    transacción, para que dos lecturas simultáneas del mismo cliente no usen
+    la misma lectura anterior.
+    """
+    sql = """
+        SELECT id_lectura, lectura_actual, fecha_lectura
+        FROM cliente_ultima_lectura
+        WHERE id_cliente = %s
+    """
+    if bloquear:
+        sql += " FOR UPDATE"
+    cursor.execute(sql, (id_cliente,))
+    fila = cursor.fetchone()
+    if fila is None:
+        return None
+    if isinstance(fila, dict):
+        return fila
+    return dict(zip(('id_lectura', 'lectura_actual', 'fecha_lectura'), fila))
+
+
+def bloquear_ultimas_lecturas(cursor, ids_clientes):
+    """
+    Bloquea (FOR UPDATE, en orden de id_cliente) las filas de
+    cliente_ultima_lectura de varios clientes. Quien modifique lecturas ya
+    existentes lo hace antes de tocarlas, igual que registrar una lectura
+    bloquea primero la última del cliente (ver consumo.py).
+    """
+    ids_clientes = sorted(set(ids_clientes))
+    if not ids_clientes:
+        return
+    marcadores = ', '.join(['%s'] * len(ids_clientes))
+    cursor.execute(f"""
+        SELECT id_cliente FROM cliente_ultima_lectura
+        WHERE id_cliente IN ({marcadores})
+        ORDER BY id_cliente
+        FOR UPDATE
+    """, ids_clientes)
+    cursor.fetchall()
+
+
+def refrescar_ultima_lectura(cursor, id_cliente):
+    """
+    Recalcula el puntero a la última lectura de un cliente desde su historial
+    e incrementa su versión (cada cambio en las lecturas del cliente la
+    incrementa; ver estado_cuenta.py).
+
+    Debe ejecutarse en la misma transacción que inserta o modifica la lectura.
+    """
+    cursor.execute("""
+        INSERT INTO cliente_ultima_lectura (id_cliente, id_lectura, lectura_actual, fecha_lectura)
+        SELECT id_cliente, id_lectura, lectura_actual, fecha_lectura
+        FROM lectura
+        WHERE id_cliente = %s
+        ORDER BY fecha_lectura DESC, id_lectura DESC
+        LIMIT 1
+        ON DUPLICATE KEY UPDATE
+            id_lectura = VALUES(id_lectura),
+            lectura_actual = VALUES(lectura_actual),
+            fecha_lectura = VALUES(fecha_lectura),
+            version = version + 1
+    """, (id_cliente,))
+
+
+def sellar_ultimas_lecturas(cursor, ids_clientes):
+    """
+    Incrementa el sello 'lecturas' y lo anota en sello_lecturas de los
+    clientes cuyo puntero se refrescó. Se llama al final de la transacción,
+    en lugar de incrementar_version(cursor, 'lecturas').
+    """
+    incrementar_version(cursor, 'lecturas')
+    ids_clientes = sorted(set(ids_clientes))
+    if not ids_clientes:
+        return
+    marcadores = ', '.join(['%s'] * len(ids_clientes))
+    cursor.execute(f"""
+        UPDATE cliente_ultima_lectura
+        SET sello_lecturas = (SELECT version FROM version_cache WHERE nombre = 'lecturas')
+        WHERE id_cliente IN ({marcadores})
+    """, ids_clientes)
+
+
+def reconstruir_ultimas_lecturas(conn):
+    """
+    Reconstruye cliente_ultima_lectura completa a partir del historial de lecturas.
+
+    Devuelve el número de clientes con puntero. Hace commit al terminar.
+    """
+    cursor = conn.cursor()
+    try:
+        # Primero el sello, para anotarlo en todas las filas nuevas
+        incrementar_version(cursor, 'lecturas')
+        cursor.execute("DELETE FROM cliente_ultima_lectura")
+        cursor.execute("""
+            INSERT INTO cliente_ultima_lectura (id_cliente, id_lectura, lectura_actual, fecha_lectura, sello_lecturas)
+            SELECT id_cliente, id_lectura, lectura_actual, fecha_lectura,
+                   (SELECT version FROM version_cache WHERE nombre = 'lecturas')
+            FROM (
+                SELECT id_cliente, id_lectura, lectura_actual, fecha_lectura,
+                       ROW_NUMBER() OVER (PARTITION BY id_cliente
+                                          ORDER BY fecha_lectura DESC, id_lectura DESC) AS posicion
+                FROM lectura
+            ) ordenadas
+            WHERE posicion = 1
+        """)
+        total = cursor.rowcount
+        conn.commit()
+        return total
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def refrescar_ultimas_lecturas(cursor, ids_clientes):
+    """Igual que refrescar_ultima_lectura() para varios clientes en una sola sentencia"""
+    if not ids_clientes:
+        return
+    marcadores = ', '.join(['%s'] * len(ids_clientes))
+    cursor.execute(f"""
+        INSERT INTO cliente_ultima_lectura (id_cliente, id_lectura, lectura_actual, fecha_lectura)
+        SELECT id_cliente, id_lectura, lectura_actual, fecha_lectura
+        FROM (
+            SELECT id_cliente, id_lectura, lectura_actual, fecha_lectura,
+                   ROW_NUMBER() OVER (PARTITION BY id_cliente
+                                      ORDER BY fecha_lectura DESC, id_lectura DESC) AS posicion
+            FROM lectura
+            WHERE id_cliente IN ({marcadores})
+        ) ordenadas
+        WHERE posicion = 1
+        ON DUPLICATE KEY UPDATE
+            id_lectura = VALUES(id_lectura),
+            lectura_actual = VALUES(lectura_actual),
+            fecha_lectura = VALUES(fecha_lectura),
+            version = version + 1
+    """, list(ids_clientes))
+
+
+def marcar_lecturas_modificadas(cursor, ids_clientes):
+    """
+    Incrementa la versión de cliente_ultima_lectura de clientes cuyas
+    lecturas cambiaron sin cambiar el puntero (p. ej. sus montos), para que
+    su estado de cuenta en cache se descarte (ver estado_cuenta.py).
+    """
+    ids_clientes = sorted(set(ids_clientes))
+    if not ids_clientes:
+        return
+    marcadores = ', '.join(['%s'] * len(ids_clientes))
+    cursor.execute(f"""
+        UPDATE cliente_ultima_lectura SET version = version + 1
+        WHERE id_cliente IN ({marcadores})
+    """, ids_clientes)
+
+
+# --- Importación masiva ---
+
+def leer_archivo_lecturas(contenido, nombre_archivo=''):
+    """
+    Convierte el contenido de un archivo CSV o JSON en una lista de dicts.
+
+    El CSV debe tener encabezado con las columnas de COLUMNAS_IMPORTACION
+    (separadas por coma, punto y coma o tabulador). El JSON puede ser una
+    lista de objetos o {"lecturas": [...]}. Lanza ValueError si el archivo no
+    tiene un formato válido.
+    """
+    if isinstance(contenido, bytes):
+        try:
+            contenido = contenido.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            contenido = contenido.decode('latin-1')
+
+    if nombre_archivo.lower().endswith('.json') or contenido.lstrip().startswith(('[', '{')):
+        try:
+            datos = json.loads(contenido)
+        except json.JSONDecodeError as err:
+            raise ValueError(f"JSON no válido: {err}")
+        if isinstance(datos, dict):
+            datos = datos.get('lecturas')
+        if not isinstance(datos, list):
+            raise ValueError('El JSON debe ser una lista de lecturas o {"lecturas": [...]}')
+        return [fila if isinstance(fila, dict) else {} for fila in datos]
+
+    lineas = contenido.splitlines()
+    if not lineas:
+        raise ValueError('El archivo está vacío')
+    try:
+        dialecto = csv.Sniffer().sniff(lineas[0], delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    lector = csv.DictReader(lineas, dialect=dialecto)
+    lector.fieldnames = [(columna or '').strip().lower() for columna in lector.fieldnames or []]
+    faltantes = [columna for columna in COLUMNAS_IMPORTACION if columna not in lector.fieldnames]
+    if faltantes:
+        raise ValueError(f"Faltan columnas en el encabezado: {', '.join(faltantes)}")
+    return [fila for fila in lector if any((valor or '').strip() for valor in fila.values() if isinstance(valor, str))]
+
+
+def _convertir_fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    texto = str(valor or '').strip()
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Fecha no válida: '{texto}' (use AAAA-MM-DD o DD/MM/AAAA)")
+
+
+def _validar_fila(numero, fila):
+    """Devuelve la fila con tipos convertidos o lanza ValueError con el motivo"""
+    no_contador = str(fila.get('no_contador') or '').strip()
+    if not no_contador:
+        raise ValueError('Falta el número de contador')
+
+    fecha_lectura = _convertir_fecha(fila.get('fecha_lectura'))
+    if fecha_lectura > date.today():
+        raise ValueError(f"La fecha {fecha_lectura:%d/%m/%Y} es futura")
+
+    valor = fila.get('lectura_actual')
+    texto = '' if valor is None else str(valor).strip()
+    try:
+        lectura_actual = float(texto.replace(',', '.'))
+    except ValueError:
+        raise ValueError(f"Lectura no válida: '{texto}'")
+    if lectura_actual < 0:
+        raise ValueError('La lectura no puede ser negativa')
+
+    return {
+        'fila': numero,
+        'no_contador': no_contador,
+        'fecha_lectura': fecha_lectura,
+        'lectura_actual': round(lectura_actual, 2),
+    }
+
+
+def _error(numero, no_contador, mensaje):
+    return {'fila': numero, 'no_contador': no_contador, 'error': mensaje}
+
+
+def _resolver_contadores(cursor, contadores):
+    """{no_contador: {'id_cliente', 'activo'}} de los contadores indicados, en una sola consulta"""
+    if not contadores:
+        return {}
+    contadores = list(contadores)
+    marcadores = ', '.join(['%s'] * len(contadores))
+    cursor.execute(f"""
+        SELECT id_cliente, no_contador, activo
+        FROM cliente
+        WHERE no_contador IN ({marcadores})
+    """, contadores)
+    return {fila['no_contador']: fila for fila in cursor.fetchall()}
+
+
+def _importar_lote(conn, grupos, id_usuario, solo_validar, resultado):
+    """
+    Inserta en una transacción las lecturas de un grupo de clientes.
+
+    Las lecturas anteriores se leen bloqueadas (FOR UPDATE) para no cruzarse
+    con registros manuales simultáneos; las lecturas de un mismo cliente se
+    encadenan por fecha, cada una toma como anterior la que la precede.
+    """
+    cursor = conn.cursor(dictionary=True)
+    ids = [id_cliente for id_cliente, _ in grupos]
+    marcadores = ', '.join(['%s'] * len(ids))
+    registros = []
+    filas_registradas = []
+    try:
+        cursor.execute(f"""
+            SELECT id_cliente, lectura_actual, fecha_lectura
+            FROM cliente_ultima_lectura
+            WHERE id_cliente IN ({marcadores})
+            ORDER BY id_cliente
+            {'' if solo_validar else 'FOR UPDATE'}
+        """, ids)
+        ultimas = {fila['id_cliente']: fila for fila in cursor.fetchall()}
+
+        for id_cliente, filas in grupos:
+            ultima = ultimas.get(id_cliente)
+            lectura_anterior = float(ultima['lectura_actual']) if ultima else 0
+            fecha_anterior = ultima['fecha_lectura'] if ultima else None
+            for fila in sorted(filas, key=lambda f: (f['fecha_lectura'], f['fila'])):
+                if fecha_anterior is not None and fila['fecha_lectura'] <= fecha_anterior:
+                    resultado['errores'].append(_error(
+                        fila['fila'], fila['no_contador'],
+                        f"El cliente ya tiene una lectura del {fecha_anterior:%d/%m/%Y} (igual o posterior)"))
+                    continue
+                registros.append([id_cliente, id_usuario, fila['fecha_lectura'],
+                                  lectura_anterior, fila['lectura_actual'], None])
+                filas_registradas.append(fila)
+                lectura_anterior = fila['lectura_actual']
+                fecha_anterior = fila['fecha_lectura']
+
+        # Facturas del lote de una vez, con la tarifa vigente en cada fecha
+        if registros:
+            montos = calcular_facturas_por_fecha(
+                lambda: conn,
+                [registro[4] - registro[3] for registro in registros],
+                [registro[2] for registro in registros])
+            for registro, monto in zip(registros, montos.tolist()):
+                registro[5] = monto
+
+        if registros and not solo_validar:
+            cursor.executemany("""
+                INSERT INTO lectura (id_cliente, id_usuario_lector, fecha_lectura, lectura_anterior, lectura_actual, monto_total)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, registros)
+            refrescar_ultimas_lecturas(cursor, ids)
+            refrescar_consumo_mensual(cursor, {registro[0] for registro in registros},
+                                      min(registro[2] for registro in registros))
+            sellar_ultimas_lecturas(cursor, ids)
+            conn.commit()
+        else:
+            conn.rollback()
+
+        resultado['insertadas'] += len(registros)
+        resultado['monto_total'] += sum(registro[5] for registro in registros)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        print(f"ERROR importar_lecturas: {err}")
+        for fila in filas_registradas:
+            resultado['errores'].append(_error(fila['fila'], fila['no_contador'], f"Lote no guardado: {err}"))
+    finally:
+        cursor.close()
+
+
+def importar_lecturas(conn, filas, id_usuario, tamano_lote=None, solo_validar=False):
+    """
+    Valida e inserta en bloque las lecturas de `filas` (dicts con
+    no_contador, fecha_lectura y lectura_actual), calculando su factura.
+
+    Los contadores se resuelven en una sola consulta y las lecturas se
+    insertan con executemany en transacciones de unas `tamano_lote` filas;
+    si un lote falla, los demás se guardan igual. Con solo_validar=True no se
+    guarda nada. Devuelve un resumen con los errores por fila:
+    {'total', 'insertadas', 'monto_total', 'errores': [{'fila', 'no_contador', 'error'}], 'segundos'}
+    """
+    inicio = time.perf_counter()
+    tamano_lote = tamano_lote or Config.LECTURAS_IMPORTACION_LOTE
+    resultado = {'total': len(filas), 'insertadas': 0, 'monto_total': 0.0, 'errores': [],
+                 'solo_validar': solo_validar}
+
+    validas = []
+    for numero, fila in enumerate(filas, start=1):
+        try:
+            validas.append(_validar_fila(numero, fila))
+        except ValueError as err:
+            resultado['errores'].append(_error(numero, str(fila.get('no_contador') or ''), str(err)))
+
+    cursor = conn.cursor(dictionary=True)
+    try:
+        clientes = _resolver_contadores(cursor, {fila['no_contador'] for fila in validas})
+    finally:
+        cursor.close()
+
+    por_cliente = defaultdict(list)
+    for fila in validas:
+        cliente = clientes.get(fila['no_contador'])
+        if cliente is None:
+            resultado['errores'].append(_error(fila['fila'], fila['no_contador'], 'Contador no registrado'))
+        elif not cliente['activo']:
+            resultado['errores'].append(_error(fila['fila'], fila['no_contador'], 'Cliente inactivo'))
+        else:
+            por_cliente[cliente['id_cliente']].append(fila)
+
+    # Lotes de clientes completos: las lecturas de un cliente van en la misma transacción
+    lote, filas_lote = [], 0
+    for id_cliente, filas_cliente in por_cliente.items():
+        lote.append((id_cliente, filas_cliente))
+        filas_lote += len(filas_cliente)
+        if filas_lote >= tamano_lote:
+            _importar_lote(conn, lote, id_usuario, solo_validar, resultado)
+            lote, filas_lote = [], 0
+    if lote:
+        _importar_lote(conn, lote, id_usuario, solo_validar, resultado)
+
+    resultado['errores'].sort(key=lambda error: error['fila'])
+    resultado['monto_total'] = round(resultado['monto_total'], 2)
+    resultado['segundos'] = round(time.perf_counter() - inicio, 2)
+    print(f"DEBUG importar_lecturas: {resultado['insertadas']} de {resultado['total']} "
+          f"{'válidas' if solo_validar else 'insertadas'}, {len(resultado['errores'])} errores "
+          f"en {resultado['segundos']} s")
+    return resultado
@@ -0,0 +1,443 @@
+# listas.py - Listados paginados en el servidor (protocolo ajax de DataTables)
+"""
+Motor común de las tablas con serverSide de DataTables.
+
+Cada listado se declara una vez (Listado) con:
+- la tabla base, sus uniones y la condición fija;
+- las columnas permitidas (Columna): expresión SQL, si se puede ordenar por
+  ella y en qué campos se busca; nada que venga del navegador llega al SQL
+  salvo como parámetro;
+- los filtros que acepta (Filtro) y el permiso necesario para verlo;
+- los sellos de versión (version_cache) de los que dependen sus totales.
+
+El SQL que genera está siempre acotado:
+- Una página tiene como máximo LISTADOS_MAX_FILAS filas.
+- La búsqueda es por prefijo (LIKE 'texto%'), que puede usar índices.
+- En los listados simples, primero se eligen las claves de la página
+  recorriendo solo las tablas necesarias para filtrar y ordenar, y después
+  se leen los datos completos de esas filas (unión diferida).
+- Si el navegador envía la clave de la última fila de la página anterior
+  (despues_de), la siguiente página se pide con WHERE en lugar de OFFSET.
+- COUNT(*) y los totales se guardan en cache hasta que cambie alguno de
+  los sellos de versión del listado, o cambie el día.
+"""
+
+import json
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+from cache import CacheLRU, version_actual
+from config import Config
+
+_ALIAS = re.compile(r'\b([A-Za-z_]\w*)\.[A-Za-z_]')
+_MAX_PALABRAS = 5
+
+# Totales por listado y filtros: {(listado, versiones, fecha, where, parámetros): resumen}
+cache_conteos = CacheLRU(max_entradas=Config.LISTADOS_CONTEO_MAX, ttl=Config.LISTADOS_CONTEO_TTL)
+
+
+class Columna:
+    """
+    Columna de un listado.
+
+    nombre: nombre en DataTables (columns[i][data]) y en cada fila devuelta.
+    expresion: SQL del valor (se selecciona como `nombre`).
+    orden: expresiones ORDER BY (por defecto la misma expresión); None si no
+    se puede ordenar por esta columna.
+    invertir: ordenar al revés de lo pedido (p. ej. días de mora por fecha).
+    busqueda: expresiones en las que se busca por prefijo el texto del buscador.
+    clave: campo de la fila con el valor de orden, para pedir la página
+    siguiente por clave; None si esta columna no lo admite.
+    """
+
+    def __init__(self, nombre, expresion, orden=(), invertir=False, busqueda=(), clave=None):
+        self.nombre = nombre
+        self.expresion = expresion
+        self.orden = (expresion,) if orden == () else orden
+        self.invertir = invertir
+        self.busqueda = busqueda
+        self.clave = clave
+
+
+class Filtro:
+    """
+    Filtro por parámetro de la petición.
+
+    condicion: SQL con un único %s para el valor ya convertido.
+    convertir: función que convierte el texto recibido (ValueError si no es válido).
+    obligatorio: forma parte del listado en sí (p. ej. el sector de la página)
+    y cuenta también para recordsTotal.
+    """
+
+    def __init__(self, condicion, convertir=str, obligatorio=False):
+        self.condicion = condicion
+        self.convertir = convertir
+        self.obligatorio = obligatorio
+
+
+def fecha_iso(texto):
+    """Convierte 'YYYY-MM-DD' en date (ValueError si no es válida)"""
+    return datetime.strptime(texto, '%Y-%m-%d').date()
+
+
+def _patron_prefijo(palabra):
+    """Patrón LIKE 'palabra%' escapando los comodines"""
+    return palabra.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def valor_json(valor):
+    """Valores de MySQL a tipos que entiende jsonify y DataTables"""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (date, datetime)):
+        return valor.strftime('%d/%m/%Y')
+    return valor
+
+
+def _valor_clave(valor):
+    """Valor de orden de la última fila, tal como se devolverá en despues_de"""
+    if isinstance(valor, datetime):
+        return valor.isoformat(' ')
+    if isinstance(valor, date):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    return valor
+
+
+class Listado:
+    """
+    Declaración de un listado paginado en el servidor.
+
+    tabla: tabla base con su alias ('lectura l').
+    clave: expresión única por fila ('l.id_lectura'); en los listados
+    agrupados, la expresión del GROUP BY. Desempata el orden.
+    uniones: {alias: 'JOIN ...'} en orden; solo se incluyen las que hacen falta.
+    condicion: WHERE fijo del listado.
+    agrupar: si se indica, el listado es de agregados por esta expresión
+    (sin unión diferida ni paginación por clave).
+    totales: {nombre: expresión de agregado} que se calculan junto al COUNT.
+    versiones: sellos de version_cache de los que dependen los datos.
+    orden: (columna, 'asc'|'desc') si el navegador no pide otro.
+    """
+
+    def __init__(self, nombre, permiso, tabla, clave, columnas, uniones=None, condicion=None, filtros=None,
+                 agrupar=None, totales=None, versiones=(), orden=None):
+        self.nombre = nombre
+        self.permiso = permiso
+        self.tabla = tabla
+        self.clave = clave
+        self.columnas = {columna.nombre: columna for columna in columnas}
+        self.uniones = uniones or {}
+        self.condicion = condicion
+        self.filtros = filtros or {}
+        self.agrupar = agrupar
+        self.totales = totales or {}
+        self.versiones = versiones
+        self.orden = orden or (columnas[0].nombre, 'asc')
+
+    # --- Construcción del SQL ---
+
+    def _uniones_para(self, *fragmentos):
+        """JOIN necesarios para que las expresiones dadas tengan sus alias"""
+        pendientes = set()
+        for fragmento in fragmentos:
+            pendientes.update(_ALIAS.findall(fragmento))
+        necesarios = set()
+        while pendientes:
+            alias = pendientes.pop()
+            if alias in self.uniones and alias not in necesarios:
+                necesarios.add(alias)
+                pendientes.update(_ALIAS.findall(self.uniones[alias]))
+        return '\n'.join(union for alias, union in self.uniones.items() if alias in necesarios)
+
+    def leer_filtros(self, args):
+        """
+        Valores de los filtros declarados a partir de los parámetros de la
+        petición ({nombre: valor}). Los opcionales vacíos o inválidos se
+        ignoran; ValueError si falta o no es válido uno obligatorio.
+        """
+        valores = {}
+        for nombre, filtro in self.filtros.items():
+            texto = (args.get(nombre) or '').strip()
+            if not texto:
+                if filtro.obligatorio:
+                    raise ValueError(f"Falta el parámetro {nombre}")
+                continue
+            try:
+                valores[nombre] = filtro.convertir(texto)
+            except (ValueError, TypeError):
+                if filtro.obligatorio:
+                    raise ValueError(f"Valor no válido para {nombre}")
+        return valores
+
+    def _where(self, valores, buscar=None):
+        """Condiciones y parámetros para los filtros y el texto de búsqueda"""
+        condiciones = [self.condicion] if self.condicion else []
+        parametros = []
+        for nombre, valor in valores.items():
+            condiciones.append(self.filtros[nombre].condicion)
+            parametros.append(valor)
+        campos = [campo for columna in self.columnas.values() for campo in columna.busqueda]
+        if buscar and campos:
+            for palabra in buscar.split()[:_MAX_PALABRAS]:
+                patron = _patron_prefijo(palabra)
+                condiciones.append('(' + ' OR '.join(f"{campo} LIKE %s" for campo in campos) + ')')
+                parametros.extend([patron] * len(campos))
+        return ' AND '.join(condiciones) or 'TRUE', parametros
+
+    # --- Totales ---
+
+    def _versiones(self, obtener_conn):
+        return tuple(version_actual(obtener_conn, nombre) for nombre in self.versiones)
+
+    def resumen(self, obtener_conn, valores, buscar=None):
+        """
+        {'cantidad': filas, <total>: valor, ...} para los filtros dados, desde
+        la cache mientras no cambien los sellos de versión del listado.
+        """
+        where, parametros = self._where(valores, buscar)
+        versiones = self._versiones(obtener_conn)
+        clave = (self.nombre, versiones, date.today(), where, tuple(parametros))
+        if None not in versiones:
+            resumen = cache_conteos.obtener(clave)
+            if resumen is not None:
+                return resumen
+
+        contar = f"COUNT(DISTINCT {self.agrupar})" if self.agrupar else "COUNT(*)"
+        expresiones = [contar] + list(self.totales.values())
+        cursor = obtener_conn().cursor()
+        try:
+            cursor.execute(f"""
+                SELECT {', '.join(expresiones)}
+                FROM {self.tabla}
+                {self._uniones_para(where, *self.totales.values())}
+                WHERE {where}
+            """, parametros)
+            fila = cursor.fetchone()
+        finally:
+            cursor.close()
+
+        resumen = {'cantidad': fila[0]}
+        for nombre, valor in zip(self.totales, fila[1:]):
+            resumen[nombre] = float(valor or 0)
+        if None not in versiones:
+            cache_conteos.guardar(clave, resumen)
+        return resumen
+
+    # --- Página ---
+
+    def pagina(self, obtener_conn, args):
+        """
+        Respuesta completa para DataTables (draw, recordsTotal,
+        recordsFiltered, data) más `totales` de las filas filtradas y
+        `ultima_clave`, que el navegador puede devolver como despues_de
+        para pedir la página siguiente sin OFFSET.
+        """
+        draw = args.get('draw', 0, type=int)
+        inicio = max(args.get('start', 0, type=int), 0)
+        cantidad = args.get('length', 25, type=int)
+        if cantidad < 1 or cantidad > Config.LISTADOS_MAX_FILAS:
+            cantidad = Config.LISTADOS_MAX_FILAS
+        buscar = args.get('search[value]', '').strip() or None
+
+        valores = self.leer_filtros(args)
+        fijos = {nombre: valor for nombre, valor in valores.items() if self.filtros[nombre].obligatorio}
+
+        indice = args.get('order[0][column]', type=int)
+        nombre_columna = args.get(f'columns[{indice}][data]') if indice is not None else None
+        columna = self.columnas.get(nombre_columna)
+        if columna is None or not columna.orden:
+            columna = self.columnas[self.orden[0]]
+            pedido = self.orden[1]
+        else:
+            pedido = args.get('order[0][dir]', 'asc')
+        descendente = (pedido == 'desc') != columna.invertir
+        direccion = 'DESC' if descendente else 'ASC'
+        orden = ', '.join(f"{expresion} {direccion}" for expresion in columna.orden)
+        if columna.orden != (self.clave,):
+            orden += f", {self.clave} {direccion}"
+
+        where, parametros = self._where(valores, buscar)
+        desplazamiento = inicio
+        campo_clave = columna.clave if not self.agrupar else None
+        despues_de = args.get('despues_de')
+        if despues_de and campo_clave:
+            # Siguiente página por clave: (orden, clave) posteriores a la última fila
+            try:
+                valor, valor_clave = json.loads(despues_de)
+                comparador = '<' if descendente else '>'
+                if columna.orden == (self.clave,):
+                    where += f" AND {self.clave} {comparador} %s"
+                    parametros = parametros + [valor_clave]
+                else:
+                    expresion = columna.orden[0]
+                    where += (f" AND ({expresion} {comparador} %s"
+                              f" OR ({expresion} = %s AND {self.clave} {comparador} %s))")
+                    parametros = parametros + [valor, valor, valor_clave]
+                desplazamiento = 0
+            except (ValueError, TypeError):
+                pass
+
+        seleccion = ', '.join(f"{c.expresion} AS {c.nombre}" for c in self.columnas.values())
+        if self.agrupar:
+            sql = f"""
+                SELECT {seleccion}, {self.clave} AS clave_fila
+                FROM {self.tabla}
+                {self._uniones_para(where, seleccion, orden)}
+                WHERE {where}
+                GROUP BY {self.agrupar}
+                ORDER BY {orden}
+                LIMIT %s OFFSET %s
+            """
+        else:
+            # Unión diferida: las claves de la página recorriendo solo lo
+            # necesario para filtrar y ordenar; luego los datos de esas filas
+            sql = f"""
+                SELECT {seleccion}, {self.clave} AS clave_fila
+                FROM (
+                    SELECT {self.clave} AS clave_pagina
+                    FROM {self.tabla}
+                    {self._uniones_para(where, orden)}
+                    WHERE {where}
+                    ORDER BY {orden}
+                    LIMIT %s OFFSET %s
+                ) pagina
+                JOIN {self.tabla} ON {self.clave} = pagina.clave_pagina
+                {self._uniones_para(seleccion, orden)}
+                ORDER BY {orden}
+            """
+
+        resumen_total = self.resumen(obtener_conn, fijos)
+        filtrado = len(fijos) != len(valores) or buscar
+        resumen_filtrado = self.resumen(obtener_conn, valores, buscar) if filtrado else resumen_total
+
+        cursor = obtener_conn().cursor(dictionary=True)
+        try:
+            cursor.execute(sql, parametros + [cantidad, desplazamiento])
+            filas = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        ultima_clave = None
+        if filas and campo_clave:
+            ultima_clave = [_valor_clave(filas[-1][campo_clave]), _valor_clave(filas[-1]['clave_fila'])]
+
+        datos = [{nombre: valor_json(fila[nombre]) for nombre in self.columnas} for fila in filas]
+        totales = {nombre: valor for nombre, valor in resumen_filtrado.items() if nombre != 'cantidad'}
+        return {
+            'draw': draw,
+            'recordsTotal': resumen_total['cantidad'],
+            'recordsFiltered': resumen_filtrado['cantidad'],
+            'totales': totales,
+            'ultima_clave': ultima_clave,
+            'data': datos,
+        }
+
+
+# --- Listados de la aplicación ---
+
+_UNIONES_LECTURA = {
+    'c': "JOIN cliente c ON l.id_cliente = c.id_cliente",
+    's': "JOIN sector s ON c.id_sector = s.id_sector",
+}
+_UNIONES_CLIENTE = {
+    's': "JOIN sector s ON c.id_sector = s.id_sector",
+}
+_BUSQUEDA_CLIENTE = ('c.nombre', 'c.apellido', 'c.no_contador')
+_NOMBRE_CLIENTE = "CONCAT(c.nombre, ' ', c.apellido)"
+
+# Deuda pendiente de un cliente (usa idx_lectura_cliente_fecha)
+_DEUDA_CLIENTE = """(SELECT COALESCE(SUM(lp.monto_total), 0) FROM lectura lp
+                     WHERE lp.id_cliente = c.id_cliente AND lp.estado_pago = 'PENDIENTE')"""
+
+FACTURAS_PENDIENTES = Listado(
+    'facturas_pendientes', 'pagos.ver', 'lectura l', 'l.id_lectura',
+    columnas=[
+        Columna('id_lectura', 'l.id_lectura', clave='id_lectura'),
+        Columna('id_cliente', 'l.id_cliente', orden=None),
+        Columna('cliente', _NOMBRE_CLIENTE, orden=('c.nombre', 'c.apellido'), busqueda=('c.nombre', 'c.apellido')),
+        Columna('no_contador', 'c.no_contador', busqueda=('c.no_contador',)),
+        Columna('nombre_sector', 's.nombre_sector'),
+        Columna('fecha_lectura', 'l.fecha_lectura', clave='fecha_lectura'),
+        Columna('consumo_m3', 'l.consumo_m3'),
+        Columna('monto_total', 'l.monto_total', clave='monto_total'),
+        Columna('dias_mora', 'DATEDIFF(CURDATE(), l.fecha_lectura)', orden=('l.fecha_lectura',), invertir=True,
+                clave='fecha_lectura'),
+    ],
+    uniones=_UNIONES_LECTURA,
+    condicion="l.estado_pago = 'PENDIENTE'",
+    filtros={
+        'id_sector': Filtro("c.id_sector = %s", int),
+        'desde': Filtro("l.fecha_lectura >= %s", fecha_iso),
+        'hasta': Filtro("l.fecha_lectura <= %s", fecha_iso),
+    },
+    totales={
+        'monto': "COALESCE(SUM(l.monto_total), 0)",
+        'dias_mora': "COALESCE(AVG(DATEDIFF(CURDATE(), l.fecha_lectura)), 0)",
+    },
+    versiones=('lecturas', 'pagos'),
+    orden=('dias_mora', 'desc'),
+)
+
+USUARIOS = Listado(
+    'usuarios', 'usuarios.ver', 'usuario u', 'u.id_usuario',
+    columnas=[
+        Columna('id_usuario', 'u.id_usuario', clave='id_usuario'),
+        Columna('nombre_completo', "CONCAT(u.nombre, ' ', u.apellido)", orden=('u.nombre', 'u.apellido'),
+                busqueda=('u.nombre', 'u.apellido')),
+        Columna('correo_electronico', 'u.correo_electronico', busqueda=('u.correo_electronico',)),
+        Columna('rol', 'u.rol'),
+        Columna('activo', 'u.activo'),
+        Columna('fecha_creacion', 'u.fecha_creacion', clave='fecha_creacion'),
+    ],
+    filtros={
+        'rol': Filtro("u.rol = %s"),
+    },
+    versiones=('usuarios',),
+    orden=('id_usuario', 'desc'),
+)
+
+CLIENTES = Listado(
+    'clientes', 'clientes.crear', 'cliente c', 'c.id_cliente',
+    columnas=[
+        Columna('id_cliente', 'c.id_cliente', clave='id_cliente'),
+        Columna('cliente', _NOMBRE_CLIENTE, orden=('c.nombre', 'c.apellido'), busqueda=('c.nombre', 'c.apellido')),
+        Columna('nombre_sector', 's.nombre_sector'),
+        Columna('no_contador', 'c.no_contador', busqueda=('c.no_contador',)),
+        Columna('telefono', 'c.telefono', orden=None),
+    ],
+    uniones=_UNIONES_CLIENTE,
+    condicion="c.activo = TRUE",
+    filtros={
+        'id_sector': Filtro("c.id_sector = %s", int),
+    },
+    versiones=('clientes',),
+    orden=('id_cliente', 'desc'),
+)
+
+CLIENTES_SECTOR = Listado(
+    'clientes_sector', 'sectores.ver', 'cliente c', 'c.id_cliente',
+    columnas=[
+        Columna('id_cliente', 'c.id_cliente', clave='id_cliente'),
+        Columna('cliente', _NOMBRE_CLIENTE, orden=('c.nombre', 'c.apellido'), busqueda=('c.nombre', 'c.apellido')),
+        Columna('no_contador', 'c.no_contador', busqueda=('c.no_contador',)),
+        Columna('telefono', 'c.telefono', orden=None),
+        Columna('deuda', _DEUDA_CLIENTE),
+    ],
+    condicion="c.activo = TRUE",
+    filtros={
+        'id_sector': Filtro("c.id_sector = %s", int, obligatorio=True),
+    },
+    totales={
+        'deuda': f"COALESCE(SUM({_DEUDA_CLIENTE}), 0)",
+        'con_deuda': f"COALESCE(SUM({_DEUDA_CLIENTE} > 0), 0)",
+    },
+    versiones=('clientes', 'lecturas', 'pagos'),
+    orden=('deuda', 'desc'),
+)
+
+LISTADOS = {listado.nombre: listado for listado in (
+    FACTURAS_PENDIENTES, USUARIOS, CLIENTES, CLIENTES_SECTOR,
+)}
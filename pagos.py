@@ -0,0 +1,316 @@
+# pagos.py - Registro de pagos seguro ante cobros simultáneos
+"""
+Cobro de facturas, individual o de varias de un mismo cliente a la vez.
+
+Varios cajeros pueden intentar cobrar la misma factura al mismo tiempo, y un
+mismo formulario puede llegar dos veces (doble clic, reenvío del navegador).
+Por eso cada cobro es una sola transacción que:
+
+- anota la clave de idempotencia del formulario en pago_solicitud, con el
+  tipo de cobro; si la clave ya existe el cobro se hizo antes y se devuelve
+  el mismo resultado (o un error si fue de otro tipo);
+- toma las facturas con un UPDATE condicional (estado_pago = 'PENDIENTE'):
+  el UPDATE bloquea las filas y solo cambia las que siguen pendientes, así
+  que si no cambian todas, otro cobro se adelantó y no se cobra ninguna;
+- inserta los pagos con INSERT ... SELECT (pago.id_lectura es único) y
+  los suma a la fila del día y cajero en ingreso_diario, que solo comparten
+  los cobros de una misma caja.
+
+El sello 'pagos' de version_cache es una sola fila para todos los cobros:
+se incrementa después del commit, en una sentencia aparte que se confirma
+de inmediato (_incrementar_sello_pagos), para que los cobros de distintas
+cajas no esperen unos por otros. Una cache que leyó el sello anterior y los
+datos después del commit guarda datos más nuevos de lo que indica su clave,
+nunca más viejos.
+
+Si MySQL aborta la transacción por un interbloqueo o una espera de bloqueo
+demasiado larga, ejecutar_con_reintentos() la repite completa.
+
+Un cobro de varias facturas queda registrado en pago_grupo y sirve después
+para emitir un solo recibo con todas ellas.
+
+ingreso_diario guarda el total y la cantidad de pagos de cada día por cajero
+receptor (una fila por cajero, para que los cobros de distintas cajas no
+esperen por la misma fila). El reporte de ingresos lee esa tabla en lugar
+de agrupar todos los pagos del período; reconstruir_ingresos_diarios() la
+recalcula desde la tabla pago.
+"""
+
+import mysql.connector
+
+from cache import incrementar_version
+from config import Config
+from conexion import ejecutar_con_reintentos
+
+
+# Tipos de cobro en pago_solicitud
+SOLICITUD_FACTURA = 'FACTURA'
+SOLICITUD_GRUPO = 'GRUPO'
+
+
+def _marcadores(valores):
+    return ', '.join(['%s'] * len(valores))
+
+
+def facturas_pendientes_cliente(conn, id_cliente):
+    """Facturas pendientes de un cliente, de la más antigua a la más reciente"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT id_lectura, fecha_lectura, lectura_anterior, lectura_actual, consumo_m3, monto_total,
+                   DATEDIFF(CURDATE(), fecha_lectura) AS dias_mora
+            FROM lectura
+            WHERE id_cliente = %s AND estado_pago = 'PENDIENTE'
+            ORDER BY fecha_lectura, id_lectura
+        """, (id_cliente,))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def _reservar_solicitud(cursor, clave, id_usuario, tipo):
+    """
+    Anota la clave de idempotencia de un formulario de cobro.
+
+    Devuelve False si la clave ya estaba (el formulario se envió dos veces).
+    Si el primer envío aún no termina, el INSERT espera su commit o rollback.
+    """
+    try:
+        cursor.execute("INSERT INTO pago_solicitud (clave, id_usuario, tipo) VALUES (%s, %s, %s)",
+                       (clave, id_usuario, tipo))
+        return True
+    except mysql.connector.IntegrityError as err:
+        if err.errno != 1062:  # ER_DUP_ENTRY
+            raise
+        return False
+
+
+def _solicitud_anterior(conn, cursor, clave, tipo):
+    """
+    id_pago (SOLICITUD_FACTURA) o id_pago_grupo (SOLICITUD_GRUPO) del cobro
+    ya registrado con esta clave. ValueError si la clave se usó para el otro
+    tipo de cobro.
+    """
+    # La transacción actual no puede ver el commit del primer envío
+    conn.rollback()
+    cursor.execute("SELECT tipo, id_pago, id_pago_grupo FROM pago_solicitud WHERE clave = %s", (clave,))
+    fila = cursor.fetchone()
+    if fila is None:
+        raise ValueError("No se encontró el cobro de este formulario; vuelva a cargar la página.")
+    tipo_anterior, id_pago, id_pago_grupo = fila
+    if tipo_anterior is None:  # Claves anotadas antes de guardar el tipo
+        tipo_anterior = SOLICITUD_GRUPO if id_pago_grupo is not None else SOLICITUD_FACTURA
+    resultado = id_pago_grupo if tipo == SOLICITUD_GRUPO else id_pago
+    if tipo_anterior != tipo or resultado is None:
+        raise ValueError("Este formulario ya se usó para otro cobro; vuelva a cargar la página.")
+    return resultado
+
+
+def _sumar_ingresos(cursor, condicion, parametros):
+    """Suma a ingreso_diario los pagos recién insertados que cumplen `condicion`"""
+    cursor.execute(f"""
+        INSERT INTO ingreso_diario (fecha, id_usuario_receptor, total, cantidad)
+        SELECT DATE(fecha_pago), id_usuario_receptor, SUM(monto_pagado), COUNT(*)
+        FROM pago
+        WHERE {condicion}
+        GROUP BY DATE(fecha_pago), id_usuario_receptor
+        ON DUPLICATE KEY UPDATE
+            total = ingreso_diario.total + VALUES(total),
+            cantidad = ingreso_diario.cantidad + VALUES(cantidad)
+    """, parametros)
+
+
+def _incrementar_sello_pagos(conn):
+    """
+    Incrementa el sello 'pagos' en una transacción propia, después del commit
+    del cobro. Si falla, el cobro ya quedó registrado: las caches que dependen
+    del sello se renuevan al vencer su TTL.
+    """
+    cursor = conn.cursor()
+    try:
+        incrementar_version(cursor, 'pagos')
+        conn.commit()
+    except mysql.connector.Error as err:
+        conn.rollback()
+        print(f"ERROR al incrementar el sello 'pagos': {err}")
+    finally:
+        cursor.close()
+
+
+def reconstruir_ingresos_diarios(conn, desde=None, hasta=None):
+    """
+    Recalcula ingreso_diario desde la tabla pago: completa, o solo los días
+    de desde a hasta (date). Devuelve el número de filas (día y cajero).
+    Hace commit al terminar.
+
+    Mientras corre, los cobros de esos días esperan a que termine.
+    """
+    condicion_dias, condicion_pagos, parametros = "", "", ()
+    if desde and hasta:
+        condicion_dias = "WHERE fecha BETWEEN %s AND %s"
+        condicion_pagos = "WHERE fecha_pago >= %s AND fecha_pago < %s + INTERVAL 1 DAY"
+        parametros = (desde, hasta)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DELETE FROM ingreso_diario {condicion_dias}", parametros)
+        cursor.execute(f"""
+            INSERT INTO ingreso_diario (fecha, id_usuario_receptor, total, cantidad)
+            SELECT DATE(fecha_pago), id_usuario_receptor, SUM(monto_pagado), COUNT(*)
+            FROM pago
+            {condicion_pagos}
+            GROUP BY DATE(fecha_pago), id_usuario_receptor
+        """, parametros)
+        total = cursor.rowcount
+        incrementar_version(cursor, 'pagos')
+        conn.commit()
+        return total
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def registrar_pago(conn, id_lectura, id_usuario, clave=None):
+    """
+    Cobra una factura y devuelve (id_pago, repetido).
+
+    repetido es True si el formulario con esta clave ya se había procesado;
+    en ese caso no se cobra de nuevo y se devuelve el pago original.
+    ValueError si la factura no existe o ya está pagada.
+    """
+    def transaccion(conn):
+        cursor = conn.cursor()
+        try:
+            if clave and not _reservar_solicitud(cursor, clave, id_usuario, SOLICITUD_FACTURA):
+                return _solicitud_anterior(conn, cursor, clave, SOLICITUD_FACTURA), True
+
+            cursor.execute("""
+                UPDATE lectura SET estado_pago = 'PAGADO'
+                WHERE id_lectura = %s AND estado_pago = 'PENDIENTE'
+            """, (id_lectura,))
+            if cursor.rowcount != 1:
+                raise ValueError("Factura no encontrada o ya pagada.")
+
+            cursor.execute("""
+                INSERT INTO pago (id_lectura, monto_pagado, id_usuario_receptor)
+                SELECT id_lectura, monto_total, %s
+                FROM lectura
+                WHERE id_lectura = %s
+            """, (id_usuario, id_lectura))
+            id_pago = cursor.lastrowid
+            if clave:
+                cursor.execute("UPDATE pago_solicitud SET id_pago = %s WHERE clave = %s", (id_pago, clave))
+            _sumar_ingresos(cursor, "id_pago = %s", (id_pago,))
+            conn.commit()
+            return id_pago, False
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    id_pago, repetido = ejecutar_con_reintentos(conn, transaccion)
+    if not repetido:
+        _incrementar_sello_pagos(conn)
+    print(f"DEBUG pago {id_pago}: lectura {id_lectura}{' (repetido)' if repetido else ''}")
+    return id_pago, repetido
+
+
+def registrar_pago_grupo(conn, id_cliente, ids_lectura, id_usuario, clave=None):
+    """
+    Cobra las facturas `ids_lectura` del cliente y devuelve (id_pago_grupo, repetido).
+
+    ValueError si no se eligió ninguna, si son demasiadas o si alguna ya no
+    está pendiente (en ese caso no se registra ningún pago).
+    """
+    ids = sorted({int(id_lectura) for id_lectura in ids_lectura})
+    if not ids:
+        raise ValueError("Seleccione al menos una factura")
+    if len(ids) > Config.PAGOS_MAX_FACTURAS:
+        raise ValueError(f"No se pueden cobrar más de {Config.PAGOS_MAX_FACTURAS} facturas a la vez")
+
+    def transaccion(conn):
+        cursor = conn.cursor()
+        try:
+            if clave and not _reservar_solicitud(cursor, clave, id_usuario, SOLICITUD_GRUPO):
+                return _solicitud_anterior(conn, cursor, clave, SOLICITUD_GRUPO), True
+
+            # Las filas se bloquean en orden de id_lectura, igual en todos los
+            # cobros, para no provocar interbloqueos entre ellos
+            cursor.execute(f"""
+                UPDATE lectura SET estado_pago = 'PAGADO'
+                WHERE id_lectura IN ({_marcadores(ids)}) AND id_cliente = %s AND estado_pago = 'PENDIENTE'
+            """, ids + [id_cliente])
+            if cursor.rowcount != len(ids):
+                conn.rollback()
+                cursor.execute(f"""
+                    SELECT id_lectura FROM lectura
+                    WHERE id_lectura IN ({_marcadores(ids)}) AND id_cliente = %s AND estado_pago = 'PENDIENTE'
+                """, ids + [id_cliente])
+                faltantes = sorted(set(ids) - {fila[0] for fila in cursor.fetchall()})
+                raise ValueError("Las facturas " + ', '.join(f"#{id_lectura}" for id_lectura in faltantes)
+                                 + " ya no están pendientes o no son de este cliente")
+
+            cursor.execute(f"""
+                INSERT INTO pago_grupo (id_cliente, cantidad_facturas, monto_total, id_usuario_receptor)
+                SELECT %s, COUNT(*), SUM(monto_total), %s
+                FROM lectura
+                WHERE id_lectura IN ({_marcadores(ids)})
+            """, [id_cliente, id_usuario] + ids)
+            id_pago_grupo = cursor.lastrowid
+
+            cursor.execute(f"""
+                INSERT INTO pago (id_lectura, monto_pagado, id_usuario_receptor, id_pago_grupo)
+                SELECT id_lectura, monto_total, %s, %s
+                FROM lectura
+                WHERE id_lectura IN ({_marcadores(ids)})
+            """, [id_usuario, id_pago_grupo] + ids)
+            if clave:
+                cursor.execute("UPDATE pago_solicitud SET id_pago_grupo = %s WHERE clave = %s",
+                               (id_pago_grupo, clave))
+            _sumar_ingresos(cursor, "id_pago_grupo = %s", (id_pago_grupo,))
+            conn.commit()
+            return id_pago_grupo, False
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    id_pago_grupo, repetido = ejecutar_con_reintentos(conn, transaccion)
+    if not repetido:
+        _incrementar_sello_pagos(conn)
+    print(f"DEBUG pago_grupo {id_pago_grupo}: cliente {id_cliente}, {len(ids)} facturas"
+          f"{' (repetido)' if repetido else ''}")
+    return id_pago_grupo, repetido
+
+
+def obtener_pago_grupo(conn, id_pago_grupo):
+    """Datos del grupo, del cliente y sus facturas (None si no existe)"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT g.id_pago_grupo, g.id_cliente, g.cantidad_facturas, g.monto_total, g.fecha_pago,
+                   c.nombre, c.apellido, c.no_contador, s.nombre_sector
+            FROM pago_grupo g
+            JOIN cliente c ON g.id_cliente = c.id_cliente
+            JOIN sector s ON c.id_sector = s.id_sector
+            WHERE g.id_pago_grupo = %s
+        """, (id_pago_grupo,))
+        grupo = cursor.fetchone()
+        if grupo is None:
+            return None
+
+        cursor.execute("""
+            SELECT l.id_lectura, l.fecha_lectura, l.lectura_anterior, l.lectura_actual, l.consumo_m3,
+                   p.monto_pagado
+            FROM pago p
+            JOIN lectura l ON p.id_lectura = l.id_lectura
+            WHERE p.id_pago_grupo = %s
+            ORDER BY l.fecha_lectura, l.id_lectura
+        """, (id_pago_grupo,))
+        grupo['facturas'] = cursor.fetchall()
+        return grupo
+    finally:
+        cursor.close()
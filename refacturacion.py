@@ -0,0 +1,281 @@
+# refacturacion.py - Recalcular el monto de las facturas pendientes tras un cambio de tarifas
+"""
+Trabajo por lotes que recalcula monto_total de las lecturas con
+estado_pago = 'PENDIENTE' con las tarifas vigentes (facturacion.py).
+
+- Recorre las lecturas pendientes por id_lectura (paginación por clave, sin
+  OFFSET) en lotes de REFACTURACION_LOTE filas.
+- Calcula los montos del lote de una vez (NumPy) y escribe solo los que
+  cambian, con un único UPDATE ... CASE por lote.
+- Cada lote es una transacción corta que también guarda el avance en la
+  tabla refacturacion; si el proceso se interrumpe, se reanuda desde el
+  último lote confirmado.
+- En modo simulación no modifica lecturas; acumula el resumen de
+  diferencias (cantidad, montos antes y después y las mayores diferencias).
+"""
+
+import json
+import time
+
+import numpy as np
+
+from cache import incrementar_version
+from config import Config
+from consumo import refrescar_consumo_mensual
+from facturacion import calcular_facturas_por_fecha, tarifa_vigente
+from lecturas import bloquear_ultimas_lecturas, marcar_lecturas_modificadas
+
+ESTADO_EN_CURSO = 'EN_CURSO'
+ESTADO_TERMINADA = 'TERMINADA'
+ESTADO_CANCELADA = 'CANCELADA'
+
+MAYORES_DIFERENCIAS = 20  # diferencias que se guardan como muestra en el resumen
+
+
+def iniciar_refacturacion(conn, simulacion=False, fecha_tarifa=None, id_usuario=None):
+    """
+    Registra un nuevo trabajo de refacturación y devuelve su id.
+
+    fecha_tarifa: si se indica, todas las lecturas se facturan con el esquema
+    vigente en esa fecha; si es None, cada una con el vigente en su fecha de
+    lectura.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO refacturacion (simulacion, fecha_tarifa, id_usuario)
+            VALUES (%s, %s, %s)
+        """, (simulacion, fecha_tarifa, id_usuario))
+        id_refacturacion = cursor.lastrowid
+        conn.commit()
+        return id_refacturacion
+    finally:
+        cursor.close()
+
+
+def obtener_refacturacion(conn, id_refacturacion):
+    """Estado y resumen de un trabajo (None si no existe)"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT * FROM refacturacion WHERE id_refacturacion = %s", (id_refacturacion,))
+        trabajo = cursor.fetchone()
+    finally:
+        cursor.close()
+    if trabajo is not None:
+        trabajo['muestra'] = json.loads(trabajo['muestra']) if trabajo.get('muestra') else []
+    return trabajo
+
+
+def listar_refacturaciones(conn, limite=10):
+    """Últimos trabajos, del más reciente al más antiguo"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT r.*, CONCAT(u.nombre, ' ', u.apellido) AS usuario
+            FROM refacturacion r
+            LEFT JOIN usuario u ON r.id_usuario = u.id_usuario
+            ORDER BY r.id_refacturacion DESC
+            LIMIT %s
+        """, (limite,))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def refacturacion_en_curso(conn, simulacion=False):
+    """Id del último trabajo sin terminar del tipo indicado (o None)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT MAX(id_refacturacion) FROM refacturacion
+            WHERE estado = %s AND simulacion = %s
+        """, (ESTADO_EN_CURSO, simulacion))
+        fila = cursor.fetchone()
+        return fila[0] if fila else None
+    finally:
+        cursor.close()
+
+
+def cancelar_refacturacion(conn, id_refacturacion):
+    """Marca un trabajo en curso como cancelado (los lotes ya guardados se mantienen)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE refacturacion SET estado = %s, terminada_en = NOW()
+            WHERE id_refacturacion = %s AND estado = %s
+        """, (ESTADO_CANCELADA, id_refacturacion, ESTADO_EN_CURSO))
+        conn.commit()
+        return cursor.rowcount > 0
+    finally:
+        cursor.close()
+
+
+def _actualizar_montos(cursor, cambios):
+    """UPDATE ... CASE con los nuevos montos de un lote: [(id_lectura, monto), ...]"""
+    casos = ' '.join(['WHEN %s THEN %s'] * len(cambios))
+    marcadores = ', '.join(['%s'] * len(cambios))
+    parametros = [valor for cambio in cambios for valor in cambio]
+    parametros += [id_lectura for id_lectura, _ in cambios]
+    # estado_pago en el WHERE: si la factura se pagó mientras tanto, no se toca
+    cursor.execute(f"""
+        UPDATE lectura
+        SET monto_total = CASE id_lectura {casos} END
+        WHERE id_lectura IN ({marcadores}) AND estado_pago = 'PENDIENTE'
+    """, parametros)
+    return cursor.rowcount
+
+
+def _leer_lote(cursor, condicion, parametros, limite=None, bloquear=False):
+    """(id_lectura, fecha, consumo, monto_total, no_contador, id_cliente) de las lecturas pendientes"""
+    cursor.execute(f"""
+        SELECT l.id_lectura, l.fecha_lectura, l.lectura_actual - l.lectura_anterior, l.monto_total,
+               c.no_contador, l.id_cliente
+        FROM lectura l
+        JOIN cliente c ON l.id_cliente = c.id_cliente
+        WHERE l.estado_pago = 'PENDIENTE' AND {condicion}
+        ORDER BY l.id_lectura
+        {'' if limite is None else f'LIMIT {int(limite)}'}
+        {'FOR UPDATE OF l' if bloquear else ''}
+    """, parametros)
+    return cursor.fetchall()
+
+
+def _combinar_muestra(muestra, nuevas):
+    """Conserva las MAYORES_DIFERENCIAS diferencias de mayor valor absoluto"""
+    muestra = muestra + nuevas
+    muestra.sort(key=lambda fila: abs(fila['diferencia']), reverse=True)
+    return muestra[:MAYORES_DIFERENCIAS]
+
+
+def ejecutar_refacturacion(conn, id_refacturacion, tamano_lote=None, limite_segundos=None, pausa=None,
+                           al_avanzar=None):
+    """
+    Procesa un trabajo desde su último avance guardado.
+
+    Se detiene al terminar, o antes si pasan `limite_segundos` (el trabajo
+    queda EN_CURSO y se puede continuar con otra llamada). Entre lotes
+    espera `pausa` segundos para no competir con los cobros en caja.
+    al_avanzar(trabajo) se llama después de cada lote. Devuelve el trabajo
+    actualizado.
+    """
+    tamano_lote = tamano_lote or Config.REFACTURACION_LOTE
+    pausa = Config.REFACTURACION_PAUSA if pausa is None else pausa
+    inicio = time.monotonic()
+
+    trabajo = obtener_refacturacion(conn, id_refacturacion)
+    if trabajo is None:
+        raise ValueError(f"No existe la refacturación {id_refacturacion}")
+    if trabajo['estado'] != ESTADO_EN_CURSO:
+        return trabajo
+
+    simulacion = bool(trabajo['simulacion'])
+    fecha_tarifa = trabajo['fecha_tarifa']
+    conn.rollback()  # empezar cada lote con una lectura actual de los datos
+
+    while True:
+        cursor = conn.cursor()
+        try:
+            # La fila del trabajo queda bloqueada durante el lote: dos ejecuciones
+            # simultáneas del mismo trabajo se turnan, y una cancelación lo detiene
+            cursor.execute("""
+                SELECT estado, ultimo_id_lectura, lecturas_revisadas, lecturas_cambiadas,
+                       monto_anterior, monto_nuevo, muestra
+                FROM refacturacion
+                WHERE id_refacturacion = %s
+                FOR UPDATE
+            """, (id_refacturacion,))
+            (trabajo['estado'], trabajo['ultimo_id_lectura'], trabajo['lecturas_revisadas'],
+             trabajo['lecturas_cambiadas'], trabajo['monto_anterior'], trabajo['monto_nuevo'],
+             muestra) = cursor.fetchone()
+            muestra = json.loads(muestra) if muestra else []
+            if trabajo['estado'] != ESTADO_EN_CURSO:
+                conn.rollback()
+                break
+
+            filas = _leer_lote(cursor, "l.id_lectura > %s", (trabajo['ultimo_id_lectura'],), limite=tamano_lote)
+
+            if not filas:
+                cursor.execute("""
+                    UPDATE refacturacion SET estado = %s, terminada_en = NOW()
+                    WHERE id_refacturacion = %s
+                """, (ESTADO_TERMINADA, id_refacturacion))
+                conn.commit()
+                trabajo['estado'] = ESTADO_TERMINADA
+                print(f"DEBUG refacturacion {id_refacturacion}: terminada, "
+                      f"{trabajo['lecturas_cambiadas']} de {trabajo['lecturas_revisadas']} facturas cambian")
+                break
+
+            ultimo_id_lectura = filas[-1][0]
+            if not simulacion:
+                # La última lectura de cada cliente se bloquea antes que sus
+                # lecturas, como al registrar o editar una (ver consumo.py), y el
+                # lote se vuelve a leer bloqueado: una lectura editada o pagada
+                # desde la primera consulta se recalcula con sus valores actuales
+                bloquear_ultimas_lecturas(cursor, {fila[5] for fila in filas})
+                ids_lote = [fila[0] for fila in filas]
+                filas = _leer_lote(cursor, f"l.id_lectura IN ({', '.join(['%s'] * len(ids_lote))})",
+                                   ids_lote, bloquear=True)
+
+            ids = np.array([fila[0] for fila in filas], dtype=np.int64)
+            consumos = np.array([float(fila[2]) for fila in filas], dtype=np.float64)
+            anteriores = np.array([float(fila[3]) for fila in filas], dtype=np.float64)
+            if not filas:
+                nuevos = np.zeros(0)
+            elif fecha_tarifa is not None:
+                nuevos = tarifa_vigente(lambda: conn, fecha_tarifa).calcular_lote(consumos)
+            else:
+                nuevos = calcular_facturas_por_fecha(lambda: conn, consumos, [fila[1] for fila in filas])
+
+            cambian = np.abs(nuevos - anteriores) >= 0.005
+            cambios = list(zip(ids[cambian].tolist(), nuevos[cambian].tolist()))
+            cambiadas = len(cambios)
+            if cambios and not simulacion:
+                filas_cambiadas = [fila for fila, cambia in zip(filas, cambian.tolist()) if cambia]
+                cambiadas = _actualizar_montos(cursor, cambios)
+                clientes = {fila[5] for fila in filas_cambiadas}
+                refrescar_consumo_mensual(cursor, clientes, min(fila[1] for fila in filas_cambiadas))
+                marcar_lecturas_modificadas(cursor, clientes)
+                incrementar_version(cursor, 'lecturas')
+
+            muestra = _combinar_muestra(muestra, [
+                {
+                    'id_lectura': fila[0],
+                    'no_contador': fila[4],
+                    'monto_anterior': float(fila[3]),
+                    'monto_nuevo': float(nuevo),
+                    'diferencia': round(float(nuevo) - float(fila[3]), 2),
+                }
+                for fila, nuevo, cambia in zip(filas, nuevos.tolist(), cambian.tolist()) if cambia
+            ])
+
+            trabajo['ultimo_id_lectura'] = int(ultimo_id_lectura)
+            trabajo['lecturas_revisadas'] += len(filas)
+            trabajo['lecturas_cambiadas'] += cambiadas
+            trabajo['monto_anterior'] = float(trabajo['monto_anterior']) + float(anteriores.sum())
+            trabajo['monto_nuevo'] = float(trabajo['monto_nuevo']) + float(nuevos.sum())
+            trabajo['muestra'] = muestra
+
+            # El avance se guarda en la misma transacción que los montos del lote
+            cursor.execute("""
+                UPDATE refacturacion
+                SET ultimo_id_lectura = %s, lecturas_revisadas = %s, lecturas_cambiadas = %s,
+                    monto_anterior = %s, monto_nuevo = %s, muestra = %s
+                WHERE id_refacturacion = %s
+            """, (trabajo['ultimo_id_lectura'], trabajo['lecturas_revisadas'], trabajo['lecturas_cambiadas'],
+                  round(trabajo['monto_anterior'], 2), round(trabajo['monto_nuevo'], 2),
+                  json.dumps(muestra), id_refacturacion))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        if al_avanzar is not None:
+            al_avanzar(trabajo)
+        if limite_segundos is not None and time.monotonic() - inicio >= limite_segundos:
+            break
+        if pausa:
+            time.sleep(pausa)
+
+    return trabajo
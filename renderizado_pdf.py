@@ -0,0 +1,153 @@
+# renderizado_pdf.py - Pool de procesos para dibujar los reportes PDF
+"""
+ReportLab es Python puro: mientras un hilo dibuja un reporte grande, los
+demás hilos del worker (peticiones, otros trabajos) casi no avanzan por el
+GIL. Los reportes con muchas filas se dibujan en un pool de procesos:
+
+- renderizar() recibe el nombre del reporte y sus argumentos; las listas de
+  filas (dicts del cursor) viajan como tuplas con los nombres de columna
+  una sola vez, que es mucho menos que serializar un dict por fila.
+- Si el reporte tiene menos de PDF_FILAS_EN_PROCESO filas se dibuja en el
+  mismo proceso: arrancar otro proceso y copiar los datos cuesta más que
+  dibujar unas pocas páginas (recibos, reportes de un cliente nuevo).
+- El pool ('spawn', para no heredar hilos ni conexiones del worker) se crea
+  al primer uso con PDF_PROCESOS procesos; cada uno se reemplaza tras
+  PDF_TAREAS_POR_PROCESO reportes para devolver la memoria de ReportLab.
+  Con PDF_PROCESOS=0 todo se dibuja en el mismo proceso.
+- renderizar_partes() dibuja en el mismo pool un documento por parte (los
+  avisos de cobro por lotes, ver avisos.py): los trabajos simultáneos
+  comparten los PDF_PROCESOS procesos en lugar de crear cada uno los suyos.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import Config
+from reportes_pdf import (generar_pdf_reporte_ingresos, generar_pdf_reporte_morosos,
+                          generar_pdf_reporte_consumo, generar_pdf_reporte_individual, generar_avisos_pdf)
+
+REPORTES = {
+    'ingresos': generar_pdf_reporte_ingresos,
+    'morosos': generar_pdf_reporte_morosos,
+    'consumo': generar_pdf_reporte_consumo,
+    'individual': generar_pdf_reporte_individual,
+    'avisos': generar_avisos_pdf,
+}
+
+# Lista de filas empaquetada para enviarla a otro proceso
+Filas = namedtuple('Filas', 'columnas tuplas')
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _empaquetar(valor):
+    if isinstance(valor, list) and valor and isinstance(valor[0], dict):
+        columnas = tuple(valor[0])
+        return Filas(columnas, [tuple(fila.values()) for fila in valor])
+    return valor
+
+
+def _desempaquetar(valor):
+    if isinstance(valor, Filas):
+        return [dict(zip(valor.columnas, fila)) for fila in valor.tuplas]
+    return valor
+
+
+def _dibujar(nombre, destino, argumentos):
+    """Se ejecuta en los procesos del pool: escribe el PDF en `destino` o devuelve sus bytes"""
+    argumentos = [_desempaquetar(valor) for valor in argumentos]
+    if destino is not None:
+        REPORTES[nombre](destino, *argumentos)
+        return destino
+    buffer = io.BytesIO()
+    REPORTES[nombre](buffer, *argumentos)
+    return buffer.getvalue()
+
+
+def _obtener_pool():
+    """Pool de este proceso; se crea al primer uso (y de nuevo tras un fork)"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=Config.PDF_PROCESOS,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        max_tasks_per_child=Config.PDF_TAREAS_POR_PROCESO)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _descartar_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def cantidad_filas(argumentos):
+    return sum(len(valor.tuplas) if isinstance(valor, Filas) else len(valor)
+               for valor in argumentos if isinstance(valor, (list, Filas)))
+
+
+def renderizar(nombre, destino, *argumentos):
+    """
+    Dibuja el reporte `nombre` (ver REPORTES) con los mismos argumentos que su
+    función generar_pdf_reporte_*, sin el buffer.
+
+    Si `destino` es una ruta el PDF se escribe ahí y se devuelve la ruta; si
+    es None se devuelven los bytes del PDF.
+    """
+    filas = cantidad_filas(argumentos)
+    if Config.PDF_PROCESOS < 1 or filas < Config.PDF_FILAS_EN_PROCESO:
+        return _dibujar(nombre, destino, argumentos)
+
+    inicio = time.perf_counter()
+    pool = _obtener_pool()
+    try:
+        resultado = pool.submit(_dibujar, nombre, destino, [_empaquetar(valor) for valor in argumentos]).result()
+    except BrokenProcessPool:
+        # Un proceso del pool murió (memoria, señal): el siguiente reporte crea otro pool
+        _descartar_pool(pool)
+        raise
+    print(f"DEBUG renderizado_pdf {nombre}: {filas} filas en el pool, {time.perf_counter() - inicio:.1f} s")
+    return resultado
+
+
+def renderizar_partes(nombre, partes):
+    """
+    Dibuja el reporte `nombre` una vez por cada lista de argumentos de
+    `partes` (sin el buffer) y devuelve un iterador con los bytes de cada PDF,
+    en el mismo orden. Con el pool, todas las partes se encolan a la vez y se
+    entregan a medida que terminan; si quien itera se detiene, las partes que
+    no empezaron se cancelan.
+    """
+    filas = sum(cantidad_filas(argumentos) for argumentos in partes)
+    if Config.PDF_PROCESOS < 1 or filas < Config.PDF_FILAS_EN_PROCESO:
+        return (_dibujar(nombre, None, argumentos) for argumentos in partes)
+    return _entregar_partes(nombre, partes, filas)
+
+
+def _entregar_partes(nombre, partes, filas):
+    inicio = time.perf_counter()
+    pool = _obtener_pool()
+    futuros = [pool.submit(_dibujar, nombre, None, [_empaquetar(valor) for valor in argumentos])
+               for argumentos in partes]
+    try:
+        for futuro in futuros:
+            yield futuro.result()
+    except BrokenProcessPool:
+        _descartar_pool(pool)
+        raise
+    finally:
+        for futuro in futuros:
+            futuro.cancel()
+    print(f"DEBUG renderizado_pdf {nombre}: {len(partes)} partes, {filas} filas en el pool, "
+          f"{time.perf_counter() - inicio:.1f} s")
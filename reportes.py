@@ -0,0 +1,243 @@
+# reportes.py - Reportes de ingresos, morosos y consumo
+"""
+Cada reporte se declara una vez (Reporte) con su consulta, si usa rango de
+fechas, los sellos de versión (version_cache) de los que dependen sus datos
+y los totales que se muestran al pie.
+
+resultado() ejecuta la consulta completa y guarda las filas en
+cache_reportes, con clave (reporte, sellos de versión, rango), durante
+REPORTES_CACHE_TTL segundos. La tabla HTML (por páginas, ver pagina()), el
+PDF y las exportaciones leen ese mismo resultado: ver un reporte y después
+exportarlo consulta la BD una sola vez. Un pago o una lectura nueva
+incrementa su sello y el resultado guardado deja de usarse.
+"""
+
+from datetime import datetime
+
+from cache import CacheLRU, version_actual
+from config import Config
+from consumo import meses_completos
+from exportaciones import abrir_consulta, leer_por_lotes
+from listas import fecha_iso, valor_json
+
+# Filas de cada reporte: {(reporte, versiones, desde, hasta): tupla de filas}
+cache_reportes = CacheLRU(max_entradas=Config.REPORTES_CACHE_MAX, ttl=Config.REPORTES_CACHE_TTL)
+
+
+class Reporte:
+    """
+    Declaración de un reporte.
+
+    sql: consulta completa; con fechas recibe %(desde)s y %(hasta)s.
+    columnas: columnas que se envían a la tabla HTML (y por las que se ordena)
+    y que se exportan, con sus encabezados en el mismo orden.
+    versiones: sellos de version_cache de los que dependen los datos.
+    busqueda: columnas en las que busca (por prefijo) el buscador de la tabla.
+    totales: {nombre: columna que se suma} para el pie de la tabla y del PDF.
+    archivo: prefijo del nombre de los archivos exportados.
+    preparar: función que completa los parámetros de la consulta a partir
+    del período (p. ej. meses_completos()).
+    """
+
+    def __init__(self, nombre, titulo, sql, columnas, encabezados, versiones, fechas=True, busqueda=(),
+                 totales=None, archivo=None, preparar=None):
+        self.nombre = nombre
+        self.titulo = titulo
+        self.sql = sql
+        self.columnas = columnas
+        self.encabezados = encabezados
+        self.versiones = versiones
+        self.fechas = fechas
+        self.busqueda = busqueda
+        self.totales = totales or {}
+        self.archivo = archivo
+        self.preparar = preparar
+
+    def leer_parametros(self, fecha_inicio, fecha_fin):
+        """{'desde': date, 'hasta': date} del período ({} si el reporte no usa fechas); ValueError si no es válido"""
+        if not self.fechas:
+            return {}
+        try:
+            desde, hasta = fecha_iso(fecha_inicio), fecha_iso(fecha_fin)
+        except (ValueError, TypeError):
+            raise ValueError("Seleccione un período válido")
+        if desde > hasta:
+            raise ValueError("La fecha inicial es posterior a la final")
+        return {'desde': desde, 'hasta': hasta}
+
+    def _clave(self, obtener_conn, parametros):
+        """Clave del resultado en cache_reportes (None si no se pudieron leer los sellos)"""
+        versiones = tuple(version_actual(obtener_conn, nombre) for nombre in self.versiones)
+        if None in versiones:
+            return None
+        return (self.nombre, versiones, parametros.get('desde'), parametros.get('hasta'))
+
+    def resultado(self, obtener_conn, parametros):
+        """Filas del reporte (dicts, no modificarlas), desde la cache mientras no cambien sus sellos"""
+        clave = self._clave(obtener_conn, parametros)
+        if clave is not None:
+            filas = cache_reportes.obtener(clave)
+            if filas is not None:
+                return filas
+
+        cursor = obtener_conn().cursor(dictionary=True)
+        try:
+            cursor.execute(self.sql, self._parametros_consulta(parametros))
+            filas = tuple(cursor.fetchall())
+        finally:
+            cursor.close()
+        if clave is not None:
+            cache_reportes.guardar(clave, filas)
+        return filas
+
+    def exportar(self, obtener_conn, parametros):
+        """
+        Filas para exportar, como tuplas de `columnas`: del resultado en cache
+        si ya está; si no, leyendo la consulta por lotes (sin guardarla).
+        """
+        clave = self._clave(obtener_conn, parametros)
+        filas = cache_reportes.obtener(clave) if clave is not None else None
+        if filas is not None:
+            return (tuple(fila[columna] for columna in self.columnas) for fila in filas)
+        return leer_por_lotes(abrir_consulta(obtener_conn(), self.sql, self._parametros_consulta(parametros)),
+                              self.columnas)
+
+    def _parametros_consulta(self, parametros):
+        return self.preparar(parametros) if self.preparar else parametros
+
+    def calcular_totales(self, filas):
+        return {nombre: float(sum(fila[columna] or 0 for fila in filas)) for nombre, columna in self.totales.items()}
+
+    def argumentos_pdf(self, filas, parametros):
+        """Argumentos de su generar_pdf_reporte_* (después del buffer)"""
+        if self.fechas:
+            return list(filas), parametros['desde'].isoformat(), parametros['hasta'].isoformat()
+        return (list(filas),)
+
+    def nombre_archivo(self, parametros, extension):
+        if self.fechas:
+            return f"{self.archivo}_{parametros['desde']}_{parametros['hasta']}.{extension}"
+        return f"{self.archivo}_{datetime.now().strftime('%Y%m%d')}.{extension}"
+
+    def pagina(self, filas, args):
+        """
+        Una página de las filas en el formato de DataTables (serverSide):
+        draw, recordsTotal, recordsFiltered, data y los totales de las filas
+        filtradas. El filtro y el orden se aplican sobre el resultado en memoria.
+        """
+        draw = args.get('draw', 0, type=int)
+        inicio = max(args.get('start', 0, type=int), 0)
+        cantidad = args.get('length', 25, type=int)
+        if cantidad < 1 or cantidad > Config.LISTADOS_MAX_FILAS:
+            cantidad = Config.LISTADOS_MAX_FILAS
+
+        filtradas = filas
+        buscar = args.get('search[value]', '').strip().lower()
+        if buscar and self.busqueda:
+            palabras = buscar.split()[:5]
+            filtradas = [fila for fila in filas
+                         if all(any(str(fila[columna] or '').lower().startswith(palabra)
+                                    for columna in self.busqueda)
+                                for palabra in palabras)]
+
+        indice = args.get('order[0][column]', type=int)
+        columna = args.get(f'columns[{indice}][data]') if indice is not None else None
+        if columna in self.columnas:
+            descendente = args.get('order[0][dir]', 'asc') == 'desc'
+            # Los valores nulos quedan al principio en orden ascendente, como en MySQL
+            filtradas = sorted(filtradas, key=lambda fila: (fila[columna] is not None, fila[columna]),
+                               reverse=descendente)
+
+        return {
+            'draw': draw,
+            'recordsTotal': len(filas),
+            'recordsFiltered': len(filtradas),
+            'totales': self.calcular_totales(filtradas),
+            'ultima_clave': None,
+            'data': [{nombre: valor_json(fila[nombre]) for nombre in self.columnas}
+                     for fila in filtradas[inicio:inicio + cantidad]],
+        }
+
+
+_COLUMNAS_CLIENTE = ('cliente', 'no_contador', 'nombre_sector')
+_ENCABEZADOS_CLIENTE = ('Cliente', 'Contador', 'Sector')
+
+INGRESOS = Reporte(
+    'ingresos', "Reporte de Ingresos",
+    # Una fila por día y cajero, tal como la mantienen los cobros en
+    # ingreso_diario (ver pagos.py): un período de varios años son unos pocos
+    # cientos de filas por cajero
+    """
+        SELECT i.fecha, i.id_usuario_receptor, CONCAT(u.nombre, ' ', u.apellido) as cajero,
+               i.total, i.cantidad
+        FROM ingreso_diario i
+        JOIN usuario u ON i.id_usuario_receptor = u.id_usuario
+        WHERE i.fecha BETWEEN %(desde)s AND %(hasta)s
+        ORDER BY i.fecha DESC, cajero
+    """,
+    columnas=('fecha', 'cajero', 'cantidad', 'total'),
+    encabezados=('Fecha', 'Cajero', 'Pagos', 'Monto total (Q)'),
+    versiones=('pagos',),
+    busqueda=('cajero',),
+    totales={'cantidad': 'cantidad', 'total': 'total'},
+    archivo='Reporte_Ingresos',
+)
+
+MOROSOS = Reporte(
+    'morosos', "Reporte de Clientes Morosos",
+    """
+        SELECT c.nombre, c.apellido, CONCAT(c.nombre, ' ', c.apellido) as cliente,
+               c.no_contador, s.nombre_sector,
+               COUNT(l.id_lectura) as facturas_pendientes,
+               SUM(l.monto_total) as deuda_total,
+               MIN(l.fecha_lectura) as fecha_mas_antigua
+        FROM cliente c
+        JOIN lectura l ON c.id_cliente = l.id_cliente
+        JOIN sector s ON c.id_sector = s.id_sector
+        WHERE l.estado_pago = 'PENDIENTE'
+        GROUP BY c.id_cliente
+        ORDER BY deuda_total DESC
+    """,
+    columnas=_COLUMNAS_CLIENTE + ('facturas_pendientes', 'deuda_total', 'fecha_mas_antigua'),
+    encabezados=_ENCABEZADOS_CLIENTE + ('Facturas pendientes', 'Deuda total (Q)', 'Factura más antigua'),
+    versiones=('lecturas', 'pagos'),
+    fechas=False,
+    busqueda=('nombre', 'apellido', 'no_contador'),
+    totales={'facturas_pendientes': 'facturas_pendientes', 'deuda_total': 'deuda_total'},
+    archivo='Reporte_Morosos',
+)
+
+CONSUMO = Reporte(
+    'consumo', "Reporte de Consumo de Agua",
+    # Los meses completos del período salen de consumo_mensual (ver
+    # consumo.py); solo los días sueltos de los extremos se leen de lectura
+    """
+        SELECT c.nombre, c.apellido, CONCAT(c.nombre, ' ', c.apellido) as cliente,
+               c.no_contador, s.nombre_sector,
+               SUM(m.consumo_total) / SUM(m.lecturas) as consumo_promedio,
+               MAX(m.consumo_maximo) as consumo_maximo,
+               MIN(m.consumo_minimo) as consumo_minimo
+        FROM (
+            SELECT id_cliente, consumo_total, consumo_minimo, consumo_maximo, lecturas
+            FROM consumo_mensual
+            WHERE mes >= %(mes_desde)s AND mes < %(mes_hasta)s
+            UNION ALL
+            SELECT id_cliente, consumo_m3, consumo_m3, consumo_m3, 1
+            FROM lectura
+            WHERE (fecha_lectura >= %(desde)s AND fecha_lectura < %(mes_desde)s)
+               OR (fecha_lectura >= %(mes_hasta)s AND fecha_lectura <= %(hasta)s)
+        ) m
+        JOIN cliente c ON m.id_cliente = c.id_cliente
+        JOIN sector s ON c.id_sector = s.id_sector
+        GROUP BY c.id_cliente
+        ORDER BY consumo_promedio DESC
+    """,
+    columnas=_COLUMNAS_CLIENTE + ('consumo_promedio', 'consumo_maximo', 'consumo_minimo'),
+    encabezados=_ENCABEZADOS_CLIENTE + ('Consumo promedio (m³)', 'Consumo máximo (m³)', 'Consumo mínimo (m³)'),
+    versiones=('lecturas',),
+    busqueda=('nombre', 'apellido', 'no_contador'),
+    archivo='Reporte_Consumo',
+    preparar=meses_completos,
+)
+
+REPORTES = {reporte.nombre: reporte for reporte in (INGRESOS, MOROSOS, CONSUMO)}
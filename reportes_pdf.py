@@ -0,0 +1,716 @@
+# reportes_pdf.py - Recibos, avisos de cobro y reportes en PDF
+"""
+Documentos PDF de los recibos, avisos y reportes. No dependen de Flask, así
+que también se pueden generar en otros procesos (avisos por lotes, pool de
+renderizado_pdf.py).
+
+En los recibos y avisos, de una página por pago o por factura, las partes
+fijas de cada página (encabezados, líneas, cuadro del monto, firma y línea
+de corte) forman un form XObject de PDF (beginForm/doForm de ReportLab) que
+se dibuja una vez por documento; cada página solo lo referencia y escribe
+encima sus datos. Solo acelera los documentos de varias páginas (avisos por
+lotes, recibos impresos juntos): un recibo suelto dibuja las partes fijas
+una vez igual, y lo que lo evita es la cache de recibos en disco de app.py.
+"""
+
+import threading
+from datetime import date, datetime
+from types import MappingProxyType
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from reportlab.platypus import SimpleDocTemplate, Table, LongTable, TableStyle, Paragraph, Spacer
+
+# Nombre del form -> títulos de las dos copias de la página
+PLANTILLAS = {
+    'PlantillaRecibo': ("COPIA PARA EL CLIENTE", "COPIA PARA EL COMITE"),
+    'PlantillaAviso': ("AVISO DE COBRO - COPIA PARA EL CLIENTE", "AVISO DE COBRO - COPIA PARA EL COMITE"),
+}
+Y_COPIAS = (letter[1] - 80, letter[1] - 395)  # Altura del encabezado de cada copia
+CUADRO_MONTO = (250, 40)  # Ancho y alto del cuadro del monto
+
+
+def _dibujar_partes_fijas(c, titulos):
+    """Partes de la página que no dependen de los datos: las dos copias y la línea de corte"""
+    width = letter[0]
+    rect_width, rect_height = CUADRO_MONTO
+    
+    for y_start, tipo_copia in zip(Y_COPIAS, titulos):
+        # Encabezado
+        c.setFont("Helvetica-Bold", 16)
+        c.drawCentredString(width/2, y_start, "COMITE DE AGUA POTABLE CORINTO S.L")
+        c.setFont("Helvetica", 10)
+        c.drawCentredString(width/2, y_start - 20, f"({tipo_copia})")
+        
+        # Línea separadora
+        c.setLineWidth(1)
+        c.line(50, y_start - 30, width-50, y_start - 30)
+        
+        # Cuadro para el monto
+        c.setLineWidth(2)
+        c.rect((width - rect_width) / 2, y_start - 150, rect_width, rect_height)
+        
+        # Mensaje de pago
+        c.setFont("Helvetica-Oblique", 9)
+        c.drawCentredString(width/2, y_start - 170, "Favor de pagar antes del 5 del siguiente mes.")
+        
+        # Línea para firma
+        c.line(width/2 - 100, y_start - 200, width/2 + 100, y_start - 200)
+        c.setFont("Helvetica", 9)
+        c.drawCentredString(width/2, y_start - 215, "Firma/Sello")
+    
+    # Línea de corte
+    y_corte = Y_COPIAS[0] - 255
+    c.setDash(3, 3)
+    c.line(50, y_corte, width-50, y_corte)
+    c.setDash()
+    c.drawCentredString(width/2, y_corte - 10, "----------- Línea de Corte -----------")
+
+
+def _dibujar_datos(c, y_start, datos, linea_fecha):
+    """Datos de la factura en una copia"""
+    width = letter[0]
+    rect_width, rect_height = CUADRO_MONTO
+    
+    # Información del lado izquierdo
+    c.setFont("Helvetica", 10)
+    c.drawString(50, y_start - 55, linea_fecha)
+    c.drawString(50, y_start - 70, f"No. Contador: {datos['no_contador']}")
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(50, y_start - 85, f"Nombre: {datos['nombre']} {datos['apellido']}")
+    
+    # Información del lado derecho (lecturas)
+    c.setFont("Helvetica", 10)
+    c.drawRightString(width-50, y_start - 65, f"Lectura Anterior: {datos['lectura_anterior']:.2f} m³")
+    c.drawRightString(width-50, y_start - 80, f"Lectura Actual: {datos['lectura_actual']:.2f} m³")
+    c.drawRightString(width-50, y_start - 95, f"CONSUMO: {datos['consumo_m3']:.2f} m³")
+    
+    # Total o crédito dentro del cuadro
+    monto = datos['monto_total']
+    rect_x = (width - rect_width) / 2
+    y_texto = y_start - 150 + rect_height/2 - 5
+    c.setFont("Helvetica-Bold", 14)
+    if monto < 0:
+        texto_monto = "CRÉDITO A FAVOR:"
+        valor_monto = f"Q{abs(monto):.2f}"
+        c.setFillColorRGB(0, 0.5, 0)
+    else:
+        texto_monto = "TOTAL A PAGAR:"
+        valor_monto = f"Q{monto:.2f}"
+    c.drawString(rect_x + 10, y_texto, texto_monto)
+    c.drawRightString(rect_x + rect_width - 10, y_texto, valor_monto)
+    c.setFillColorRGB(0, 0, 0)
+
+
+def _agregar_plantilla(c, nombre):
+    """Define en el documento del canvas, la primera vez, el form `nombre` con las partes fijas"""
+    if c.hasForm(nombre):
+        return
+    c.beginForm(nombre)
+    _dibujar_partes_fijas(c, PLANTILLAS[nombre])
+    c.endForm()
+
+
+def _dibujar_pagina(c, plantilla, datos, linea_fecha, usar_plantilla=True):
+    if usar_plantilla:
+        _agregar_plantilla(c, plantilla)
+        c.doForm(plantilla)
+    else:
+        _dibujar_partes_fijas(c, PLANTILLAS[plantilla])
+    
+    for y_start in Y_COPIAS:
+        _dibujar_datos(c, y_start, datos, linea_fecha)
+    c.showPage()
+
+
+def dibujar_pagina_recibo(c, datos, usar_plantilla=True):
+    """
+    Dibuja una página con las dos copias del recibo de un pago.
+
+    Para imprimir varios recibos se llama una vez por pago sobre el mismo
+    canvas. usar_plantilla=False dibuja también las partes fijas en cada
+    página (solo para comparar en utilidades.py benchmark-recibos).
+    """
+    _dibujar_pagina(c, 'PlantillaRecibo', datos,
+                    f"Fecha Emisión: {datos['fecha_pago'].strftime('%Y-%m-%d')}", usar_plantilla)
+
+
+def dibujar_pagina_aviso(c, datos):
+    """Dibuja una página con las dos copias del aviso de cobro de una factura"""
+    _dibujar_pagina(c, 'PlantillaAviso', datos, f"Fecha Lectura: {datos['fecha_lectura'].strftime('%d/%m/%Y')}")
+
+
+def generar_recibo_pdf(buffer, datos, usar_plantilla=True):
+    """Generar recibo PDF con dos copias"""
+    c = canvas.Canvas(buffer, pagesize=letter)
+    dibujar_pagina_recibo(c, datos, usar_plantilla)
+    c.save()
+
+
+def generar_avisos_pdf(buffer, facturas):
+    """Avisos de cobro de varias facturas en un solo PDF, una página por factura"""
+    c = canvas.Canvas(buffer, pagesize=letter)
+    for datos in facturas:
+        dibujar_pagina_aviso(c, datos)
+    c.save()
+
+
+def generar_recibo_grupo_pdf(buffer, grupo):
+    """Recibo de un cobro de varias facturas: dos copias con el detalle y el total"""
+    c = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    facturas = grupo['facturas']
+    
+    def dibujar_recibo(y_start, tipo_copia):
+        y = y_start
+        
+        # Encabezado
+        c.setFont("Helvetica-Bold", 16)
+        c.drawCentredString(width/2, y, "COMITE DE AGUA POTABLE CORINTO S.L")
+        y -= 20
+        c.setFont("Helvetica", 10)
+        c.drawCentredString(width/2, y, f"({tipo_copia})")
+        y -= 10
+        c.line(50, y, width-50, y)
+        y -= 25
+        
+        # Datos del cliente y del cobro
+        c.setFont("Helvetica", 10)
+        c.drawString(50, y, f"Fecha Emisión: {grupo['fecha_pago'].strftime('%Y-%m-%d')}")
+        c.drawRightString(width-50, y, f"Recibo No. G-{grupo['id_pago_grupo']}")
+        y -= 15
+        c.drawString(50, y, f"No. Contador: {grupo['no_contador']}")
+        c.drawRightString(width-50, y, f"Sector: {grupo['nombre_sector']}")
+        y -= 15
+        c.setFont("Helvetica-Bold", 11)
+        c.drawString(50, y, f"Nombre: {grupo['nombre']} {grupo['apellido']}")
+        y -= 25
+        
+        # Detalle de facturas
+        c.setFont("Helvetica-Bold", 9)
+        columnas = [(60, "Fecha Lectura"), (170, "Lectura Anterior"), (290, "Lectura Actual"), (400, "Consumo")]
+        for x, titulo in columnas:
+            c.drawString(x, y, titulo)
+        c.drawRightString(width-60, y, "Monto")
+        y -= 4
+        c.line(50, y, width-50, y)
+        y -= 12
+        c.setFont("Helvetica", 9)
+        for factura in facturas:
+            c.drawString(60, y, factura['fecha_lectura'].strftime('%d/%m/%Y'))
+            c.drawString(170, y, f"{factura['lectura_anterior']:.2f} m³")
+            c.drawString(290, y, f"{factura['lectura_actual']:.2f} m³")
+            c.drawString(400, y, f"{factura['consumo_m3']:.2f} m³")
+            c.drawRightString(width-60, y, f"Q{factura['monto_pagado']:.2f}")
+            y -= 13
+        y -= 15
+        
+        # Cuadro del total
+        rect_width = 250
+        rect_height = 40
+        rect_x = (width - rect_width) / 2
+        rect_y = y - rect_height + 10
+        c.setLineWidth(2)
+        c.rect(rect_x, rect_y, rect_width, rect_height)
+        c.setLineWidth(1)
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(rect_x + 10, rect_y + rect_height/2 - 5, f"TOTAL PAGADO ({len(facturas)}):")
+        c.drawRightString(rect_x + rect_width - 10, rect_y + rect_height/2 - 5, f"Q{grupo['monto_total']:.2f}")
+        y = rect_y - 30
+        
+        # Línea para firma
+        c.line(width/2 - 100, y, width/2 + 100, y)
+        y -= 15
+        c.setFont("Helvetica", 9)
+        c.drawCentredString(width/2, y, "Firma/Sello")
+        return y
+    
+    # Si la segunda copia no cabe debajo de la primera, va en otra página
+    y_final = dibujar_recibo(height - 80, "COPIA PARA EL CLIENTE")
+    alto_copia = height - 80 - y_final
+    if y_final - 100 - alto_copia >= 36:
+        y_corte = y_final - 40
+        c.setFont("Helvetica", 9)
+        c.setDash(3, 3)
+        c.line(50, y_corte, width-50, y_corte)
+        c.setDash()
+        c.drawCentredString(width/2, y_corte - 10, "----------- Línea de Corte -----------")
+        dibujar_recibo(y_corte - 60, "COPIA PARA EL COMITE")
+    else:
+        c.showPage()
+        dibujar_recibo(height - 80, "COPIA PARA EL COMITE")
+    
+    c.showPage()
+    c.save()
+
+
+# --- Reportes en tabla (ingresos, morosos, consumo, individual) ---
+# Los estilos de párrafo y de tabla se crean una sola vez por proceso y se
+# comparten entre reportes. No se modifican: para variar un estilo se deriva
+# otro con ParagraphStyle(nombre, parent=estilos()['normal'], ...).
+
+VERDE, VERDE_OSCURO, VERDE_CLARO = colors.HexColor('#1a472a'), colors.HexColor('#2d5016'), colors.HexColor('#d4edda')
+ROJO, ROJO_CLARO, AMARILLO = colors.HexColor('#721c24'), colors.HexColor('#f8d7da'), colors.HexColor('#fff3cd')
+AZUL, AZUL_CLARO = colors.HexColor('#004085'), colors.HexColor('#cce5ff')
+
+# Comandos de TableStyle de cada tabla de los reportes
+_ENCABEZADO_TABLA = (
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+)
+_FILA_TOTAL = (
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('TOPPADDING', (0, -1), (-1, -1), 12),
+    ('BOTTOMPADDING', (0, -1), (-1, -1), 12),
+)
+TABLAS = {
+    'ingresos': (
+        ('BACKGROUND', (0, 0), (-1, 0), VERDE_OSCURO),
+        *_ENCABEZADO_TABLA,
+        ('FONTSIZE', (0, 0), (-1, 0), 11),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('TOPPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
+        ('TEXTCOLOR', (0, 1), (-1, -2), colors.black),
+        ('FONTNAME', (0, 1), (-1, -2), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -2), 10),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, colors.HexColor('#f5f5f5')]),
+        ('BACKGROUND', (0, -1), (-1, -1), VERDE_CLARO),
+        ('TEXTCOLOR', (0, -1), (-1, -1), colors.HexColor('#155724')),
+        ('FONTSIZE', (0, -1), (-1, -1), 11),
+        *_FILA_TOTAL,
+    ),
+    'morosos': (
+        ('BACKGROUND', (0, 0), (-1, 0), ROJO),
+        *_ENCABEZADO_TABLA,
+        ('ALIGN', (0, 1), (0, -2), 'LEFT'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('TOPPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -2), AMARILLO),
+        ('TEXTCOLOR', (0, 1), (-1, -2), colors.black),
+        ('FONTNAME', (0, 1), (-1, -2), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -2), 9),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, AMARILLO]),
+        ('BACKGROUND', (0, -1), (-1, -1), ROJO_CLARO),
+        ('TEXTCOLOR', (0, -1), (-1, -1), ROJO),
+        ('FONTSIZE', (0, -1), (-1, -1), 10),
+        *_FILA_TOTAL,
+    ),
+    'consumo': (
+        ('BACKGROUND', (0, 0), (-1, 0), AZUL),
+        *_ENCABEZADO_TABLA,
+        ('ALIGN', (0, 1), (0, -1), 'LEFT'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('TOPPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), AZUL_CLARO),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, AZUL_CLARO]),
+    ),
+    'pendientes': (
+        ('BACKGROUND', (0, 0), (-1, 0), ROJO),
+        *_ENCABEZADO_TABLA,
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BACKGROUND', (0, 1), (-1, -1), AMARILLO),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+    ),
+    'lecturas': (
+        ('BACKGROUND', (0, 0), (-1, 0), AZUL),
+        *_ENCABEZADO_TABLA,
+        ('FONTSIZE', (0, 0), (-1, 0), 9),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ('BACKGROUND', (0, 1), (-1, -1), AZUL_CLARO),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, AZUL_CLARO]),
+    ),
+    'pagos': (
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#155724')),
+        *_ENCABEZADO_TABLA,
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BACKGROUND', (0, 1), (-1, -1), VERDE_CLARO),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, VERDE_CLARO]),
+    ),
+}
+
+FILAS_TABLA_LARGA = 100  # Desde aquí se usa LongTable
+
+_estilos = None
+_tablas = {}
+_estilos_lock = threading.Lock()
+
+
+def _crear_estilos():
+    base = getSampleStyleSheet()
+    
+    def titulo(nombre, color):
+        return ParagraphStyle(nombre, parent=base['Heading1'], fontSize=18, textColor=color,
+                              spaceAfter=30, alignment=TA_CENTER, fontName='Helvetica-Bold')
+    
+    def encabezado(nombre, color, **cambios):
+        return ParagraphStyle(nombre, parent=base['Heading2'], fontSize=12, textColor=color,
+                              spaceAfter=12, fontName='Helvetica-Bold', **cambios)
+    
+    return MappingProxyType({
+        'titulo_verde': titulo('TituloVerde', VERDE),
+        'titulo_rojo': titulo('TituloRojo', ROJO),
+        'titulo_azul': titulo('TituloAzul', AZUL),
+        'encabezado': encabezado('Encabezado', VERDE_OSCURO),
+        'encabezado_rojo': encabezado('EncabezadoRojo', ROJO, alignment=TA_CENTER),
+        'encabezado_azul': encabezado('EncabezadoAzul', AZUL, alignment=TA_CENTER),
+        # Antes se cambiaba styles['Normal'].fontSize; el interlineado sigue siendo el de Normal
+        'normal': ParagraphStyle('Normal10', parent=base['Normal'], fontSize=10),
+        'normal_9': ParagraphStyle('Normal9', parent=base['Normal'], fontSize=9),
+    })
+
+
+def estilos():
+    """Estilos de párrafo de los reportes (solo lectura), creados una vez por proceso"""
+    global _estilos
+    if _estilos is None:
+        with _estilos_lock:
+            if _estilos is None:
+                _estilos = _crear_estilos()
+    return _estilos
+
+
+def estilo_tabla(nombre):
+    """TableStyle de una tabla de TABLAS, creado una vez por proceso"""
+    estilo = _tablas.get(nombre)
+    if estilo is None:
+        estilo = _tablas.setdefault(nombre, TableStyle(TABLAS[nombre]))
+    return estilo
+
+
+def _celda_texto(texto, estilo, ancho):
+    """
+    Celda de texto que se ajusta al ancho de la columna. Un Paragraph es mucho
+    más caro de medir y dibujar que un texto simple, así que solo se usa si el
+    texto no cabe en una línea.
+    """
+    if stringWidth(texto, estilo.fontName, estilo.fontSize) <= ancho - 12:  # Menos el relleno de la celda
+        return texto
+    return Paragraph(escape(texto), estilo)
+
+
+def _tabla(table_data, col_widths, nombre_estilo):
+    """Table con el estilo compartido; las tablas largas usan LongTable, que parte las páginas más rápido"""
+    clase = LongTable if len(table_data) > FILAS_TABLA_LARGA else Table
+    table = clase(table_data, colWidths=col_widths)
+    table.setStyle(estilo_tabla(nombre_estilo))
+    return table
+
+
+def _fecha(valor):
+    return valor.strftime('%d/%m/%Y') if isinstance(valor, date) else str(valor)
+
+
+def _documento(buffer):
+    return SimpleDocTemplate(buffer, pagesize=letter,
+                             rightMargin=72, leftMargin=72,
+                             topMargin=72, bottomMargin=18)
+
+
+def generar_pdf_reporte_ingresos(buffer, datos, fecha_inicio, fecha_fin):
+    """Generar PDF profesional para reporte de ingresos"""
+    doc = _documento(buffer)
+    e = estilos()
+    normal_style = e['normal']
+    
+    # Contenido
+    story = []
+    
+    # Encabezado
+    story.append(Paragraph("COMITÉ DE AGUA POTABLE CORINTO S.L", e['titulo_verde']))
+    story.append(Paragraph("REPORTE DE INGRESOS", e['encabezado']))
+    story.append(Spacer(1, 12))
+    
+    # Información del reporte
+    info_text = f"""
+    <b>Período:</b> {fecha_inicio} al {fecha_fin}<br/>
+    <b>Fecha de Generación:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}<br/>
+    <b>Total de Registros:</b> {len(datos)}
+    """
+    story.append(Paragraph(info_text, normal_style))
+    story.append(Spacer(1, 20))
+    
+    # Calcular totales, también por cajero
+    total_ingresos = sum(registro['total'] for registro in datos)
+    total_pagos = sum(registro['cantidad'] for registro in datos)
+    por_cajero = {}
+    for registro in datos:
+        cajero = por_cajero.setdefault(registro['id_usuario_receptor'], [registro['cajero'], 0, 0])
+        cajero[1] += registro['cantidad']
+        cajero[2] += registro['total']
+    
+    # Resumen por cajero
+    story.append(Paragraph("<b>Ingresos por cajero</b>", normal_style))
+    story.append(Spacer(1, 6))
+    table_data = [['Cajero', 'Pagos', 'Monto (Q)']]
+    table_data.extend([_celda_texto(cajero, normal_style, 3*inch), str(cantidad), f"{total:.2f}"]
+                      for cajero, cantidad, total in sorted(por_cajero.values(), key=lambda fila: -fila[2]))
+    table_data.append([
+        Paragraph('<b>TOTAL INGRESOS</b>', normal_style),
+        Paragraph(f'<b>{total_pagos}</b>', normal_style),
+        Paragraph(f'<b>Q{total_ingresos:.2f}</b>', normal_style)
+    ])
+    story.append(_tabla(table_data, [3*inch, 1*inch, 2*inch], 'ingresos'))
+    story.append(Spacer(1, 20))
+    
+    # Detalle por día y cajero
+    story.append(Paragraph("<b>Detalle por día</b>", normal_style))
+    story.append(Spacer(1, 6))
+    table_data = [['Fecha', 'Cajero', 'Pagos', 'Monto (Q)']]
+    table_data.extend([_fecha(registro['fecha']), _celda_texto(registro['cajero'], normal_style, 2.5*inch),
+                       str(registro['cantidad']), f"{registro['total']:.2f}"] for registro in datos)
+    
+    # Fila de total
+    table_data.append([
+        Paragraph('<b>TOTAL INGRESOS</b>', normal_style),
+        '',
+        Paragraph(f'<b>{total_pagos}</b>', normal_style),
+        Paragraph(f'<b>Q{total_ingresos:.2f}</b>', normal_style)
+    ])
+    
+    # Crear tabla
+    table = _tabla(table_data, [1.5*inch, 2.5*inch, 0.8*inch, 1.2*inch], 'ingresos')
+    
+    story.append(table)
+    story.append(Spacer(1, 20))
+    
+    # Pie de página
+    footer_text = f"<i>Reporte generado el {datetime.now().strftime('%d/%m/%Y a las %H:%M')}</i>"
+    story.append(Paragraph(footer_text, normal_style))
+    
+    # Construir PDF
+    doc.build(story)
+
+
+def generar_pdf_reporte_morosos(buffer, datos):
+    """Generar PDF profesional para reporte de clientes morosos"""
+    doc = _documento(buffer)
+    e = estilos()
+    normal_style = e['normal_9']
+    
+    # Contenido
+    story = []
+    
+    # Encabezado
+    story.append(Paragraph("COMITÉ DE AGUA POTABLE CORINTO S.L", e['titulo_rojo']))
+    story.append(Paragraph("REPORTE DE CLIENTES MOROSOS", e['encabezado_rojo']))
+    story.append(Spacer(1, 12))
+    
+    # Información del reporte
+    total_deuda = sum(registro['deuda_total'] for registro in datos)
+    total_facturas = sum(registro['facturas_pendientes'] for registro in datos)
+    
+    info_text = f"""
+    <b>Fecha de Generación:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}<br/>
+    <b>Total de Clientes Morosos:</b> {len(datos)}<br/>
+    <b>Total de Facturas Pendientes:</b> {total_facturas}<br/>
+    <b>Deuda Total:</b> Q{total_deuda:.2f}
+    """
+    story.append(Paragraph(info_text, normal_style))
+    story.append(Spacer(1, 20))
+    
+    # Tabla de datos
+    col_widths = [2.5*inch, 1*inch, 1.2*inch, 0.8*inch, 1*inch, 1*inch]
+    table_data = [['Cliente', 'Contador', 'Sector', 'Facturas', 'Deuda (Q)', 'Fecha Antigua']]
+    
+    for registro in datos:
+        nombre_completo = f"{registro['nombre']} {registro['apellido']}"
+        # Los nombres largos se ajustan en varias líneas
+        table_data.append([
+            _celda_texto(nombre_completo, normal_style, col_widths[0]),
+            registro['no_contador'],
+            registro['nombre_sector'],
+            str(registro['facturas_pendientes']),
+            f"{registro['deuda_total']:.2f}",
+            _fecha(registro['fecha_mas_antigua'])
+        ])
+    
+    # Fila de total
+    table_data.append([
+        Paragraph('<b>TOTALES</b>', normal_style),
+        '',
+        '',
+        Paragraph(f'<b>{total_facturas}</b>', normal_style),
+        Paragraph(f'<b>Q{total_deuda:.2f}</b>', normal_style),
+        ''
+    ])
+    
+    # Crear tabla con ancho aumentado para la columna de Cliente
+    table = _tabla(table_data, col_widths, 'morosos')
+    
+    story.append(table)
+    story.append(Spacer(1, 20))
+    
+    # Pie de página
+    footer_text = f"<i>Reporte generado el {datetime.now().strftime('%d/%m/%Y a las %H:%M')}</i>"
+    story.append(Paragraph(footer_text, normal_style))
+    
+    # Construir PDF
+    doc.build(story)
+
+
+def generar_pdf_reporte_consumo(buffer, datos, fecha_inicio, fecha_fin):
+    """Generar PDF profesional para reporte de consumo"""
+    doc = _documento(buffer)
+    e = estilos()
+    normal_style = e['normal_9']
+    
+    # Contenido
+    story = []
+    
+    # Encabezado
+    story.append(Paragraph("COMITÉ DE AGUA POTABLE CORINTO S.L", e['titulo_azul']))
+    story.append(Paragraph("REPORTE DE CONSUMO DE AGUA", e['encabezado_azul']))
+    story.append(Spacer(1, 12))
+    
+    # Información del reporte
+    info_text = f"""
+    <b>Período:</b> {fecha_inicio} al {fecha_fin}<br/>
+    <b>Fecha de Generación:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}<br/>
+    <b>Total de Clientes:</b> {len(datos)}
+    """
+    story.append(Paragraph(info_text, normal_style))
+    story.append(Spacer(1, 20))
+    
+    # Tabla de datos
+    table_data = [['Cliente', 'Contador', 'Sector', 'Promedio (m³)', 'Máximo (m³)', 'Mínimo (m³)']]
+    table_data.extend([
+        f"{registro['nombre']} {registro['apellido']}",
+        registro['no_contador'],
+        registro['nombre_sector'],
+        f"{registro['consumo_promedio']:.2f}",
+        f"{registro['consumo_maximo']:.2f}",
+        f"{registro['consumo_minimo']:.2f}"
+    ] for registro in datos)
+    
+    # Crear tabla
+    table = _tabla(table_data, [2*inch, 1*inch, 1.2*inch, 1*inch, 1*inch, 1*inch], 'consumo')
+    
+    story.append(table)
+    story.append(Spacer(1, 20))
+    
+    # Pie de página
+    footer_text = f"<i>Reporte generado el {datetime.now().strftime('%d/%m/%Y a las %H:%M')}</i>"
+    story.append(Paragraph(footer_text, normal_style))
+    
+    # Construir PDF
+    doc.build(story)
+
+
+def generar_pdf_reporte_individual(buffer, cliente, lecturas, pagos, estadisticas, facturas_pendientes):
+    """Generar PDF profesional para reporte individual de cliente"""
+    doc = _documento(buffer)
+    e = estilos()
+    heading_style = e['encabezado']
+    normal_style = e['normal']
+    
+    # Contenido
+    story = []
+    
+    # Encabezado
+    story.append(Paragraph("COMITÉ DE AGUA POTABLE CORINTO S.L", e['titulo_verde']))
+    story.append(Paragraph("REPORTE INDIVIDUAL DE CLIENTE", heading_style))
+    story.append(Spacer(1, 20))
+    
+    # Información del cliente
+    story.append(Paragraph("INFORMACIÓN DEL CLIENTE", heading_style))
+    cliente_text = f"""
+    <b>Nombre:</b> {cliente['nombre']} {cliente['apellido']}<br/>
+    <b>Número de Contador:</b> {cliente['no_contador']}<br/>
+    <b>Sector:</b> {cliente['nombre_sector']}<br/>
+    <b>Teléfono:</b> {cliente.get('telefono', 'No registrado')}<br/>
+    <b>Estado:</b> {'Activo' if cliente.get('activo', True) else 'Inactivo'}
+    """
+    story.append(Paragraph(cliente_text, normal_style))
+    story.append(Spacer(1, 20))
+    
+    # Estadísticas
+    story.append(Paragraph("ESTADÍSTICAS", heading_style))
+    stats_text = f"""
+    <b>Total de Lecturas:</b> {estadisticas['total_lecturas']}<br/>
+    <b>Consumo Promedio:</b> {estadisticas['consumo_promedio']:.2f} m³<br/>
+    <b>Consumo Máximo:</b> {estadisticas['consumo_maximo']:.2f} m³<br/>
+    <b>Consumo Mínimo:</b> {estadisticas['consumo_minimo']:.2f} m³<br/>
+    <b>Total Pagado:</b> Q{estadisticas['total_pagado']:.2f}<br/>
+    <b>Deuda Actual:</b> Q{estadisticas['deuda_total']:.2f}
+    """
+    story.append(Paragraph(stats_text, normal_style))
+    story.append(Spacer(1, 20))
+    
+    # Facturas pendientes
+    if facturas_pendientes:
+        story.append(Paragraph("FACTURAS PENDIENTES", heading_style))
+        table_data = [['Fecha Lectura', 'Consumo (m³)', 'Monto (Q)', 'Días Mora']]
+        
+        for factura in facturas_pendientes:
+            table_data.append([
+                _fecha(factura['fecha_lectura']),
+                f"{factura['consumo_m3']:.2f}",
+                f"{factura['monto_total']:.2f}",
+                str(factura.get('dias_mora', 0))
+            ])
+        
+        table = _tabla(table_data, [2*inch, 1.5*inch, 1.5*inch, 1*inch], 'pendientes')
+        story.append(table)
+        story.append(Spacer(1, 20))
+    
+    # Historial de lecturas
+    if lecturas:
+        story.append(Paragraph("HISTORIAL DE LECTURAS", heading_style))
+        table_data = [['Fecha', 'Lect. Ant.', 'Lect. Act.', 'Consumo (m³)', 'Monto (Q)', 'Estado']]
+        
+        for lectura in lecturas[:20]:  # Limitar a 20 para no hacer el PDF muy largo
+            estado = 'Pagado' if lectura['estado_pago'] == 'PAGADO' else 'Pendiente'
+            table_data.append([
+                _fecha(lectura['fecha_lectura']),
+                f"{lectura['lectura_anterior']:.2f}",
+                f"{lectura['lectura_actual']:.2f}",
+                f"{lectura['consumo_m3']:.2f}",
+                f"{lectura['monto_total']:.2f}",
+                estado
+            ])
+        
+        table = _tabla(table_data, [1*inch, 1*inch, 1*inch, 1*inch, 1*inch, 0.8*inch], 'lecturas')
+        story.append(table)
+        story.append(Spacer(1, 20))
+    
+    # Historial de pagos
+    if pagos:
+        story.append(Paragraph("HISTORIAL DE PAGOS", heading_style))
+        table_data = [['Fecha Pago', 'Período', 'Consumo (m³)', 'Monto (Q)']]
+        
+        for pago in pagos[:20]:  # Limitar a 20
+            table_data.append([
+                _fecha(pago['fecha_pago']),
+                _fecha(pago['fecha_lectura']),
+                f"{pago['consumo_m3']:.2f}",
+                f"{pago['monto_pagado']:.2f}"
+            ])
+        
+        table = _tabla(table_data, [2*inch, 2*inch, 1.5*inch, 1.5*inch], 'pagos')
+        story.append(table)
+    
+    # Pie de página
+    story.append(Spacer(1, 20))
+    footer_text = f"<i>Reporte generado el {datetime.now().strftime('%d/%m/%Y a las %H:%M')}</i>"
+    story.append(Paragraph(footer_text, normal_style))
+    
+    # Construir PDF
+    doc.build(story)
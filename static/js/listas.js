@@ -0,0 +1,54 @@
+// listas.js - Tablas de DataTables paginadas en el servidor (ver listas.py)
+
+function escaparHtml(texto) {
+    return String(texto ?? '').replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+}
+
+function formatoQuetzales(monto) {
+    return 'Q' + Number(monto || 0).toFixed(2);
+}
+
+/**
+ * Crea una tabla serverSide que pide sus páginas a /api/listas/<nombre>.
+ *
+ * opciones: las de DataTables (columns, order, createdRow...) más
+ *   parametros: función que devuelve los filtros extra ({id_sector: ...})
+ *   alRecibir: función llamada con la respuesta completa (totales, etc.)
+ *
+ * Para pedir la página siguiente por clave (sin OFFSET) se recuerda la
+ * última fila de la página anterior junto con el orden y los filtros usados.
+ */
+function crearListado(selector, url, opciones) {
+    const {parametros, alRecibir, ...opcionesTabla} = opciones;
+    let paginaAnterior = null;
+
+    return $(selector).DataTable(Object.assign({
+        language: {
+            url: 'https://cdn.datatables.net/plug-ins/1.13.7/i18n/es-ES.json'
+        },
+        responsive: true,
+        serverSide: true,
+        processing: true,
+        searchDelay: 400,
+        pageLength: 25,
+        lengthMenu: [10, 25, 50, 100],
+        ajax: {
+            url: url,
+            data: function(d) {
+                const extra = parametros ? parametros() : {};
+                Object.assign(d, extra);
+                const firma = JSON.stringify([d.order, d.search, d.length, extra]);
+                if (paginaAnterior && paginaAnterior.clave && paginaAnterior.firma === firma
+                        && d.start === paginaAnterior.inicio + d.length) {
+                    d.despues_de = JSON.stringify(paginaAnterior.clave);
+                }
+                paginaAnterior = {firma: firma, inicio: d.start, clave: null};
+            },
+            dataSrc: function(json) {
+                paginaAnterior.clave = json.ultima_clave;
+                if (alRecibir) alRecibir(json);
+                return json.data;
+            }
+        }
+    }, opcionesTabla));
+}
@@ -0,0 +1,269 @@
+# trabajos.py - Cola de trabajos en segundo plano para exportaciones pesadas
+"""
+Los PDF de reportes y los avisos de cobro pueden tardar muchos segundos; si
+se generan dentro de la petición ocupan un worker de gunicorn (que atiende
+a los cajeros) y a veces superan el tiempo máximo de la plataforma.
+
+- encolar() guarda el trabajo en la tabla `trabajo` (estado PENDIENTE) y la
+  petición responde de inmediato; la página del trabajo consulta su estado.
+- Cada proceso de la aplicación tiene un despachador: un hilo que revisa la
+  tabla cada TRABAJOS_INTERVALO segundos (o al encolar) y ejecuta los
+  trabajos en un pool de TRABAJOS_HILOS hilos. En todo el servidor corren
+  como máximo TRABAJOS_MAX_SIMULTANEOS trabajos a la vez; el reparto se
+  hace con un bloqueo con nombre de MySQL (GET_LOCK).
+- El resultado queda en un archivo de TRABAJOS_DIR hasta expira_en; después
+  el despachador lo borra. Los trabajos EN_CURSO por más de
+  TRABAJOS_TIEMPO_MAX segundos (el proceso murió) se marcan como ERROR.
+
+Cada tipo de trabajo es una función registrada con @tipo_trabajo('nombre')
+que recibe (conn, parametros, ruta), escribe el archivo en `ruta` y
+devuelve (nombre_archivo, mimetype).
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mysql.connector
+
+from config import Config
+from conexion import obtener_conexion
+
+ESTADO_PENDIENTE = 'PENDIENTE'
+ESTADO_EN_CURSO = 'EN_CURSO'
+ESTADO_TERMINADO = 'TERMINADO'
+ESTADO_ERROR = 'ERROR'
+ESTADO_EXPIRADO = 'EXPIRADO'
+
+LIMPIEZA_INTERVALO = 60  # Segundos entre revisiones de archivos expirados y trabajos abandonados
+
+_tipos = {}
+
+
+def tipo_trabajo(nombre):
+    """Registra la función que ejecuta los trabajos de un tipo"""
+    def registrar(funcion):
+        _tipos[nombre] = funcion
+        return funcion
+    return registrar
+
+
+def encolar(conn, tipo, parametros, id_usuario):
+    """Guarda un trabajo pendiente y devuelve su id"""
+    if tipo not in _tipos:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO trabajo (tipo, parametros, estado, id_usuario)
+            VALUES (%s, %s, %s, %s)
+        """, (tipo, json.dumps(parametros, default=str), ESTADO_PENDIENTE, id_usuario))
+        id_trabajo = cursor.lastrowid
+        conn.commit()
+    finally:
+        cursor.close()
+    despachador.despertar()
+    return id_trabajo
+
+
+def obtener_trabajo(conn, id_trabajo):
+    """Datos de un trabajo (None si no existe)"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT id_trabajo, tipo, estado, id_usuario, mensaje, archivo, nombre_archivo, mimetype,
+                   creado_en, iniciado_en, terminado_en, expira_en,
+                   (SELECT COUNT(*) FROM trabajo anterior
+                    WHERE anterior.estado = 'PENDIENTE' AND anterior.id_trabajo < trabajo.id_trabajo) AS en_espera
+            FROM trabajo
+            WHERE id_trabajo = %s
+        """, (id_trabajo,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def ruta_resultado(id_trabajo):
+    return os.path.join(Config.TRABAJOS_DIR, f"trabajo_{id_trabajo}")
+
+
+def _borrar_archivo(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+class Despachador:
+    """Hilo que reparte los trabajos pendientes al pool de hilos del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._evento = threading.Event()
+        self._pid = None
+        self._hilo = None
+        self._ejecutor = None
+        self._ocupados = 0
+        self._limpieza_en = 0
+
+    def iniciar(self):
+        """Arranca el hilo en este proceso si aún no corre (también tras un fork)"""
+        if self._pid == os.getpid() and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._hilo.is_alive():
+                return
+            self._pid = os.getpid()
+            self._ocupados = 0
+            self._ejecutor = ThreadPoolExecutor(max_workers=Config.TRABAJOS_HILOS, thread_name_prefix='trabajo')
+            self._hilo = threading.Thread(target=self._bucle, name='despachador-trabajos', daemon=True)
+            self._hilo.start()
+
+    def despertar(self):
+        """Revisar la tabla ahora en lugar de esperar al siguiente intervalo"""
+        self.iniciar()
+        self._evento.set()
+
+    def _bucle(self):
+        while True:
+            self._evento.wait(Config.TRABAJOS_INTERVALO)
+            self._evento.clear()
+            try:
+                self._revisar()
+            except Exception as err:  # El hilo no debe morir por un error de BD
+                print(f"ERROR despachador de trabajos: {err}")
+
+    def _revisar(self):
+        conn = obtener_conexion()
+        try:
+            if time.monotonic() >= self._limpieza_en:
+                self._limpiar(conn)
+                self._limpieza_en = time.monotonic() + LIMPIEZA_INTERVALO
+            while self._ocupados < Config.TRABAJOS_HILOS:
+                id_trabajo = self._reclamar(conn)
+                if id_trabajo is None:
+                    break
+                with self._lock:
+                    self._ocupados += 1
+                self._ejecutor.submit(self._ejecutar, id_trabajo)
+        finally:
+            conn.close()
+
+    def _reclamar(self, conn):
+        """Marca EN_CURSO el trabajo pendiente más antiguo si hay cupo en el servidor"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT GET_LOCK('trabajos_reclamar', 5)")
+            if cursor.fetchone()[0] != 1:
+                return None
+            try:
+                cursor.execute("SELECT COUNT(*) FROM trabajo WHERE estado = %s", (ESTADO_EN_CURSO,))
+                if cursor.fetchone()[0] >= Config.TRABAJOS_MAX_SIMULTANEOS:
+                    return None
+                cursor.execute("""
+                    SELECT id_trabajo FROM trabajo
+                    WHERE estado = %s
+                    ORDER BY id_trabajo
+                    LIMIT 1
+                """, (ESTADO_PENDIENTE,))
+                fila = cursor.fetchone()
+                if fila is None:
+                    return None
+                cursor.execute("""
+                    UPDATE trabajo SET estado = %s, iniciado_en = NOW()
+                    WHERE id_trabajo = %s AND estado = %s
+                """, (ESTADO_EN_CURSO, fila[0], ESTADO_PENDIENTE))
+                conn.commit()
+                return fila[0]
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK('trabajos_reclamar')")
+                cursor.fetchone()
+        finally:
+            cursor.close()
+
+    def _ejecutar(self, id_trabajo):
+        ruta = ruta_resultado(id_trabajo)
+        conn = None
+        try:
+            conn = obtener_conexion()
+            cursor = conn.cursor()
+            cursor.execute("SELECT tipo, parametros FROM trabajo WHERE id_trabajo = %s", (id_trabajo,))
+            tipo, parametros = cursor.fetchone()
+            cursor.close()
+
+            inicio = time.perf_counter()
+            os.makedirs(Config.TRABAJOS_DIR, exist_ok=True)
+            nombre_archivo, mimetype = _tipos[tipo](conn, json.loads(parametros), ruta)
+            conn.rollback()  # Los trabajos solo leen; termina su transacción de lectura
+
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE trabajo
+                SET estado = %s, archivo = %s, nombre_archivo = %s, mimetype = %s, terminado_en = NOW(),
+                    expira_en = NOW() + INTERVAL %s HOUR
+                WHERE id_trabajo = %s
+            """, (ESTADO_TERMINADO, ruta, nombre_archivo, mimetype, Config.TRABAJOS_EXPIRACION_HORAS, id_trabajo))
+            conn.commit()
+            cursor.close()
+            print(f"DEBUG trabajo {id_trabajo} ({tipo}): {time.perf_counter() - inicio:.1f} s")
+        except Exception as err:
+            print(f"ERROR trabajo {id_trabajo}: {err}")
+            _borrar_archivo(ruta)
+            self._marcar_error(conn, id_trabajo, err)
+        finally:
+            if conn is not None:
+                conn.close()
+            with self._lock:
+                self._ocupados -= 1
+            self._evento.set()  # Puede haber otro trabajo esperando cupo
+
+    @staticmethod
+    def _marcar_error(conn, id_trabajo, err):
+        mensaje = str(err) if isinstance(err, (ValueError, mysql.connector.Error)) else "Error al generar el archivo"
+        try:
+            if conn is None:
+                conn = obtener_conexion()
+            conn.rollback()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE trabajo SET estado = %s, mensaje = %s, terminado_en = NOW()
+                WHERE id_trabajo = %s
+            """, (ESTADO_ERROR, mensaje[:500], id_trabajo))
+            conn.commit()
+            cursor.close()
+        except mysql.connector.Error as err_bd:
+            print(f"ERROR al marcar el trabajo {id_trabajo}: {err_bd}")
+
+    def _limpiar(self, conn):
+        """Borra los resultados expirados y da por fallidos los trabajos abandonados"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT id_trabajo, archivo FROM trabajo
+                WHERE estado = %s AND expira_en < NOW()
+                LIMIT 500
+            """, (ESTADO_TERMINADO,))
+            expirados = cursor.fetchall()
+            for _, archivo in expirados:
+                if archivo:
+                    _borrar_archivo(archivo)
+            if expirados:
+                marcadores = ', '.join(['%s'] * len(expirados))
+                cursor.execute(f"""
+                    UPDATE trabajo SET estado = %s, archivo = NULL
+                    WHERE id_trabajo IN ({marcadores})
+                """, [ESTADO_EXPIRADO] + [id_trabajo for id_trabajo, _ in expirados])
+
+            cursor.execute("""
+                UPDATE trabajo SET estado = %s, mensaje = 'El trabajo se interrumpió; vuelva a solicitarlo',
+                       terminado_en = NOW()
+                WHERE estado = %s AND iniciado_en < NOW() - INTERVAL %s SECOND
+            """, (ESTADO_ERROR, ESTADO_EN_CURSO, Config.TRABAJOS_TIEMPO_MAX))
+            conn.commit()
+        finally:
+            cursor.close()
+
+
+despachador = Despachador()
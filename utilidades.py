@@ -5,19 +5,27 @@ Script de Utilidades para el Sistema de Gestión de Agua
 Permite crear usuarios, generar hashes de contraseñas y otras tareas administrativas
 """
 
+import argparse
+import csv
+import sys
+from datetime import datetime
+
 from werkzeug.security import generate_password_hash, check_password_hash
 import mysql.connector
 from config import Config
+from conexion import obtener_conexion
+from lecturas import reconstruir_ultimas_lecturas, leer_archivo_lecturas, importar_lecturas
+from pagos import reconstruir_ingresos_diarios
+from consumo import reconstruir_consumo_mensual
+from cache import incrementar_version
+from facturacion import cargar_esquemas, simular_tarifa, ESQUEMA_PREDETERMINADO
+from refacturacion import iniciar_refacturacion, ejecutar_refacturacion, refacturacion_en_curso
+from avisos import generar_avisos
 
 def get_db_connection():
     """Conectar a la base de datos"""
     try:
-        conn = mysql.connector.connect(
-            host=Config.DB_HOST,
-            user=Config.DB_USER,
-            password=Config.DB_PASSWORD,
-            database=Config.DB_NAME
-        )
+        conn = obtener_conexion()
         return conn
     except mysql.connector.Error as err:
         print(f"❌ Error al conectar a MySQL: {err}")
@@ -213,6 +221,291 @@ def verificar_conexion():
         cursor.close()
         conn.close()
 
+def reparar_ultimas_lecturas():
+    """Reconstruir el puntero a la última lectura de cada cliente"""
+    print("\n" + "="*60)
+    print("RECONSTRUIR ÚLTIMAS LECTURAS")
+    print("="*60)
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        total = reconstruir_ultimas_lecturas(conn)
+        print(f"\n✅ Última lectura reconstruida para {total} clientes")
+    except mysql.connector.Error as err:
+        print(f"❌ Error: {err}")
+    finally:
+        conn.close()
+
+def reparar_ingresos_diarios(fecha_inicio=None, fecha_fin=None):
+    """Recalcular los ingresos por día y cajero desde la tabla de pagos"""
+    print("\n" + "="*60)
+    print("RECONSTRUIR INGRESOS DIARIOS")
+    print("="*60)
+    
+    if bool(fecha_inicio) != bool(fecha_fin):
+        print("❌ Indique --desde y --hasta, o ninguna de las dos para reconstruir todo")
+        return
+    try:
+        desde = datetime.strptime(fecha_inicio, '%Y-%m-%d').date() if fecha_inicio else None
+        hasta = datetime.strptime(fecha_fin, '%Y-%m-%d').date() if fecha_fin else None
+    except ValueError:
+        print("❌ Las fechas deben tener el formato AAAA-MM-DD")
+        return
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        total = reconstruir_ingresos_diarios(conn, desde, hasta)
+        periodo = f"del {desde} al {hasta}" if desde else "de todo el historial"
+        print(f"\n✅ Ingresos {periodo} reconstruidos: {total} filas (día y cajero)")
+    except mysql.connector.Error as err:
+        print(f"❌ Error: {err}")
+    finally:
+        conn.close()
+
+def reparar_consumo_mensual():
+    """Reconstruir el consumo por mes de cada cliente desde las lecturas"""
+    print("\n" + "="*60)
+    print("RECONSTRUIR CONSUMO MENSUAL")
+    print("="*60)
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        total = reconstruir_consumo_mensual(conn)
+        print(f"\n✅ Consumo mensual reconstruido: {total} filas (cliente y mes)")
+    except mysql.connector.Error as err:
+        print(f"❌ Error: {err}")
+    finally:
+        conn.close()
+
+def importar_lecturas_cli(archivo, id_usuario, solo_validar=False, tamano_lote=None, archivo_errores=None):
+    """Importar lecturas desde un archivo CSV o JSON"""
+    print("\n" + "="*60)
+    print("IMPORTAR LECTURAS")
+    print("="*60)
+    
+    try:
+        with open(archivo, 'rb') as f:
+            filas = leer_archivo_lecturas(f.read(), archivo)
+    except (OSError, ValueError) as err:
+        print(f"❌ No se pudo leer el archivo: {err}")
+        return
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        resultado = importar_lecturas(conn, filas, id_usuario, tamano_lote=tamano_lote, solo_validar=solo_validar)
+    except mysql.connector.Error as err:
+        print(f"❌ Error: {err}")
+        return
+    finally:
+        conn.close()
+    
+    accion = "válidas" if solo_validar else "registradas"
+    print(f"\n✅ {resultado['insertadas']} de {resultado['total']} lecturas {accion} "
+          f"(Q{resultado['monto_total']:.2f}) en {resultado['segundos']} s")
+    
+    errores = resultado['errores']
+    if not errores:
+        return
+    print(f"⚠️  {len(errores)} filas con errores")
+    if archivo_errores:
+        with open(archivo_errores, 'w', newline='', encoding='utf-8') as f:
+            escritor = csv.DictWriter(f, fieldnames=['fila', 'no_contador', 'error'])
+            escritor.writeheader()
+            escritor.writerows(errores)
+        print(f"Detalle guardado en {archivo_errores}")
+    else:
+        for error in errores[:50]:
+            print(f"  Fila {error['fila']:<6} {error['no_contador']:<15} {error['error']}")
+        if len(errores) > 50:
+            print(f"  ... y {len(errores) - 50} más (use --errores ARCHIVO para el detalle completo)")
+
+def listar_tarifas():
+    """Mostrar los esquemas de tarifas activos"""
+    print("\n" + "="*60)
+    print("ESQUEMAS DE TARIFAS")
+    print("="*60)
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        esquemas = cargar_esquemas(conn)
+    except mysql.connector.Error as err:
+        print(f"❌ Error: {err}")
+        return
+    finally:
+        conn.close()
+    
+    if not esquemas:
+        print("\nNo hay esquemas en la BD, se usa la tarifa predeterminada:")
+        print(ESQUEMA_PREDETERMINADO.describir())
+        return
+    for esquema in esquemas:
+        print(f"\n[{esquema.id_esquema}] vigente desde {esquema.vigente_desde:%d/%m/%Y}")
+        print(esquema.describir())
+
+def publicar_tarifas():
+    """Validar los esquemas de tarifas y avisar a los workers que los recarguen"""
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    cursor = conn.cursor()
+    try:
+        esquemas = cargar_esquemas(conn)
+        print(f"\n{len(esquemas)} esquemas válidos")
+        incrementar_version(cursor, 'tarifas')
+        conn.commit()
+        print("✅ Tarifas publicadas: los workers las recargarán en unos segundos")
+    except mysql.connector.Error as err:
+        conn.rollback()
+        print(f"❌ Error: {err}")
+    finally:
+        cursor.close()
+        conn.close()
+
+def simular_tarifa_cli(id_esquema, fecha_inicio=None, fecha_fin=None):
+    """Comparar lo facturado con lo que se facturaría con otro esquema"""
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        esquemas = {esquema.id_esquema: esquema for esquema in cargar_esquemas(conn, solo_activos=False)}
+        esquema = esquemas.get(id_esquema)
+        if esquema is None:
+            print(f"❌ No existe el esquema {id_esquema} (o sus bloques no son válidos)")
+            return
+        print(esquema.describir())
+        resultado = simular_tarifa(conn, esquema, fecha_inicio, fecha_fin)
+    except mysql.connector.Error as err:
+        print(f"❌ Error: {err}")
+        return
+    finally:
+        conn.close()
+    
+    print(f"\n📈 Lecturas: {resultado['lecturas']}")
+    print(f"Facturado:  Q{resultado['monto_actual']:,.2f}")
+    print(f"Simulado:   Q{resultado['monto_simulado']:,.2f}")
+    print(f"Diferencia: Q{resultado['diferencia']:,.2f} ({resultado['cambian']} facturas cambian)")
+
+def refacturar_pendientes(simulacion=False, fecha_tarifa=None, id_refacturacion=None, tamano_lote=None):
+    """Recalcular el monto de las facturas pendientes (reanuda el trabajo en curso si lo hay)"""
+    print("\n" + "="*60)
+    print("REFACTURACIÓN DE PENDIENTES" + (" (SIMULACIÓN)" if simulacion else ""))
+    print("="*60)
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    def mostrar_avance(trabajo):
+        print(f"  ... {trabajo['lecturas_revisadas']} revisadas, {trabajo['lecturas_cambiadas']} cambian "
+              f"(hasta lectura #{trabajo['ultimo_id_lectura']})")
+    
+    try:
+        if id_refacturacion is None:
+            id_refacturacion = refacturacion_en_curso(conn, simulacion)
+            if id_refacturacion is not None:
+                print(f"Reanudando la refacturación #{id_refacturacion}")
+        if id_refacturacion is None:
+            id_refacturacion = iniciar_refacturacion(conn, simulacion, fecha_tarifa)
+            print(f"Refacturación #{id_refacturacion} iniciada")
+        
+        trabajo = ejecutar_refacturacion(conn, id_refacturacion, tamano_lote=tamano_lote, al_avanzar=mostrar_avance)
+    except (mysql.connector.Error, ValueError) as err:
+        print(f"❌ Error: {err}")
+        print("El avance confirmado se conserva; vuelva a ejecutar el comando para continuar.")
+        return
+    finally:
+        conn.close()
+    
+    diferencia = float(trabajo['monto_nuevo']) - float(trabajo['monto_anterior'])
+    print(f"\n✅ Refacturación #{id_refacturacion}: {trabajo['estado']}")
+    print(f"Revisadas: {trabajo['lecturas_revisadas']}")
+    print(f"{'Cambiarían' if simulacion else 'Actualizadas'}: {trabajo['lecturas_cambiadas']}")
+    print(f"Total anterior: Q{float(trabajo['monto_anterior']):,.2f}  nuevo: Q{float(trabajo['monto_nuevo']):,.2f}  "
+          f"diferencia: Q{diferencia:,.2f}")
+    if trabajo['muestra']:
+        print("\nMayores diferencias:")
+        for fila in trabajo['muestra']:
+            print(f"  #{fila['id_lectura']:<8} {fila['no_contador']:<15} Q{fila['monto_anterior']:>10.2f} -> "
+                  f"Q{fila['monto_nuevo']:>10.2f} ({fila['diferencia']:+.2f})")
+
+def generar_avisos_cli(fecha_inicio, fecha_fin, id_sector=None, salida=None):
+    """Generar los avisos de cobro de las lecturas pendientes de un rango"""
+    import shutil
+    import time
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    inicio = time.perf_counter()
+    try:
+        ruta, es_zip, cantidad = generar_avisos(conn, fecha_inicio, fecha_fin, id_sector)
+    except (mysql.connector.Error, ValueError) as err:
+        print(f"❌ Error: {err}")
+        return
+    finally:
+        conn.close()
+    
+    salida = salida or f"Avisos_{fecha_inicio}_{fecha_fin}.{'zip' if es_zip else 'pdf'}"
+    shutil.move(ruta, salida)
+    print(f"✅ {cantidad} avisos en {salida} ({time.perf_counter() - inicio:.1f} s)")
+
+def benchmark_recibos(cantidad=200):
+    """Medir el tiempo por recibo PDF con y sin la plantilla de partes fijas"""
+    import io
+    import time
+    from datetime import datetime
+    from decimal import Decimal
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    from reportes_pdf import generar_recibo_pdf, dibujar_pagina_recibo
+    
+    datos = {
+        'fecha_pago': datetime.now(), 'no_contador': 'CNT-000123', 'nombre': 'Juan', 'apellido': 'Pérez',
+        'lectura_anterior': Decimal('1520.00'), 'lectura_actual': Decimal('1547.50'),
+        'consumo_m3': Decimal('27.50'), 'monto_total': Decimal('68.75'),
+    }
+    
+    def un_recibo_por_pdf(usar_plantilla):
+        for _ in range(cantidad):
+            generar_recibo_pdf(io.BytesIO(), datos, usar_plantilla)
+    
+    def lote_en_un_pdf(usar_plantilla):
+        c = canvas.Canvas(io.BytesIO(), pagesize=letter)
+        for _ in range(cantidad):
+            dibujar_pagina_recibo(c, datos, usar_plantilla)
+        c.save()
+    
+    print("\n" + "="*60)
+    print(f"BENCHMARK DE RECIBOS ({cantidad} recibos)")
+    print("="*60)
+    print(f"{'':<22}{'Sin plantilla':>16}{'Con plantilla':>16}")
+    generar_recibo_pdf(io.BytesIO(), datos)  # Carga fuentes y módulos antes de medir
+    for titulo, prueba in (("Un recibo por PDF", un_recibo_por_pdf), ("Lote en un solo PDF", lote_en_un_pdf)):
+        tiempos = []
+        for usar_plantilla in (False, True):
+            inicio = time.perf_counter()
+            prueba(usar_plantilla)
+            tiempos.append((time.perf_counter() - inicio) / cantidad * 1000)
+        print(f"{titulo:<22}{tiempos[0]:>13.3f} ms{tiempos[1]:>13.3f} ms")
+
 def menu_principal():
     """Menú principal del script de utilidades"""
     while True:
@@ -224,6 +517,9 @@ def menu_principal():
         print("3. Cambiar contraseña")
         print("4. Generar hash de contraseña")
         print("5. Verificar conexión a base de datos")
+        print("6. Reconstruir últimas lecturas de clientes")
+        print("7. Reconstruir ingresos diarios")
+        print("8. Reconstruir consumo mensual")
         print("0. Salir")
         
         opcion = input("\nSeleccione una opción: ").strip()
@@ -238,6 +534,12 @@ def menu_principal():
             generar_hash()
         elif opcion == '5':
             verificar_conexion()
+        elif opcion == '6':
+            reparar_ultimas_lecturas()
+        elif opcion == '7':
+            reparar_ingresos_diarios()
+        elif opcion == '8':
+            reparar_consumo_mensual()
         elif opcion == '0':
             print("\n👋 ¡Hasta luego!")
             break
@@ -246,9 +548,85 @@ def menu_principal():
         
         input("\nPresione Enter para continuar...")
 
+def ejecutar_comando(argumentos):
+    """Ejecutar una tarea sin el menú interactivo: python utilidades.py <comando> [opciones]"""
+    parser = argparse.ArgumentParser(
+        prog='utilidades.py',
+        description='Utilidades del Sistema de Gestión de Agua (sin argumentos abre el menú interactivo)'
+    )
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    
+    sub = subparsers.add_parser('verificar-conexion', help='Verificar conexión a la base de datos')
+    sub.set_defaults(funcion=lambda args: verificar_conexion())
+    
+    sub = subparsers.add_parser('reconstruir-ultimas-lecturas',
+                                help='Reconstruir la última lectura de cada cliente desde el historial')
+    sub.set_defaults(funcion=lambda args: reparar_ultimas_lecturas())
+    
+    sub = subparsers.add_parser('reconstruir-ingresos',
+                                help='Recalcular los ingresos por día y cajero desde la tabla de pagos')
+    sub.add_argument('--desde', help='Primer día a recalcular (AAAA-MM-DD); sin fechas se recalcula todo')
+    sub.add_argument('--hasta', help='Último día a recalcular (AAAA-MM-DD)')
+    sub.set_defaults(funcion=lambda args: reparar_ingresos_diarios(args.desde, args.hasta))
+    
+    sub = subparsers.add_parser('reconstruir-consumo',
+                                help='Recalcular el consumo por mes de cada cliente desde las lecturas')
+    sub.set_defaults(funcion=lambda args: reparar_consumo_mensual())
+    
+    sub = subparsers.add_parser('importar-lecturas', help='Importar lecturas desde un archivo CSV o JSON')
+    sub.add_argument('archivo', help='Archivo con columnas no_contador, fecha_lectura, lectura_actual')
+    sub.add_argument('--usuario', type=int, required=True, help='id_usuario que se registra como lector')
+    sub.add_argument('--solo-validar', action='store_true', help='Validar sin guardar')
+    sub.add_argument('--lote', type=int, default=None, help='Filas por transacción')
+    sub.add_argument('--errores', metavar='ARCHIVO', help='Guardar el detalle de errores en un CSV')
+    sub.set_defaults(funcion=lambda args: importar_lecturas_cli(
+        args.archivo, args.usuario, args.solo_validar, args.lote, args.errores))
+    
+    sub = subparsers.add_parser('tarifas', help='Mostrar los esquemas de tarifas activos')
+    sub.set_defaults(funcion=lambda args: listar_tarifas())
+    
+    sub = subparsers.add_parser('publicar-tarifas',
+                                help='Validar los esquemas de tarifas y hacer que la aplicación los recargue')
+    sub.set_defaults(funcion=lambda args: publicar_tarifas())
+    
+    sub = subparsers.add_parser('simular-tarifa',
+                                help='Comparar lo facturado con lo que daría otro esquema de tarifas')
+    sub.add_argument('--esquema', type=int, required=True, help='id_esquema a simular (puede estar inactivo)')
+    sub.add_argument('--desde', help='Fecha inicial de lectura (AAAA-MM-DD)')
+    sub.add_argument('--hasta', help='Fecha final de lectura (AAAA-MM-DD)')
+    sub.set_defaults(funcion=lambda args: simular_tarifa_cli(args.esquema, args.desde, args.hasta))
+    
+    sub = subparsers.add_parser('refacturar',
+                                help='Recalcular las facturas pendientes con las tarifas vigentes (reanudable)')
+    sub.add_argument('--simular', action='store_true', help='Solo mostrar las diferencias, sin modificar facturas')
+    sub.add_argument('--fecha-tarifa', help='Aplicar la tarifa vigente en esta fecha (AAAA-MM-DD) a todas')
+    sub.add_argument('--reanudar', type=int, metavar='ID', help='Continuar una refacturación específica')
+    sub.add_argument('--lote', type=int, default=None, help='Facturas por transacción')
+    sub.set_defaults(funcion=lambda args: refacturar_pendientes(
+        args.simular, args.fecha_tarifa, args.reanudar, args.lote))
+    
+    sub = subparsers.add_parser('avisos', help='Generar los avisos de cobro de las lecturas pendientes')
+    sub.add_argument('--desde', required=True, help='Fecha inicial de lectura (AAAA-MM-DD)')
+    sub.add_argument('--hasta', required=True, help='Fecha final de lectura (AAAA-MM-DD)')
+    sub.add_argument('--sector', type=int, help='Solo este id_sector')
+    sub.add_argument('--salida', metavar='ARCHIVO', help='Archivo PDF o ZIP a crear')
+    sub.set_defaults(funcion=lambda args: generar_avisos_cli(
+        args.desde, args.hasta, args.sector, args.salida))
+    
+    sub = subparsers.add_parser('benchmark-recibos',
+                                help='Medir el tiempo por recibo PDF con y sin la plantilla de partes fijas')
+    sub.add_argument('--cantidad', type=int, default=200, help='Recibos a generar en cada prueba')
+    sub.set_defaults(funcion=lambda args: benchmark_recibos(args.cantidad))
+    
+    args = parser.parse_args(argumentos)
+    args.funcion(args)
+
 if __name__ == '__main__':
     try:
-        menu_principal()
+        if len(sys.argv) > 1:
+            ejecutar_comando(sys.argv[1:])
+        else:
+            menu_principal()
     except KeyboardInterrupt:
         print("\n\n👋 ¡Hasta luego!")
     except Exception as e: